@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+
+"""FTDI adapter identification and per-adapter result cache."""
+
+from json import dump, load
+from os import environ, makedirs, replace
+from os.path import dirname, expanduser, isfile, join as joinpath
+from pyftdi.ftdi import Ftdi
+from pyftdi.usbtools import UsbTools
+
+
+CACHE_DIR_NAME = 'pyftdi-example'
+
+
+def adapter_serial(ftdi: Ftdi) -> str:
+    """Return a stable identifier for the adapter behind an open Ftdi.
+
+       The USB serial number is used when the EEPROM provides one, otherwise
+       the identifier falls back to the USB bus/address location, which is
+       only stable until the adapter is replugged.
+
+       :param ftdi: a connected Ftdi instance
+       :return: identifier string
+    """
+    dev = ftdi.usb_dev
+    serial = None
+    if dev.iSerialNumber:
+        try:
+            serial = UsbTools.get_string(dev, dev.iSerialNumber)
+        except (ValueError, IOError):
+            serial = None
+    if serial:
+        return f'{ftdi.ic_name}:{serial}'
+    return f'{ftdi.ic_name}@{dev.bus}:{dev.address}'
+
+
+def cache_path(name: str) -> str:
+    """Return the path of a named JSON cache file.
+
+       :param name: cache name, without extension
+       :return: absolute path, under $XDG_CACHE_HOME or ~/.cache
+    """
+    root = environ.get('XDG_CACHE_HOME') or expanduser('~/.cache')
+    return joinpath(root, CACHE_DIR_NAME, f'{name}.json')
+
+
+def load_cache(name: str) -> dict:
+    """Load a named JSON cache.
+
+       :param name: cache name
+       :return: cached dictionary, empty if missing or unreadable
+    """
+    path = cache_path(name)
+    if not isfile(path):
+        return {}
+    try:
+        with open(path, 'rt') as cfp:
+            data = load(cfp)
+    except (OSError, ValueError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+
+def save_cache(name: str, data: dict) -> None:
+    """Atomically store a named JSON cache.
+
+       :param name: cache name
+       :param data: dictionary to store
+    """
+    path = cache_path(name)
+    makedirs(dirname(path), exist_ok=True)
+    tmp = f'{path}.tmp'
+    with open(tmp, 'wt') as cfp:
+        dump(data, cfp, indent=2, sort_keys=True)
+    replace(tmp, path)
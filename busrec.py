@@ -0,0 +1,631 @@
+#!/usr/bin/env python3
+
+"""I2C/GPIO bus traffic recorder and replayer.
+
+   A recording is a compact binary log of every I2C and GPIO transaction
+   issued through wrapped pyftdi ports. It can be replayed against an
+   in-memory PMBus device stand-in, either at full speed or with the
+   original timing, to reproduce field sequences and for load testing.
+"""
+
+#pylint: disable-msg=broad-except
+
+import struct
+from argparse import ArgumentParser
+from collections import deque, namedtuple
+from sys import modules, stderr
+from time import perf_counter, perf_counter_ns, sleep, time
+from traceback import format_exc
+from typing import (BinaryIO, Callable, Dict, Iterable, Iterator, Optional,
+                    Sequence)
+from pyftdi.i2c import I2cIOError, I2cNackError
+
+
+Record = namedtuple('Record', 'time op address flags out data')
+"""A recorded transaction; time is in seconds from the recording start."""
+
+
+class BusRecorder:
+    """Record I2C and GPIO transactions into a binary file.
+
+       File layout: a header (magic, version, start epoch) followed by
+       records. Each record is a fixed 8-byte header, the delay since the
+       previous record in microseconds (u32), the operation and flags (u8),
+       the slave address (u8) and the payload length (u16), then the
+       payload. Exchange payloads are prefixed with the length of the
+       written part (u16). Delays that do not fit in a record are carried
+       by payload-less idle records. The GPIO direction is recorded when a
+       GPIO port is wrapped and whenever it changes, so that GPIO reads can
+       be replayed with their output pins masked.
+
+       Records are accumulated in memory and written out in large blocks,
+       so that recording adds little to the cost of a transaction.
+    """
+
+    MAGIC = b'BREC'
+    VERSION = 2
+    HEADER = struct.Struct('<4sBxxxd')
+    RECORD = struct.Struct('<IBBH')
+    DELAY_MAX = 0xffffffff
+    PAYLOAD_MAX = 0xffff
+
+    OP_IDLE = 0
+    OP_WRITE = 1
+    OP_READ = 2
+    OP_EXCHANGE = 3
+    OP_GPIO_READ = 4
+    OP_GPIO_WRITE = 5
+    OP_GPIO_DIRECTION = 6
+    OP_MASK = 0x0f
+
+    FLAG_RELAX = 0x10
+    FLAG_WITH_OUTPUT = 0x10
+    """GPIO reads only: output pins are not masked."""
+    FLAG_START = 0x20
+    FLAG_ERROR = 0x40
+    FLAG_NACK = 0x80
+
+    GPIO_ADDRESS = 0xff
+    GPIO = struct.Struct('<H')
+    EXCHANGE = struct.Struct('<H')
+
+    FLUSH_SIZE = 1 << 16
+
+    def __init__(self, path: str):
+        self._fp = open(path, 'wb')
+        self._buffer = bytearray(self.HEADER.pack(self.MAGIC, self.VERSION,
+                                                  time()))
+        self._last = perf_counter_ns()
+
+    def __enter__(self) -> 'BusRecorder':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def port(self, port) -> 'RecordingI2cPort':
+        """Wrap an I2C port so that its transactions are recorded.
+
+           :param port: pyftdi I2cPort (or compatible)
+           :return: recording port
+        """
+        return RecordingI2cPort(port, self)
+
+    def gpio(self, gpio) -> 'RecordingGpioPort':
+        """Wrap a GPIO port so that its accesses are recorded.
+
+           :param gpio: pyftdi I2cGpioPort (or compatible)
+           :return: recording GPIO port
+        """
+        return RecordingGpioPort(gpio, self)
+
+    def record(self, op: int, address: int, payload: bytes = b'') -> None:
+        """Append a record.
+
+           :param op: operation and flags
+           :param address: slave address, or GPIO_ADDRESS
+           :param payload: operation payload
+        """
+        if len(payload) > self.PAYLOAD_MAX:
+            raise ValueError('Transaction too large to be recorded')
+        now = perf_counter_ns()
+        delta = (now - self._last) // 1000
+        # only advance by the recorded amount, so rounding does not drift
+        self._last += delta * 1000
+        while delta > self.DELAY_MAX:
+            self._buffer.extend(self.RECORD.pack(self.DELAY_MAX, self.OP_IDLE,
+                                                 0, 0))
+            delta -= self.DELAY_MAX
+        self._buffer.extend(self.RECORD.pack(delta, op, address,
+                                             len(payload)))
+        self._buffer.extend(payload)
+        if len(self._buffer) >= self.FLUSH_SIZE:
+            self.flush()
+
+    def record_batch(self, operations: Sequence[tuple],
+                     data: Dict[int, bytes], nacks: Iterable[int] = (),
+                     skipped: Iterable[int] = ()) -> None:
+        """Append the records of an executed I2C batch.
+
+           Batches bypass the wrapped ports, see i2cbatch.py. Their steps
+           are recorded once the batch has run, as complete transactions,
+           all timed at its completion; delays are not recorded.
+
+           :param operations: bus operation of each step, see
+                              I2cBatch.operations
+           :param data: read data, by step
+           :param nacks: steps that were not acknowledged
+           :param skipped: steps that were not executed
+        """
+        nacks = set(nacks)
+        skipped = set(skipped)
+        relax_start = self.FLAG_RELAX | self.FLAG_START
+        for step, (kind, *args) in enumerate(operations):
+            if step in skipped:
+                continue
+            flags = self.FLAG_NACK if step in nacks else 0
+            rdata = bytes(data.get(step, b'')) if not flags else b''
+            if kind == 'gpio':
+                self.record(self.OP_GPIO_WRITE, self.GPIO_ADDRESS,
+                            self.GPIO.pack(args[0]))
+            elif kind == 'write':
+                self.record(self.OP_WRITE | relax_start | flags, args[0],
+                            args[1])
+            elif kind == 'read':
+                self.record(self.OP_READ | relax_start | flags, args[0],
+                            rdata)
+            elif kind == 'exchange':
+                self.record(self.OP_EXCHANGE | relax_start | flags, args[0],
+                            self.EXCHANGE.pack(len(args[1])) + args[1] +
+                            rdata)
+
+    def flush(self) -> None:
+        """Write pending records to the file."""
+        if self._fp and self._buffer:
+            self._fp.write(self._buffer)
+            self._buffer = bytearray()
+
+    def close(self) -> None:
+        """Flush and close the recording."""
+        if self._fp:
+            self.flush()
+            self._fp.close()
+            self._fp = None
+
+    @classmethod
+    def load(cls, stream: BinaryIO) -> Iterator[Record]:
+        """Decode a recording.
+
+           :param stream: binary input stream
+           :return: iterator on the recorded transactions
+        """
+        header = stream.read(cls.HEADER.size)
+        if len(header) != cls.HEADER.size:
+            raise ValueError('Truncated recording')
+        magic, version, _ = cls.HEADER.unpack(header)
+        if magic != cls.MAGIC or not 1 <= version <= cls.VERSION:
+            raise ValueError('Not a bus recording')
+        # version 1 prefixed exchange payloads with a single length byte
+        prefix = 1 if version == 1 else cls.EXCHANGE.size
+        data = memoryview(stream.read())
+        offset = 0
+        elapsed = 0
+        size = cls.RECORD.size
+        while offset + size <= len(data):
+            delta, op, address, length = cls.RECORD.unpack_from(data, offset)
+            offset += size
+            payload = bytes(data[offset:offset+length])
+            offset += length
+            elapsed += delta
+            if op == cls.OP_IDLE:
+                continue
+            if op & cls.OP_MASK == cls.OP_EXCHANGE and payload:
+                outlen = int.from_bytes(payload[:prefix], 'little')
+                out = payload[prefix:prefix+outlen]
+                rdata = payload[prefix+outlen:]
+            elif op & cls.OP_MASK in (cls.OP_READ, cls.OP_GPIO_READ):
+                out, rdata = b'', payload
+            else:
+                out, rdata = payload, b''
+            yield Record(elapsed / 1E6, op & cls.OP_MASK, address,
+                         op & ~cls.OP_MASK, out, rdata)
+
+
+class RecordingI2cPort:
+    """I2C port proxy recording all transactions.
+
+       NACKed or failed transactions are recorded with the matching flag,
+       then the exception is re-raised.
+    """
+
+    def __init__(self, port, recorder: BusRecorder):
+        self._port = port
+        self._recorder = recorder
+        self._address = port.address
+
+    def __getattr__(self, name):
+        return getattr(self._port, name)
+
+    def write(self, out, relax: bool = True, start: bool = True) -> None:
+        out = bytes(out)
+        self._check_size(len(out))
+        flags = self._flags(BusRecorder.OP_WRITE, relax, start)
+        try:
+            self._port.write(out, relax=relax, start=start)
+        except I2cNackError:
+            flags |= BusRecorder.FLAG_NACK
+            raise
+        except I2cIOError:
+            flags |= BusRecorder.FLAG_ERROR
+            raise
+        finally:
+            self._recorder.record(flags, self._address, out)
+
+    def read(self, readlen: int = 0, relax: bool = True,
+             start: bool = True) -> bytes:
+        self._check_size(readlen)
+        flags = self._flags(BusRecorder.OP_READ, relax, start)
+        data = b''
+        try:
+            data = self._port.read(readlen, relax=relax, start=start)
+            return data
+        except I2cNackError:
+            flags |= BusRecorder.FLAG_NACK
+            raise
+        except I2cIOError:
+            flags |= BusRecorder.FLAG_ERROR
+            raise
+        finally:
+            self._recorder.record(flags, self._address, bytes(data))
+
+    def exchange(self, out=b'', readlen: int = 0, relax: bool = True,
+                 start: bool = True) -> bytes:
+        out = bytes(out)
+        self._check_size(BusRecorder.EXCHANGE.size + len(out) + readlen)
+        flags = self._flags(BusRecorder.OP_EXCHANGE, relax, start)
+        data = b''
+        try:
+            data = self._port.exchange(out, readlen, relax=relax,
+                                       start=start)
+            return data
+        except I2cNackError:
+            flags |= BusRecorder.FLAG_NACK
+            raise
+        except I2cIOError:
+            flags |= BusRecorder.FLAG_ERROR
+            raise
+        finally:
+            self._recorder.record(flags, self._address,
+                                  BusRecorder.EXCHANGE.pack(len(out)) + out +
+                                  bytes(data))
+
+    @staticmethod
+    def _check_size(size: int) -> None:
+        # fail before the transaction, not while recording its outcome
+        if size > BusRecorder.PAYLOAD_MAX:
+            raise ValueError(f'Transaction of {size} bytes too large to be '
+                             f'recorded')
+
+    @staticmethod
+    def _flags(op: int, relax: bool, start: bool) -> int:
+        if relax:
+            op |= BusRecorder.FLAG_RELAX
+        if start:
+            op |= BusRecorder.FLAG_START
+        return op
+
+
+class RecordingGpioPort:
+    """GPIO port proxy recording all accesses."""
+
+    def __init__(self, gpio, recorder: BusRecorder):
+        self._gpio = gpio
+        self._recorder = recorder
+        self._record_direction()
+
+    def __getattr__(self, name):
+        return getattr(self._gpio, name)
+
+    def read(self, with_output: bool = False) -> int:
+        value = self._gpio.read(with_output)
+        op = BusRecorder.OP_GPIO_READ
+        if with_output:
+            op |= BusRecorder.FLAG_WITH_OUTPUT
+        self._recorder.record(op, BusRecorder.GPIO_ADDRESS,
+                              BusRecorder.GPIO.pack(value))
+        return value
+
+    def set_direction(self, pins: int, direction: int) -> None:
+        self._gpio.set_direction(pins, direction)
+        self._record_direction()
+
+    def _record_direction(self) -> None:
+        direction = getattr(self._gpio, 'direction', None)
+        if direction is not None:
+            self._recorder.record(BusRecorder.OP_GPIO_DIRECTION,
+                                  BusRecorder.GPIO_ADDRESS,
+                                  BusRecorder.GPIO.pack(direction))
+
+    def write(self, value: int) -> None:
+        self._gpio.write(value)
+        self._recorder.record(BusRecorder.OP_GPIO_WRITE,
+                              BusRecorder.GPIO_ADDRESS,
+                              BusRecorder.GPIO.pack(value))
+
+
+class MemoryPmbusDevice:
+    """In-memory stand-in for a PMBus slave.
+
+       Registers are kept per page (the PAGE register itself is global).
+       A write of a command code followed by data updates the register.
+       A read returns the next primed value of the register, in priming
+       order, then the last written or read value, padded with 0xff.
+    """
+
+    PAGE = 0x00
+
+    def __init__(self, address: int):
+        self.address = address
+        self.page = 0
+        self.registers: Dict[tuple, bytes] = {}
+        self.primed: Dict[tuple, deque] = {}
+        self.pointer = None
+        """Command code selected by the last write."""
+
+    def prime(self, command: int, data: bytes, page: Optional[int] = None) \
+            -> None:
+        """Queue a value for a later read of a register."""
+        self.primed.setdefault((self.page if page is None else page,
+                                command), deque()).append(bytes(data))
+
+    def write(self, out, relax: bool = True, start: bool = True) -> None:
+        out = bytes(out)
+        if not out:
+            return
+        if start:
+            self.pointer = out[0]
+            out = out[1:]
+        elif self.pointer is None:
+            raise I2cIOError('Write continuation without command')
+        if not out:
+            return
+        if self.pointer == self.PAGE:
+            self.page = out[0]
+        else:
+            self.registers[(self.page, self.pointer)] = out
+
+    def read(self, readlen: int = 0, relax: bool = True,
+             start: bool = True) -> bytes:
+        if not readlen:
+            return b''
+        key = (self.page, self.pointer)
+        primed = self.primed.get(key)
+        if primed:
+            self.registers[key] = primed.popleft()
+        data = self.registers.get(key, b'')
+        if self.pointer == self.PAGE:
+            data = bytes((self.page,))
+        return (data + b'\xff' * readlen)[:readlen]
+
+    def exchange(self, out=b'', readlen: int = 0, relax: bool = True,
+                 start: bool = True) -> bytes:
+        self.write(out, relax=False, start=start)
+        return self.read(readlen)
+
+
+class AbsentDevice:
+    """Stand-in for an address no device acknowledges."""
+
+    def __init__(self, address: int):
+        self.address = address
+
+    def _nack(self, *_, **__):
+        raise I2cNackError('NACK from slave')
+
+    write = read = exchange = _nack
+
+
+class MemoryGpio:
+    """In-memory stand-in for a GPIO port.
+
+       As with pyftdi, reads mask the output pins unless asked otherwise.
+       The default direction is the UCD92xx one, where all GPIOs are
+       outputs.
+    """
+
+    DIRECTION = 0xff78
+
+    def __init__(self, value: int = 0, direction: int = DIRECTION):
+        self.value = value
+        self.direction = direction
+
+    def read(self, with_output: bool = False) -> int:
+        if with_output:
+            return self.value
+        return self.value & ~self.direction
+
+    def write(self, value: int) -> None:
+        # input pins keep their level
+        self.value = (self.value & ~self.direction) | \
+            (value & self.direction)
+
+    def set_direction(self, pins: int, direction: int) -> None:
+        self.direction = (self.direction & ~pins) | (direction & pins)
+
+
+class BusReplayer:
+    """Replay a recording against I2C port stand-ins.
+
+       By default every address that acknowledged in the recording is
+       served by a MemoryPmbusDevice primed with the values read from each
+       register, served back in the recorded order, so that polled
+       telemetry replays as recorded, and other addresses NACK. Any port-compatible target,
+       including a real I2cPort, can be substituted with port_factory.
+
+       Each replayed read is compared with the recorded data, and NACK
+       status with the recorded one; differences are reported as
+       mismatches.
+    """
+
+    def __init__(self, records: Iterable[Record],
+                 port_factory: Optional[Callable[[int], object]] = None,
+                 gpio=None):
+        self._records = list(records)
+        self._ports = {}
+        self._factory = port_factory or self._standin
+        self.gpio = gpio or MemoryGpio()
+        if not port_factory:
+            self._prime()
+
+    @classmethod
+    def from_file(cls, path: str, **kwargs) -> 'BusReplayer':
+        """Load a recording file for replay."""
+        with open(path, 'rb') as rfp:
+            return cls(BusRecorder.load(rfp), **kwargs)
+
+    def port(self, address: int):
+        """Return the replay target for a slave address."""
+        if address not in self._ports:
+            self._ports[address] = self._factory(address)
+        return self._ports[address]
+
+    def replay(self, realtime: bool = False, speed: float = 1.0) -> dict:
+        """Replay all transactions.
+
+           :param realtime: reproduce the recorded inter-transaction delays
+           :param speed: time scale factor in realtime mode
+           :return: statistics: transaction count, NACK count, elapsed time,
+                    transaction rate and the list of mismatches as
+                    (record index, expected, got) tuples
+        """
+        mismatches = []
+        nacks = 0
+        start = perf_counter()
+        for index, rec in enumerate(self._records):
+            if realtime:
+                delay = start + rec.time / speed - perf_counter()
+                if delay > 0:
+                    sleep(delay)
+            try:
+                data = self._execute(rec)
+                nacked = False
+            except I2cNackError:
+                data = b''
+                nacked = True
+                nacks += 1
+            expect_nack = bool(rec.flags & BusRecorder.FLAG_NACK)
+            if nacked != expect_nack:
+                mismatches.append((index, 'NACK' if expect_nack else 'ACK',
+                                   'NACK' if nacked else 'ACK'))
+            elif rec.data and bytes(data) != rec.data:
+                mismatches.append((index, rec.data, bytes(data)))
+        elapsed = perf_counter() - start
+        return {'transactions': len(self._records),
+                'nacks': nacks,
+                'elapsed': elapsed,
+                'rate': len(self._records) / elapsed if elapsed else 0.0,
+                'mismatches': mismatches}
+
+    def _execute(self, rec: Record):
+        relax = bool(rec.flags & BusRecorder.FLAG_RELAX)
+        start = bool(rec.flags & BusRecorder.FLAG_START)
+        if rec.op == BusRecorder.OP_GPIO_READ:
+            with_output = bool(rec.flags & BusRecorder.FLAG_WITH_OUTPUT)
+            return BusRecorder.GPIO.pack(self.gpio.read(with_output))
+        if rec.op == BusRecorder.OP_GPIO_DIRECTION:
+            direction = BusRecorder.GPIO.unpack(rec.out)[0]
+            # only stand-ins follow the recorded direction, a real port
+            # is configured by its owner
+            if isinstance(self.gpio, MemoryGpio):
+                self.gpio.direction = direction
+            return b''
+        if rec.op == BusRecorder.OP_GPIO_WRITE:
+            self.gpio.write(BusRecorder.GPIO.unpack(rec.out)[0])
+            return b''
+        port = self.port(rec.address)
+        if rec.op == BusRecorder.OP_WRITE:
+            port.write(rec.out, relax=relax, start=start)
+            return b''
+        if rec.op == BusRecorder.OP_READ:
+            return port.read(len(rec.data), relax=relax, start=start)
+        return port.exchange(rec.out, len(rec.data), relax=relax,
+                             start=start)
+
+    def _standin(self, address: int):
+        return AbsentDevice(address)
+
+    def _prime(self) -> None:
+        # track the page and command pointer of each device, and queue the
+        # values the recording reads from each register
+        gpio_primed = not isinstance(self.gpio, MemoryGpio)
+        for rec in self._records:
+            if rec.address == BusRecorder.GPIO_ADDRESS:
+                if rec.op == BusRecorder.OP_GPIO_READ and not gpio_primed:
+                    self.gpio.value = BusRecorder.GPIO.unpack(rec.data)[0]
+                    gpio_primed = True
+                continue
+            if rec.flags & (BusRecorder.FLAG_NACK | BusRecorder.FLAG_ERROR):
+                continue
+            dev = self._ports.get(rec.address)
+            if not isinstance(dev, MemoryPmbusDevice):
+                dev = MemoryPmbusDevice(rec.address)
+                self._ports[rec.address] = dev
+            start = bool(rec.flags & BusRecorder.FLAG_START)
+            if rec.op == BusRecorder.OP_READ:
+                if rec.data:
+                    dev.prime(dev.pointer, rec.data)
+            else:
+                if rec.op == BusRecorder.OP_EXCHANGE and rec.data:
+                    if rec.out:
+                        dev.prime(rec.out[0], rec.data)
+                    else:
+                        dev.prime(dev.pointer, rec.data)
+                if rec.out and start:
+                    dev.pointer = rec.out[0]
+                    if dev.pointer == MemoryPmbusDevice.PAGE and \
+                            len(rec.out) > 1:
+                        dev.page = rec.out[1]
+        # replay starts from power-on state
+        for dev in self._ports.values():
+            dev.page = 0
+            dev.pointer = None
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('action', choices=('dump', 'replay'),
+                               help='print or replay the recording')
+        argparser.add_argument('recording', help='recording file')
+        argparser.add_argument('-t', '--realtime', action='store_true',
+                               help='replay with the original timing')
+        argparser.add_argument('-s', '--speed', type=float, default=1.0,
+                               help='time scale factor in realtime mode')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        if args.action == 'dump':
+            names = {BusRecorder.OP_WRITE: 'write',
+                     BusRecorder.OP_READ: 'read',
+                     BusRecorder.OP_EXCHANGE: 'exchange',
+                     BusRecorder.OP_GPIO_READ: 'gpio_read',
+                     BusRecorder.OP_GPIO_WRITE: 'gpio_write',
+                     BusRecorder.OP_GPIO_DIRECTION: 'gpio_dir'}
+            with open(args.recording, 'rb') as rfp:
+                for rec in BusRecorder.load(rfp):
+                    status = 'NACK' if rec.flags & BusRecorder.FLAG_NACK \
+                        else 'ERR' if rec.flags & BusRecorder.FLAG_ERROR \
+                        else ''
+                    print(f'{rec.time:12.6f} 0x{rec.address:02x} '
+                          f'{names.get(rec.op, "?"):10s} {rec.out.hex():16s} '
+                          f'{rec.data.hex():16s} {status}')
+        else:
+            stats = BusReplayer.from_file(args.recording).replay(
+                args.realtime, args.speed)
+            print(f'{stats["transactions"]} transactions in '
+                  f'{stats["elapsed"]*1E3:.1f} ms '
+                  f'({stats["rate"]:.0f}/s), {stats["nacks"]} NACK(s), '
+                  f'{len(stats["mismatches"])} mismatch(es)')
+            for index, expect, got in stats['mismatches']:
+                print(f'  #{index}: expected {expect!r}, got {got!r}')
+            if stats['mismatches']:
+                exit(1)
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
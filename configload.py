@@ -0,0 +1,308 @@
+#!/usr/bin/env python3
+
+"""Bulk configuration loader for UCD92xx sequencers.
+
+   Stream a configuration image into the device as batched SMBus writes,
+   then read it back and compare checksums.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from sys import modules, stderr
+from time import perf_counter
+from traceback import format_exc
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from zlib import crc32
+from pyftdi.i2c import I2cNackError
+from pmbus import UCD92xx
+
+
+class ConfigEntry(NamedTuple):
+    """A single command of a configuration image."""
+    line: int
+    page: Optional[int]
+    code: int
+    name: str
+    data: bytes
+    """Payload as sent on the bus, block byte count included."""
+    readlen: Optional[int]
+    """Readback length, None for write-only or unknown commands."""
+
+
+class LoadReport(NamedTuple):
+    """Outcome of a configuration load."""
+    written: int
+    elapsed: float
+    checksum: int
+    """CRC-32 of the written payloads."""
+    readback: Optional[int]
+    """CRC-32 of the read back payloads, None if not verified."""
+    verified: Optional[bool]
+    """Whether the readback matched, None if not verified."""
+    mismatches: List[Tuple[ConfigEntry, bytes]]
+    """Entries whose readback differs, with the data read back."""
+
+
+class ConfigLoader:
+    """Load a configuration image into a UCD92xx.
+
+       An image is a text file with one command per line; ``#`` starts a
+       comment::
+
+         page 0                  # select a rail for the next commands
+         vout_command 66 1a      # command name and payload bytes
+         0xd5 4d 61 69 6e        # command code and payload bytes
+         mfr_specific_d0 0102    # payload spaces are optional
+
+       Payloads are given in bus order, i.e. little endian words. The byte
+       count of SMBus block commands is added by the loader; commands of
+       unknown codes are written as given. Data flash blocks exported as
+       manufacturer block commands use the same syntax.
+
+       Commands are compiled into PMBus batches of ``chunk`` entries, each
+       sent as a few large MPSSE buffers, so only the ACKs of a whole chunk
+       are checked at once. A NACK stops the load at the end of its chunk.
+
+       :param device: target device
+       :param pec: append a Packet Error Code to each write
+       :param chunk: entries per batch
+    """
+
+    CHUNK = 256
+    SKIP_VERIFY = ('clear_faults', 'store_default_all',
+                   'restore_default_all', 'store_user_all',
+                   'restore_user_all')
+    """Commands that are never read back."""
+
+    def __init__(self, device: UCD92xx, pec: bool = False,
+                 chunk: int = CHUNK):
+        if chunk < 1:
+            raise ValueError('Invalid chunk size')
+        self._device = device
+        self._pec = pec
+        self._chunk = chunk
+
+    @classmethod
+    def parse(cls, lines: Iterable[str]) -> List[ConfigEntry]:
+        """Parse a configuration image.
+
+           :param lines: image lines
+           :return: entries
+           :raise ValueError: on a syntax error
+        """
+        codes = {info[0]: name for name, info in
+                 UCD92xx.command_table.items()}
+        entries = []
+        page = None
+        for num, line in enumerate(lines, start=1):
+            words = line.split('#', 1)[0].split()
+            if not words:
+                continue
+            try:
+                if words[0].lower() == 'page':
+                    page = int(words[1], 0)
+                    if len(words) != 2 or \
+                            not 0 <= page < UCD92xx.PAGE_COUNT:
+                        raise ValueError('Invalid page')
+                    continue
+                entries.append(cls._parse_entry(num, page, words, codes))
+            except (IndexError, ValueError) as exc:
+                raise ValueError(f'Line {num}: {exc or "syntax error"}: '
+                                 f'{line.strip()}') from exc
+        return entries
+
+    @classmethod
+    def parse_file(cls, path: str) -> List[ConfigEntry]:
+        """Parse a configuration image file.
+
+           :param path: image file
+           :return: entries
+        """
+        with open(path, 'rt') as ifp:
+            return cls.parse(ifp)
+
+    def load(self, entries: List[ConfigEntry], verify: bool = True) \
+            -> LoadReport:
+        """Write, then optionally verify, a configuration image.
+
+           :param entries: parsed image
+           :param verify: read back and compare the written commands
+           :return: the load report
+        """
+        start = perf_counter()
+        checksum = self.write(entries)
+        if not verify:
+            return LoadReport(len(entries), perf_counter() - start, checksum,
+                              None, None, [])
+        expected, readback, mismatches = self.verify(entries)
+        return LoadReport(len(entries), perf_counter() - start, checksum,
+                          readback, expected == readback, mismatches)
+
+    def write(self, entries: List[ConfigEntry]) -> int:
+        """Stream a configuration image into the device.
+
+           :param entries: parsed image
+           :return: CRC-32 of the written payloads
+           :raise I2cNackError: if a write is not acknowledged
+        """
+        device = self._device
+        checksum = 0
+        for pos in range(0, len(entries), self._chunk):
+            chunk = entries[pos:pos+self._chunk]
+            # a failed PAGE write must stop the writes to that page
+            batch = device.batch(page_fence=True)
+            steps = {}
+            for entry in chunk:
+                data = entry.data
+                if self._pec:
+                    data += bytes((self._pec_byte(entry.code, data),))
+                steps[batch.write_bytes(entry.code, data, entry.page)] = \
+                    entry
+                checksum = crc32(entry.data, checksum)
+            batch.execute(check=False)
+            for step in batch.result.nacks:
+                if step in steps:
+                    entry = steps[step]
+                    raise I2cNackError(f'Line {entry.line}: {entry.name} '
+                                       f'not acknowledged')
+            batch.batch.check(batch.result)
+        return checksum
+
+    def verify(self, entries: List[ConfigEntry]) \
+            -> Tuple[int, int, List[Tuple[ConfigEntry, bytes]]]:
+        """Read back the commands of a configuration image.
+
+           Only the last write of each command and page is checked. A read
+           that failed, e.g. behind a PAGE write that failed, counts as a
+           mismatch with empty data.
+
+           :param entries: parsed image
+           :return: CRC-32 of the expected and of the read back payloads,
+                    and the entries whose readback differs, with the data
+                    read back
+        """
+        final = {}
+        for entry in entries:
+            if entry.readlen is not None and \
+                    entry.name not in self.SKIP_VERIFY:
+                final[(entry.page, entry.code)] = entry
+        expected = list(final.values())
+        expected_crc = 0
+        readback_crc = 0
+        mismatches = []
+        for pos in range(0, len(expected), self._chunk):
+            chunk = expected[pos:pos+self._chunk]
+            # a failed PAGE write must not verify another page
+            batch = self._device.batch(page_fence=True)
+            for index, entry in enumerate(chunk):
+                batch.read_bytes(entry.code, entry.readlen, entry.page, index)
+            values = batch.execute(check=False)
+            for index, entry in enumerate(chunk):
+                data = values.get(index, b'')[:len(entry.data)]
+                expected_crc = crc32(entry.data, expected_crc)
+                readback_crc = crc32(data, readback_crc)
+                if data != entry.data:
+                    mismatches.append((entry, data))
+        return expected_crc, readback_crc, mismatches
+
+    def _pec_byte(self, code: int, data: bytes) -> int:
+        address = self._device.i2c_slave.address
+        message = bytes((address << 1, code)) + data
+        return self._device.get_crc(int.from_bytes(message, 'big'))
+
+    @staticmethod
+    def _parse_entry(num: int, page: Optional[int], words: List[str],
+                     codes: dict) -> ConfigEntry:
+        command = words[0].lower()
+        data = bytes.fromhex(''.join(words[1:]).replace('0x', ''))
+        if command in UCD92xx.command_table:
+            name = command
+        elif command in UCD92xx.pmbus_dict:
+            name = command
+            code = UCD92xx.pmbus_dict[command]
+        else:
+            code = int(command, 0)
+            if not 0 <= code <= 0xff:
+                raise ValueError('Invalid command code')
+            name = codes.get(code, f'0x{code:02x}')
+        if name not in UCD92xx.command_table:
+            return ConfigEntry(num, page, code, name, data, None)
+        code, fmt, readlen, _, _ = UCD92xx.command_table[name]
+        if fmt == UCD92xx.BLOCK:
+            if not 0 < len(data) <= UCD92xx.BLOCK_MAX_LENGTH:
+                raise ValueError('Invalid block length')
+            return ConfigEntry(num, page, code, name,
+                               bytes((len(data),)) + data,
+                               1 + len(data))
+        if readlen is None:
+            if data:
+                raise ValueError(f'{name} takes no payload')
+        elif len(data) != readlen:
+            raise ValueError(f'{name} expects {readlen} payload bytes')
+        return ConfigEntry(num, page, code, name, data, readlen)
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('image', help='configuration image file')
+        argparser.add_argument('-u', '--url',
+                               help='FTDI interface URL')
+        argparser.add_argument('-a', '--address', default='0x34',
+                               help='PMBus slave address')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=400000,
+                               help='I2C bus frequency, in Hz')
+        argparser.add_argument('-p', '--pec', action='store_true',
+                               help='append a PEC byte to each write')
+        argparser.add_argument('-c', '--chunk', type=int,
+                               default=ConfigLoader.CHUNK,
+                               help='commands per batch')
+        argparser.add_argument('-n', '--no-verify', action='store_true',
+                               help='skip readback verification')
+        argparser.add_argument('-s', '--store', action='store_true',
+                               help='store to data flash once verified')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        entries = ConfigLoader.parse_file(args.image)
+        device = UCD92xx(int(args.address, 0), args.frequency, url=args.url)
+        try:
+            loader = ConfigLoader(device, args.pec, args.chunk)
+            report = loader.load(entries, not args.no_verify)
+            for entry, data in report.mismatches:
+                print(f'Line {entry.line}: {entry.name} page {entry.page}: '
+                      f'wrote {entry.data.hex()}, read {data.hex()}')
+            print(f'{report.written} commands in {report.elapsed:.3f}s, '
+                  f'crc32 0x{report.checksum:08x}, ' +
+                  {None: 'not verified', True: 'verified',
+                   False: 'VERIFY FAILED'}[report.verified])
+            if args.store:
+                if report.verified is False:
+                    raise ValueError('Not storing a mismatching '
+                                     'configuration')
+                device.store_default_all()
+        finally:
+            device.close()
+        if report.verified is False:
+            exit(3)
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
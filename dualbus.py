@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+
+"""Concurrent I2C and SPI on a multi-interface FTDI adapter.
+
+   Drive a UCD92xx over I2C and a SPI slave from two MPSSE interfaces of
+   the same FT2232H/FT4232H, each from its own worker thread, so that the
+   USB transfers of both buses overlap.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from concurrent.futures import Future, ThreadPoolExecutor
+from re import sub
+from sys import modules, stderr
+from threading import Event
+from time import perf_counter
+from traceback import format_exc
+from typing import Callable, Optional, Sequence
+from pyftdi.spi import SpiController, SpiPort
+from pmbus import UCD92xx
+from spiqual import SpiQualifier
+
+
+def interface_url(url: str, interface: int) -> str:
+    """Return the URL of another interface of the same FTDI device.
+
+       :param url: FTDI device URL, with or without an interface number
+       :param interface: interface number, starting from 1
+       :return: interface URL
+    """
+    return f"{sub(r'/[0-9]*$', '', url)}/{interface}"
+
+
+class DualBusSession:
+    """I2C and SPI masters on two interfaces of one FTDI adapter.
+
+       The UCD92xx and the SPI controller are each bound to a single worker
+       thread, which opens the interface and runs all the accesses to it.
+       pyusb releases the GIL while a USB transfer is pending, so a long SPI
+       transfer, such as a flash read or program, does not delay the PMBus
+       transactions, and the other way round.
+
+       Accesses are submitted as callables and return futures. A callable
+       must only use the bus of the worker it is submitted to; the device
+       and port objects should not be used from any other thread.
+
+       Only the first two interfaces of FT2232H and FT4232H adapters
+       support MPSSE.
+
+       :param url: FTDI device URL, the interface number is ignored
+       :param address: PMBus slave address
+       :param i2c_interface: interface of the I2C master
+       :param spi_interface: interface of the SPI master
+       :param i2c_frequency: I2C bus frequency, in Hz
+       :param cs_count: count of SPI chip select lines
+    """
+
+    def __init__(self, url: str = 'ftdi:///', address: int = 0x34,
+                 i2c_interface: int = 1, spi_interface: int = 2,
+                 i2c_frequency: float = 400000, cs_count: int = 1):
+        if i2c_interface == spi_interface:
+            raise ValueError('I2C and SPI need distinct interfaces')
+        self.i2c_url = interface_url(url, i2c_interface)
+        self.spi_url = interface_url(url, spi_interface)
+        self.device = UCD92xx(address, i2c_frequency, url=self.i2c_url,
+                              lazy=True)
+        self.spi = SpiController(cs_count=cs_count)
+        self._i2c_worker = ThreadPoolExecutor(1, thread_name_prefix='i2c')
+        self._spi_worker = ThreadPoolExecutor(1, thread_name_prefix='spi')
+        # open both interfaces in parallel, each from its worker
+        futures = (self.submit_i2c(self.device.get_vout_mode),
+                   self.submit_spi(self.spi.configure, self.spi_url))
+        try:
+            self.device.exponent = futures[0].result()
+            futures[1].result()
+        except Exception:
+            self.close()
+            raise
+
+    def __enter__(self) -> 'DualBusSession':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    def submit_i2c(self, func: Callable, *args, **kwargs) -> Future:
+        """Run a callable on the I2C worker.
+
+           :param func: callable, usually a method of :py:attr:`device`
+           :return: future of the result of the callable
+        """
+        return self._i2c_worker.submit(func, *args, **kwargs)
+
+    def submit_spi(self, func: Callable, *args, **kwargs) -> Future:
+        """Run a callable on the SPI worker.
+
+           :param func: callable, usually a method of a SPI port
+           :return: future of the result of the callable
+        """
+        return self._spi_worker.submit(func, *args, **kwargs)
+
+    def get_spi_port(self, cs: int = 0, qualify: bool = True,
+                     frequency: float = 6E6, mode: int = 0) -> SpiPort:
+        """Obtain a SPI port, from the SPI worker.
+
+           :param cs: chip select slot
+           :param qualify: run at the fastest qualified setting, see
+                           spiqual.py
+           :param frequency: SPI frequency, if not qualified
+           :param mode: SPI mode, if not qualified
+           :return: the configured SPI port
+        """
+        if qualify:
+            return self.submit_spi(SpiQualifier.get_port, self.spi, cs,
+                                   modes=(mode,)).result()
+        return self.submit_spi(self.spi.get_port, cs, frequency,
+                               mode).result()
+
+    def close(self) -> None:
+        """Wait for the pending accesses, then close both interfaces."""
+        try:
+            self._i2c_worker.submit(self.device.close).result()
+        finally:
+            self._i2c_worker.shutdown()
+            try:
+                self._spi_worker.submit(self.spi.close).result()
+            finally:
+                self._spi_worker.shutdown()
+
+
+def read_flash(port: SpiPort, size: int, address: int = 0,
+               chunk: int = 0x10000) -> bytes:
+    """Read a SPI flash with the READ (0x03) command.
+
+       :param port: SPI flash port
+       :param size: byte count
+       :param address: first byte address
+       :param chunk: byte count per READ command
+       :return: flash content
+    """
+    data = bytearray()
+    while len(data) < size:
+        pos = address + len(data)
+        length = min(chunk, size - len(data))
+        data.extend(port.exchange(b'\x03' + pos.to_bytes(3, 'big'), length))
+    return bytes(data)
+
+
+def poll(device: UCD92xx, names: Sequence[str], page: Optional[int],
+         stop: Event) -> int:
+    """Read PMBus commands in a loop until stopped.
+
+       :param device: UCD92xx device
+       :param names: commands to read
+       :param page: page to read them from
+       :param stop: loop stop event
+       :return: count of batched reads
+    """
+    count = 0
+    while not stop.is_set():
+        device.read_many(names, page)
+        count += 1
+    return count
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('device', nargs='?', default='ftdi:///',
+                               help='FTDI device URL')
+        argparser.add_argument('-a', '--address', default='0x34',
+                               help='PMBus slave address')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=400000,
+                               help='I2C bus frequency, in Hz')
+        argparser.add_argument('-I', '--i2c-interface', type=int, default=1,
+                               help='interface of the I2C master')
+        argparser.add_argument('-S', '--spi-interface', type=int, default=2,
+                               help='interface of the SPI master')
+        argparser.add_argument('-r', '--read', action='append',
+                               help='PMBus command to poll, may be repeated')
+        argparser.add_argument('-p', '--page', type=int, default=0,
+                               help='PMBus page to poll')
+        argparser.add_argument('-s', '--size', default='0x100000',
+                               help='SPI flash byte count to read')
+        argparser.add_argument('-o', '--output',
+                               help='file to save the flash content to')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        names = args.read or ['read_vout', 'read_iout', 'status_word']
+        size = int(args.size, 0)
+        with DualBusSession(args.device, int(args.address, 0),
+                            args.i2c_interface, args.spi_interface,
+                            args.frequency) as session:
+            port = session.get_spi_port()
+            stop = Event()
+            start = perf_counter()
+            polls = session.submit_i2c(poll, session.device, names,
+                                       args.page, stop)
+            flash = session.submit_spi(read_flash, port, size)
+            try:
+                data = flash.result()
+            finally:
+                stop.set()
+            elapsed = perf_counter() - start
+            count = polls.result()
+        print(f'SPI: {size} bytes in {elapsed*1E3:.1f} ms '
+              f'({size/elapsed/1024:.0f} KiB/s)')
+        print(f'I2C: {count} polls of {len(names)} commands '
+              f'({count/elapsed:.0f} polls/s)')
+        if args.output:
+            with open(args.output, 'wb') as ofp:
+                ofp.write(data)
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
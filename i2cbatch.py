@@ -0,0 +1,587 @@
+#!/usr/bin/env python3
+
+"""Batched I2C transactions compiled into MPSSE command buffers.
+
+   pyftdi issues one USB round trip per transferred byte, as it checks each
+   ACK before going on. A batch instead emits the whole sequence of I2C
+   frames, GPIO edges and delays in as few MPSSE buffers as the FTDI FIFOs
+   allow, collects all ACK bits and read data in one reply per buffer, and
+   checks the ACKs of a buffer before sending the next one. The MPSSE engine
+   then executes the sequence with a fixed, clock-accurate spacing between
+   steps.
+"""
+
+from collections import namedtuple
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Set, Tuple, Union
+from pyftdi.ftdi import Ftdi
+from pyftdi.i2c import I2cController, I2cIOError, I2cNackError
+
+
+StepTiming = namedtuple('StepTiming', 'name segment offset duration')
+"""Timing of a batch step, in seconds.
+
+   offset is relative to the start of the batch: the measured start of the
+   step MPSSE buffer, plus the nominal position of the step in this buffer.
+"""
+
+
+class BatchResult:
+    """Outcome of a batch execution."""
+
+    def __init__(self, data: Dict[int, bytearray], nacks: Sequence[int],
+                 timings: List[StepTiming], segments: List[float],
+                 skipped: Sequence[int] = ()):
+        self.data = data
+        """Read data, indexed by step."""
+        self.nacks = list(nacks)
+        """Steps whose slave did not acknowledge."""
+        self.skipped = list(skipped)
+        """Steps not executed, as an earlier step was not acknowledged."""
+        self.timings = timings
+        """Per-step timing."""
+        self.segments = segments
+        """Measured duration of each MPSSE buffer, USB transfer included."""
+
+    @property
+    def elapsed(self) -> float:
+        """Total measured execution time, in seconds."""
+        return sum(self.segments)
+
+
+class I2cBatch:
+    """Compile I2C frames, GPIO edges and delays into MPSSE buffers.
+
+       Each method appends one step and returns its index, which is used to
+       retrieve read data and timings from the BatchResult. All frames are
+       complete transactions (START ... STOP), so GPIO edges and delays are
+       always emitted while the bus is idle.
+
+       The batch is split in several buffers when the expected reply would
+       overflow the FTDI RX FIFO, or where :py:meth:`fence` is called; steps
+       in different buffers are separated by a USB round trip. Once a step
+       of a buffer is not acknowledged, the following buffers are not sent.
+
+       :param i2c: a configured I2C controller
+       :param gpio: initial level of the GPIO outputs, read from the
+                    adapter if not specified
+    """
+
+    # atom kinds
+    NONE = 0
+    ACK = 1
+    DATA = 2
+
+    def __init__(self, i2c: I2cController, gpio: Optional[int] = None):
+        if not i2c.configured:
+            raise I2cIOError("FTDI controller not initialized")
+        self._i2c = i2c
+        self._ftdi = i2c.ftdi
+        self._outputs = i2c.direction & ~i2c.I2C_DIR
+        if gpio is None:
+            gpio = i2c.read_gpio(True) if self._outputs else 0
+        self._level = gpio & self._outputs
+        # reply bytes that fit in the RX FIFO, minus the final GPIO sample
+        self._limit = max(2, i2c._rx_size - 3)
+        self._bit_time = 1.0 / i2c.frequency
+        self._cmd_time = self._ftdi.mpsse_bit_delay
+        self._steps: List[str] = []
+        self._operations: List[tuple] = []
+        self._segments: List[list] = []
+        self._new_segment()
+
+    @property
+    def steps(self) -> List[str]:
+        """Step names, in execution order."""
+        return list(self._steps)
+
+    @property
+    def gpio(self) -> int:
+        """GPIO output level at the current end of the batch."""
+        return self._level
+
+    @property
+    def operations(self) -> List[tuple]:
+        """Bus operation of each step, as ``('write', address, out)``,
+           ``('read', address, readlen)``,
+           ``('exchange', address, out, readlen)``, ``('gpio', level)``
+           with the GPIO output level after the step, or ``('delay',)``."""
+        return list(self._operations)
+
+    def write(self, address: int, out: Union[bytes, Sequence[int]],
+              name: Optional[str] = None) -> int:
+        """Append a write frame.
+
+           :param address: slave address
+           :param out: bytes to write
+           :param name: step name
+           :return: step index
+        """
+        step = self._add_step(name or f'write 0x{address:02x}',
+                              ('write', address, bytes(out)))
+        atoms = self._frame_start(step, address << 1)
+        for byte in bytes(out):
+            atoms.extend(self._write_byte(step, byte))
+        atoms.append(self._frame_stop(step))
+        self._add_frame(atoms)
+        return step
+
+    def read(self, address: int, readlen: int,
+             name: Optional[str] = None) -> int:
+        """Append a read frame.
+
+           :param address: slave address
+           :param readlen: count of bytes to read
+           :param name: step name
+           :return: step index
+        """
+        step = self._add_step(name or f'read 0x{address:02x}',
+                              ('read', address, readlen))
+        atoms = self._frame_start(step, (address << 1) | 1)
+        atoms.extend(self._read_bytes(step, readlen))
+        atoms.append(self._frame_stop(step))
+        self._add_frame(atoms)
+        return step
+
+    def exchange(self, address: int, out: Union[bytes, Sequence[int]],
+                 readlen: int, name: Optional[str] = None) -> int:
+        """Append a write, repeated start, read frame.
+
+           :param address: slave address
+           :param out: bytes to write, usually a register or command code
+           :param readlen: count of bytes to read
+           :param name: step name
+           :return: step index
+        """
+        if readlen < 1:
+            raise I2cIOError('Nothing to read')
+        step = self._add_step(name or f'exchange 0x{address:02x}',
+                              ('exchange', address, bytes(out), readlen))
+        atoms = self._frame_start(step, address << 1)
+        for byte in bytes(out):
+            atoms.extend(self._write_byte(step, byte))
+        atoms.extend(self._frame_start(step, (address << 1) | 1))
+        atoms.extend(self._read_bytes(step, readlen))
+        atoms.append(self._frame_stop(step))
+        self._add_frame(atoms)
+        return step
+
+    def set_gpio(self, pins: int, value: int,
+                 name: Optional[str] = None) -> int:
+        """Append a GPIO edge.
+
+           :param pins: GPIO pins to change
+           :param value: new level of those pins
+           :param name: step name
+           :return: step index
+        """
+        if pins & ~self._outputs:
+            raise I2cIOError(f'No such GPO pins: '
+                             f'{self._outputs:04x}/{pins:04x}')
+        self._level = (self._level & ~pins) | (value & pins)
+        step = self._add_step(name or f'gpio 0x{pins:04x}=0x{value:04x}',
+                              ('gpio', self._level))
+        cmd = bytearray()
+        if pins & 0xff:
+            cmd.extend(self._waveform('_idle'))
+        if pins & ~0xff:
+            direction = self._i2c.direction
+            cmd.extend((Ftdi.SET_BITS_HIGH, (self._level >> 8) & 0xff,
+                        (direction >> 8) & 0xff))
+        self._add_frame([(step, bytes(cmd), self.NONE, 0, self._cmd_time)])
+        return step
+
+    def delay(self, seconds: float, name: Optional[str] = None) -> int:
+        """Append a delay.
+
+           On H-series devices, the delay is generated with clocks without
+           data, whose resolution is the I2C bit time. SDA is left released
+           and no START is emitted, so slaves ignore these clocks. Other
+           devices repeat idle commands, whose duration is less accurate.
+
+           :param seconds: delay duration
+           :param name: step name
+           :return: step index
+        """
+        if seconds < 0:
+            raise ValueError('Negative delay')
+        step = self._add_step(name or f'delay {seconds*1E6:.0f}us',
+                              ('delay',))
+        atoms = []
+        clocks = int(round(seconds / self._bit_time))
+        if self._ftdi.is_H_series and clocks:
+            while clocks >= 8:
+                count = min(clocks // 8, 0x10000)
+                atoms.append((step, bytes((Ftdi.CLK_BYTES_NO_DATA,
+                                           (count - 1) & 0xff,
+                                           (count - 1) >> 8)),
+                              self.NONE, 0, 8 * count * self._bit_time))
+                clocks -= 8 * count
+            if clocks:
+                atoms.append((step, bytes((Ftdi.CLK_BITS_NO_DATA,
+                                           clocks - 1)),
+                              self.NONE, 0, clocks * self._bit_time))
+        else:
+            count = int(round(seconds / self._cmd_time))
+            idle = bytes(self._waveform('_idle'))
+            for _ in range(count):
+                atoms.append((step, idle, self.NONE, 0, self._cmd_time))
+        self._add_frame(atoms)
+        return step
+
+    def fence(self) -> None:
+        """End the current MPSSE buffer.
+
+           The following steps are only sent once all the steps before the
+           fence have been acknowledged, at the cost of a USB round trip.
+           Use it after a step the next ones depend on, such as a PMBus
+           PAGE write.
+        """
+        if self._segments[-1][1]:
+            self._new_segment()
+
+    def execute(self, check: bool = True) -> BatchResult:
+        """Execute the batch.
+
+           The ACK bits are only known once a buffer has been executed, so
+           all the steps of the buffer holding a NACKed step are run. The
+           next buffers are not sent, their steps are reported as skipped,
+           and the GPIO outputs are left as the last executed step set them.
+
+           :param check: raise on the first NACKed step
+           :return: the batch result
+           :raise I2cNackError: if check is set and a slave NACKed
+        """
+        i2c = self._i2c
+        data: Dict[int, bytearray] = {}
+        nacks: Set[int] = set()
+        timings = []
+        durations = []
+        elapsed = 0.0
+        current = None
+        skipped = ()
+        level = None
+        with i2c._lock:
+            for index, (cmd, atoms, size, nominal, end_level) in \
+                    enumerate(self._segments):
+                if not atoms:
+                    continue
+                # stop at the first frame boundary after a NACK, a frame
+                # split over several buffers is always completed
+                if nacks and atoms[0][0] != current:
+                    skipped = range(atoms[0][0], len(self._steps))
+                    break
+                buf = self._segment_buffer(cmd)
+                start = perf_counter()
+                self._ftdi.write_data(buf)
+                reply = self._ftdi.read_data_bytes(
+                    size + 1, 4 + int(nominal * 1000))
+                duration = perf_counter() - start
+                if len(reply) != size + 1:
+                    raise I2cIOError('No answer from FTDI')
+                durations.append(duration)
+                pos = 0
+                offset = 0.0
+                current = None
+                for step, _, kind, length, nominal_time in atoms:
+                    if step != current:
+                        # a step split over two buffers gets two entries
+                        current = step
+                        timings.append(StepTiming(self._steps[step], index,
+                                                  elapsed + offset, 0.0))
+                    last = timings[-1]
+                    timings[-1] = last._replace(
+                        duration=last.duration + nominal_time)
+                    offset += nominal_time
+                    if kind == self.ACK:
+                        if reply[pos] & I2cController.BIT0:
+                            nacks.add(step)
+                    elif kind == self.DATA:
+                        data.setdefault(step, bytearray()).extend(
+                            reply[pos:pos+length])
+                    pos += length
+                elapsed += duration
+                level = end_level
+            if level is not None:
+                # keep pyftdi in sync with the GPIO levels the batch left
+                i2c._gpio_low = level & 0xff & ~i2c._i2c_mask
+        result = BatchResult(data, sorted(nacks), timings, durations,
+                             skipped)
+        if check:
+            self.check(result)
+        return result
+
+    def check(self, result: BatchResult) -> None:
+        """Raise if any step of an executed batch was not acknowledged.
+
+           :param result: result of this batch
+           :raise I2cNackError: on the first NACKed step
+        """
+        if result.nacks:
+            step = result.nacks[0]
+            raise I2cNackError(f'NACK from slave @ step {step}: '
+                               f'{self._steps[step]}')
+
+    def freeze(self) -> 'BatchTemplate':
+        """Compile the batch into an immutable, reusable template.
+
+           :return: the template
+        """
+        return BatchTemplate(self)
+
+    def _segment_buffer(self, cmd: bytearray) -> bytes:
+        buf = bytearray(cmd)
+        if self._i2c._clkstrch:
+            buf.insert(0, Ftdi.ENABLE_CLK_ADAPTIVE)
+            buf.append(Ftdi.DISABLE_CLK_ADAPTIVE)
+        # sample the port once all commands are executed, so that the reply
+        # completion time is the buffer completion time
+        buf.extend((Ftdi.GET_BITS_LOW, Ftdi.SEND_IMMEDIATE))
+        return bytes(buf)
+
+    def _add_step(self, name: str, operation: tuple) -> int:
+        self._steps.append(name)
+        self._operations.append(operation)
+        return len(self._steps) - 1
+
+    def _new_segment(self) -> None:
+        # command buffer, atoms, reply size, nominal duration, GPIO level
+        # at the end of the buffer
+        self._segments.append([bytearray(), [], 0, 0.0, self._level])
+
+    def _add_frame(self, atoms: list) -> None:
+        size = sum(atom[3] for atom in atoms)
+        segment = self._segments[-1]
+        if segment[1] and segment[2] + size > self._limit:
+            # prefer splitting between frames
+            self._new_segment()
+        for atom in atoms:
+            segment = self._segments[-1]
+            if segment[2] + atom[3] > self._limit:
+                self._new_segment()
+                segment = self._segments[-1]
+            segment[0].extend(atom[1])
+            segment[1].append(atom)
+            segment[2] += atom[3]
+            segment[3] += atom[4]
+        self._segments[-1][4] = self._level
+
+    def _waveform(self, name: str) -> tuple:
+        # pyftdi waveforms embed the GPIO low byte level it tracks, use the
+        # level the batch will have reached at this point instead
+        i2c = self._i2c
+        saved = i2c._gpio_low
+        i2c._gpio_low = self._level & 0xff & ~i2c._i2c_mask
+        try:
+            return getattr(i2c, name)
+        finally:
+            i2c._gpio_low = saved
+
+    def _ack_atom(self, step: int, cmd: bytearray) -> tuple:
+        if self._i2c._fake_tristate:
+            cmd.extend(self._waveform('_clk_lo_data_input'))
+        else:
+            cmd.extend(self._waveform('_clk_lo_data_hi'))
+        cmd.extend(self._i2c._read_bit)
+        return (step, bytes(cmd), self.ACK, 1,
+                9 * self._bit_time + self._cmd_time)
+
+    def _frame_start(self, step: int, i2caddress: int) -> list:
+        i2c = self._i2c
+        cmd = bytearray(self._waveform('_idle') * i2c._ck_delay)
+        cmd.extend(self._waveform('_start'))
+        cmd.extend(i2c._write_byte)
+        cmd.append(i2caddress)
+        atom = self._ack_atom(step, cmd)
+        overhead = (i2c._ck_delay + 2 * i2c._ck_hd_sta) * self._cmd_time
+        return [atom[:4] + (atom[4] + overhead,)]
+
+    def _write_byte(self, step: int, byte: int) -> list:
+        i2c = self._i2c
+        if i2c._fake_tristate:
+            cmd = bytearray(self._waveform('_clk_lo_data_hi'))
+            cmd.extend(i2c._write_byte)
+        else:
+            cmd = bytearray(i2c._write_byte)
+        cmd.append(byte)
+        return [self._ack_atom(step, cmd)]
+
+    def _read_bytes(self, step: int, readlen: int) -> list:
+        i2c = self._i2c
+        if i2c._fake_tristate:
+            read_byte = (self._waveform('_clk_lo_data_input') +
+                         i2c._read_byte +
+                         self._waveform('_clk_lo_data_hi'))
+            read_not_last = bytes(read_byte + i2c._ack +
+                                  self._waveform('_clk_lo_data_lo') *
+                                  i2c._ck_delay)
+            read_last = bytes(read_byte + i2c._nack +
+                              self._waveform('_clk_lo_data_hi') *
+                              i2c._ck_delay)
+        else:
+            read_not_last = bytes(i2c._read_byte + i2c._ack +
+                                  self._waveform('_clk_lo_data_hi') *
+                                  i2c._ck_delay)
+            read_last = bytes(i2c._read_byte + i2c._nack +
+                              self._waveform('_clk_lo_data_hi') *
+                              i2c._ck_delay)
+        byte_time = 9 * self._bit_time + (1 + i2c._ck_delay) * self._cmd_time
+        atoms = [(step, read_not_last, self.DATA, 1, byte_time)] * \
+            (readlen - 1)
+        atoms.append((step, read_last, self.DATA, 1, byte_time))
+        return atoms
+
+    def _frame_stop(self, step: int) -> tuple:
+        i2c = self._i2c
+        cmd = bytearray(self._waveform('_stop'))
+        if i2c._fake_tristate:
+            cmd.extend(self._waveform('_clk_input_data_input'))
+        count = 2 * i2c._ck_hd_sta + i2c._ck_su_sto + i2c._ck_idle
+        return (step, bytes(cmd), self.NONE, 0, count * self._cmd_time)
+
+
+class BatchTemplate:
+    """Immutable, precompiled form of a batch.
+
+       The MPSSE buffers, the ACK bit positions and the location of the read
+       data in the replies are computed once, so that each execution only
+       costs the USB transfers and a few slice copies. The read data of all
+       steps are written back to back into a caller-supplied buffer, at the
+       offsets given by :py:attr:`layout`.
+
+       The GPIO levels the batch drives are part of the template: each
+       execution leaves the GPIO outputs as the batch left them when it was
+       frozen, whatever changes were made since. As with
+       :py:meth:`I2cBatch.execute`, the buffers following a NACK are not
+       sent.
+
+       :param batch: the batch to freeze
+    """
+
+    __slots__ = ('_i2c', '_ftdi', '_steps', '_operations', '_segments',
+                 '_layout', '_size')
+
+    def __init__(self, batch: I2cBatch):
+        i2c = batch._i2c
+        self._i2c = i2c
+        self._ftdi = batch._ftdi
+        self._steps = tuple(batch._steps)
+        self._operations = tuple(batch._operations)
+        layout: Dict[int, Tuple[int, int]] = {}
+        segments = []
+        size = 0
+        last_step = None
+        for cmd, atoms, rxsize, nominal, level in batch._segments:
+            if not atoms:
+                continue
+            # first step of the buffer, None if it continues a frame
+            first = atoms[0][0] if atoms[0][0] != last_step else None
+            last_step = atoms[-1][0]
+            ack_mask = 0
+            ack_steps = []
+            copies = []
+            pos = 0
+            for step, _, kind, length, _ in atoms:
+                if kind == I2cBatch.ACK:
+                    ack_mask |= I2cController.BIT0 << (8 * pos)
+                    ack_steps.append((pos, step))
+                elif kind == I2cBatch.DATA:
+                    if copies and copies[-1][0] == step and \
+                            copies[-1][2] == pos:
+                        # extend the copy of a contiguous read
+                        step_, src, end, dst = copies[-1]
+                        copies[-1] = (step_, src, end + length, dst)
+                    else:
+                        copies.append((step, pos, pos + length, size))
+                    offset, count = layout.get(step, (size, 0))
+                    layout[step] = (offset, count + length)
+                    size += length
+                pos += length
+            segments.append((batch._segment_buffer(cmd), rxsize + 1,
+                             4 + int(nominal * 1000), ack_mask,
+                             tuple(ack_steps),
+                             tuple((src, end, dst, dst + end - src)
+                                   for _, src, end, dst in copies),
+                             first, level & 0xff & ~i2c._i2c_mask))
+        self._segments = tuple(segments)
+        self._layout = layout
+        self._size = size
+
+    @property
+    def steps(self) -> Tuple[str, ...]:
+        """Step names, in execution order."""
+        return self._steps
+
+    @property
+    def operations(self) -> Tuple[tuple, ...]:
+        """Bus operation of each step, see
+           :py:attr:`I2cBatch.operations`."""
+        return self._operations
+
+    @property
+    def size(self) -> int:
+        """Byte count of the read data of all steps."""
+        return self._size
+
+    @property
+    def layout(self) -> Dict[int, Tuple[int, int]]:
+        """Offset and length of the read data of each step in the output
+           buffer."""
+        return dict(self._layout)
+
+    def execute_into(self, buf: Union[bytearray, memoryview],
+                     offset: int = 0) -> Tuple[int, ...]:
+        """Execute the template.
+
+           :param buf: output buffer of at least offset + size bytes
+           :param offset: position of the read data in buf
+           :return: the steps whose slave did not acknowledge, followed by
+                    the steps skipped after them, usually empty
+        """
+        nacks = ()
+        read = self._ftdi.read_data_bytes
+        write = self._ftdi.write_data
+        i2c = self._i2c
+        gpio_low = None
+        with i2c._lock:
+            for cmd, size, attempt, ack_mask, ack_steps, copies, first, \
+                    level in self._segments:
+                if nacks and first is not None:
+                    nacks += tuple(range(first, len(self._steps)))
+                    break
+                write(cmd)
+                reply = read(size, attempt)
+                if len(reply) != size:
+                    raise I2cIOError('No answer from FTDI')
+                for src, end, dst, dend in copies:
+                    buf[offset+dst:offset+dend] = reply[src:end]
+                if int.from_bytes(reply, 'little') & ack_mask:
+                    nacks += tuple(step for pos, step in ack_steps
+                                   if reply[pos] & I2cController.BIT0)
+                gpio_low = level
+            if gpio_low is not None:
+                i2c._gpio_low = gpio_low
+        return tuple(sorted(set(nacks))) if nacks else nacks
+
+    def skipped(self, nacks: Sequence[int]) -> range:
+        """Tell the steps an execution skipped from those it reported.
+
+           :param nacks: value returned by :py:meth:`execute_into`
+           :return: the steps that were not executed
+        """
+        if nacks:
+            for segment in self._segments:
+                first = segment[6]
+                if first is not None and first > nacks[0]:
+                    return range(first, len(self._steps))
+        return range(0)
+
+    def check(self, nacks: Sequence[int]) -> None:
+        """Raise if a step of an execution was not acknowledged.
+
+           :param nacks: value returned by :py:meth:`execute_into`
+           :raise I2cNackError: on the first NACKed step
+        """
+        if nacks:
+            raise I2cNackError(f'NACK from slave @ step {nacks[0]}: '
+                               f'{self._steps[nacks[0]]}')
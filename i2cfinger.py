@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+"""I2C device fingerprinting.
+
+   Identify the devices found by the bus scanner from a few identifying
+   register reads, matched against a local signature table.
+"""
+
+from json import load
+from logging import getLogger
+from typing import (Callable, Dict, Iterable, List, NamedTuple, Optional,
+                    Union)
+from pyftdi.i2c import I2cController, I2cIOError, I2cNackError, I2cPort
+from adapter import adapter_serial, load_cache, save_cache
+
+
+class Fingerprint(NamedTuple):
+    """Identification result of a single slave address."""
+    address: int
+    name: Optional[str]
+    probes: dict
+    cached: bool
+
+
+class DeviceFingerprinter:
+    """Identify I2C slaves with a batch of identifying reads.
+
+       Each responding address is probed with the reads that are safe for
+       its address range, and the collected values are matched in order
+       against the signature table. PMBus devices latch a CML fault on any
+       unsupported command, so the sensor ID reads are skipped once a
+       PMBus identification block has been read.
+
+       The probe results are cached per adapter serial and address. A
+       cached entry is only trusted once one of its probes, read again,
+       still gives the same value, so that a device swapped in at the
+       same address is probed again; :py:meth:`forget` drops the entries
+       of addresses known to have been vacated.
+
+       A signature is a dictionary with a ``name`` and a ``match``
+       dictionary of probe name to expected value:
+
+       * an integer must match exactly,
+       * a string must prefix the probed string,
+       * a ``[mask, value]`` pair must match the masked probed integer,
+       * ``true``/``false`` must match a boolean probe.
+
+       The name may reference probe values, e.g. ``"TI {ic_device_id}"``.
+    """
+
+    EEPROM_RANGE = range(0x50, 0x58)
+
+    PMBUS_PROBES = (
+        # name, kind, register, length
+        ('pmbus_revision', 'byte', 0x98, 1),
+        ('mfr_id', 'block', 0x99, 32),
+        ('mfr_model', 'block', 0x9a, 32),
+        ('ic_device_id', 'block', 0xad, 32),
+    )
+    """Identifying reads of PMBus devices, on non-EEPROM addresses."""
+
+    SENSOR_PROBES = (
+        ('id_0f', 'word', 0x0f, 2),
+        ('id_fe', 'word', 0xfe, 2),
+        ('id_ff', 'word', 0xff, 2),
+    )
+    """Identifying reads of other devices, on non-EEPROM addresses that
+       are not PMBus devices."""
+
+    EEPROM_PROBES = (
+        ('header', 'header', 0x00, 8),
+    )
+    """Identifying reads on EEPROM addresses."""
+
+    SIGNATURES = [
+        {'name': 'TI {ic_device_id} PMBus sequencer/controller',
+         'match': {'ic_device_id': 'UCD'}},
+        {'name': 'TI {ic_device_id} PMBus device',
+         'match': {'mfr_id': 'TI', 'ic_device_id': ''}},
+        {'name': '{mfr_id} {mfr_model} PMBus device',
+         'match': {'pmbus_revision': [0x00, 0x00], 'mfr_id': '',
+                   'mfr_model': ''}},
+        {'name': 'TI INA226 power monitor',
+         'match': {'id_fe': 0x5449, 'id_ff': [0xfff0, 0x2260]}},
+        {'name': 'TI INA228 power monitor',
+         'match': {'id_fe': 0x5449, 'id_ff': [0xfff0, 0x2280]}},
+        {'name': 'TI INA2xx/TMP4xx device',
+         'match': {'id_fe': 0x5449}},
+        {'name': 'TI TMP117 temperature sensor',
+         'match': {'id_0f': [0x0fff, 0x0117]}},
+        {'name': 'IPMI FRU EEPROM',
+         'match': {'ipmi_fru': True}},
+        {'name': 'EEPROM',
+         'match': {'header': ''}},
+    ]
+    """Built-in signature table, first match wins."""
+
+    CACHE_NAME = 'i2c_fingerprint'
+
+    def __init__(self, i2c: I2cController,
+                 signatures: Optional[List[dict]] = None,
+                 get_port: Optional[Callable[[int], I2cPort]] = None):
+        self.log = getLogger('i2cfinger')
+        self._i2c = i2c
+        # the scanner provides its ports, wrapped by the bus recorder if any
+        self._get_port = get_port or i2c.get_port
+        self._signatures = list(signatures or []) + self.SIGNATURES
+
+    @classmethod
+    def load_signatures(cls, path: str) -> List[dict]:
+        """Load a user signature table from a JSON file.
+
+           User signatures take precedence over the built-in ones.
+
+           :param path: JSON file, a list of signatures
+           :return: signature list
+        """
+        with open(path, 'rt') as sfp:
+            signatures = load(sfp)
+        if not isinstance(signatures, list) or \
+                not all('name' in sig and isinstance(sig.get('match'), dict)
+                        for sig in signatures):
+            raise ValueError(f'Invalid signature table: {path}')
+        return signatures
+
+    def identify(self, addresses: Iterable[int], refresh: bool = False) \
+            -> Dict[int, Fingerprint]:
+        """Fingerprint responding slave addresses.
+
+           :param addresses: addresses known to acknowledge
+           :param refresh: ignore cached probe results
+           :return: fingerprint of each address
+        """
+        serial = adapter_serial(self._i2c.ftdi)
+        cache = load_cache(self.CACHE_NAME)
+        known = cache.setdefault(serial, {})
+        results = {}
+        updated = False
+        for addr in addresses:
+            key = f'0x{addr:02x}'
+            probes = None if refresh else known.get(key)
+            cached = probes is not None and self._still_valid(addr, probes)
+            if not cached:
+                probes = self.probe(addr)
+                known[key] = probes
+                updated = True
+            results[addr] = Fingerprint(addr, self.match(probes), probes,
+                                        cached)
+        if updated:
+            save_cache(self.CACHE_NAME, cache)
+        return results
+
+    def forget(self, addresses: Iterable[int]) -> None:
+        """Drop the cached probe results of slave addresses.
+
+           :param addresses: addresses whose device is gone
+        """
+        cache = load_cache(self.CACHE_NAME)
+        known = cache.get(adapter_serial(self._i2c.ftdi), {})
+        keys = [f'0x{addr:02x}' for addr in addresses]
+        if any(known.pop(key, None) is not None for key in keys):
+            save_cache(self.CACHE_NAME, cache)
+
+    def probe(self, address: int) -> dict:
+        """Run the identifying reads on a slave.
+
+           Registers the device does not acknowledge are omitted.
+
+           :param address: slave address
+           :return: probe values
+        """
+        port = self._get_port(address)
+        probes = {}
+        if address in self.EEPROM_RANGE:
+            tables = (self.EEPROM_PROBES,)
+        else:
+            tables = (self.PMBUS_PROBES, self.SENSOR_PROBES)
+        for table in tables:
+            for name, kind, reg, length in table:
+                value = self._probe_register(port, kind, reg, length)
+                if value is None:
+                    continue
+                if kind == 'header':
+                    probes['ipmi_fru'] = self._is_fru_header(
+                        bytes.fromhex(value))
+                probes[name] = value
+            if any(name in probes for name, kind, _, _ in table
+                   if kind == 'block'):
+                # a PMBus device, do not issue unsupported commands
+                break
+        return probes
+
+    def match(self, probes: dict) -> Optional[str]:
+        """Match probe values against the signature table.
+
+           :param probes: probe values
+           :return: the device name, or None if no signature matches
+        """
+        for signature in self._signatures:
+            if all(self._match_value(probes.get(key), expect)
+                   for key, expect in signature['match'].items()):
+                try:
+                    return signature['name'].format(**probes)
+                except (KeyError, IndexError, ValueError):
+                    return signature['name']
+        return None
+
+    def _still_valid(self, address: int, probes: dict) -> bool:
+        # read again the first cached probe, preferably a short one
+        table = self.EEPROM_PROBES if address in self.EEPROM_RANGE \
+            else self.PMBUS_PROBES + self.SENSOR_PROBES
+        candidates = [probe for probe in table if probe[0] in probes]
+        if not candidates:
+            # nothing answered, nothing to compare
+            return True
+        name, kind, reg, length = min(candidates, key=lambda probe: probe[3])
+        value = self._probe_register(self._get_port(address), kind, reg,
+                                     length)
+        if value != probes[name]:
+            self.log.info('Device at 0x%02x changed', address)
+            return False
+        return True
+
+    def _probe_register(self, port, kind: str, reg: int, length: int) \
+            -> Optional[Union[int, str]]:
+        try:
+            if kind == 'block':
+                data = port.exchange([reg], 1 + length)
+                count = data[0]
+                if not 0 < count <= length:
+                    return None
+                return self._to_text(data[1:1+count]) or None
+            data = port.exchange([reg], length)
+        except (I2cNackError, I2cIOError):
+            return None
+        if kind == 'header':
+            return data.hex()
+        if kind == 'word':
+            # ID registers of sensors are big endian
+            return int.from_bytes(data, 'big')
+        return data[0]
+
+    @staticmethod
+    def _match_value(value, expect: Union[int, str, bool, list]) -> bool:
+        if value is None:
+            return False
+        if isinstance(expect, bool) or isinstance(value, bool):
+            return value is expect
+        if isinstance(expect, str):
+            return isinstance(value, str) and value.startswith(expect)
+        if not isinstance(value, int):
+            return False
+        if isinstance(expect, list):
+            mask, ref = expect
+            return (value & mask) == ref
+        return value == expect
+
+    @staticmethod
+    def _to_text(data: bytes) -> str:
+        text = bytes(data).rstrip(b'\x00\xff').decode('latin-1')
+        return text if text.isprintable() else bytes(data).hex()
+
+    @staticmethod
+    def _is_fru_header(data: bytes) -> bool:
+        # IPMI FRU common header: format version 1, zero checksum
+        return len(data) == 8 and data[0] == 0x01 and not sum(data) & 0xff
@@ -0,0 +1,298 @@
+#!/usr/bin/env python3
+
+"""Bulk I2C EEPROM/FRU reader and writer."""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from logging import getLogger, ERROR
+from sys import modules, stderr
+from time import monotonic
+from traceback import format_exc
+from typing import BinaryIO, Optional, Union
+from pyftdi.i2c import I2cController, I2cIOError, I2cTimeoutError
+
+
+class I2cMemory:
+    """24Cxx-style memory device on an I2C controller.
+
+       Reads are streamed in large sequential chunks. Writes are split on
+       page boundaries, and completion of each internal write cycle is
+       detected with ACK polling rather than a fixed delay.
+
+       Devices whose size exceeds the range of their address bytes (24C04,
+       24C08, 24C16, 24CM01, ...) use the low bits of the slave address as
+       block selector, which is handled transparently.
+    """
+
+    DEVICES = {
+        '24c01': (128, 8, 1),
+        '24c02': (256, 8, 1),
+        '24c04': (512, 16, 1),
+        '24c08': (1024, 16, 1),
+        '24c16': (2048, 16, 1),
+        '24c32': (4096, 32, 2),
+        '24c64': (8192, 32, 2),
+        '24c128': (16384, 64, 2),
+        '24c256': (32768, 64, 2),
+        '24c512': (65536, 128, 2),
+        '24cm01': (131072, 256, 2),
+        '24cm02': (262144, 256, 2),
+    }
+    """Known devices: size, page size, address width in bytes."""
+
+    # largest read pyftdi accepts in a single exchange
+    READ_CHUNK = int(I2cController.PAYLOAD_MAX_LENGTH/3) - 2
+
+    WRITE_TIMEOUT = 0.025
+    """Maximum write cycle duration, in seconds (datasheets say 5-10 ms)."""
+
+    def __init__(self, i2c: I2cController, address: int = 0x50,
+                 size: int = 256, page_size: int = 8, addr_width: int = 1,
+                 write_timeout: float = WRITE_TIMEOUT):
+        if addr_width not in (1, 2):
+            raise ValueError('Unsupported address width')
+        if size <= 0 or page_size <= 0 or size % page_size:
+            raise ValueError('Invalid memory geometry')
+        self.log = getLogger('i2cmem')
+        self._i2c = i2c
+        self._address = address
+        self._size = size
+        self._page_size = page_size
+        self._addr_width = addr_width
+        self._block_size = min(size, 1 << (8*addr_width))
+        self._write_timeout = write_timeout
+        blocks = (size + self._block_size - 1) // self._block_size
+        if blocks > 1:
+            if blocks & (blocks - 1) or address & (blocks - 1):
+                raise ValueError('Block select bits overlap slave address')
+        self._i2c.validate_address(address + blocks - 1)
+
+    @classmethod
+    def from_device(cls, i2c: I2cController, device: str,
+                    address: int = 0x50) -> 'I2cMemory':
+        """Create a memory instance from a known device name.
+
+           :param i2c: a configured I2C controller
+           :param device: device name, see DEVICES
+           :param address: base slave address
+           :return: memory instance
+        """
+        try:
+            size, page_size, addr_width = cls.DEVICES[device.lower()]
+        except KeyError as exc:
+            raise ValueError(f'Unknown memory device: {device}') from exc
+        return cls(i2c, address, size, page_size, addr_width)
+
+    @property
+    def size(self) -> int:
+        """Memory size in bytes."""
+        return self._size
+
+    @property
+    def page_size(self) -> int:
+        """Write page size in bytes."""
+        return self._page_size
+
+    def read(self, offset: int = 0, length: Optional[int] = None) -> bytes:
+        """Read a memory range.
+
+           :param offset: start offset
+           :param length: count of bytes, default to the end of the memory
+           :return: read bytes
+        """
+        length = self._check_range(offset, length)
+        buf = bytearray(length)
+        self.read_into(offset, buf)
+        return bytes(buf)
+
+    def read_into(self, offset: int, buf: Union[bytearray, memoryview]) \
+            -> None:
+        """Read a memory range into a caller-supplied buffer.
+
+           :param offset: start offset
+           :param buf: writable buffer, its length defines the range size
+        """
+        view = memoryview(buf).cast('B')
+        length = self._check_range(offset, len(view))
+        pos = 0
+        for start, size in self._chunks(offset, length, self.READ_CHUNK,
+                                        self._block_size):
+            addr, out = self._locate(start)
+            view[pos:pos+size] = self._i2c.exchange(addr, out, size)
+            pos += size
+
+    def dump(self, stream: BinaryIO, offset: int = 0,
+             length: Optional[int] = None) -> int:
+        """Stream a memory range to a file-like object.
+
+           Only one chunk is held in memory at a time.
+
+           :param stream: binary output stream
+           :param offset: start offset
+           :param length: count of bytes, default to the end of the memory
+           :return: count of written bytes
+        """
+        length = self._check_range(offset, length)
+        for start, size in self._chunks(offset, length, self.READ_CHUNK,
+                                        self._block_size):
+            addr, out = self._locate(start)
+            stream.write(self._i2c.exchange(addr, out, size))
+        return length
+
+    def write(self, offset: int, data: Union[bytes, bytearray]) -> None:
+        """Write a memory range.
+
+           The range is split on page boundaries; the first and last pages
+           may be partial. Each page write waits for the device write cycle
+           completion with ACK polling.
+
+           :param offset: start offset
+           :param data: bytes to write
+        """
+        data = memoryview(bytes(data))
+        self._check_range(offset, len(data))
+        pos = 0
+        for start, size in self._chunks(offset, len(data), self._page_size,
+                                        self._page_size):
+            addr, out = self._locate(start)
+            out.extend(data[pos:pos+size])
+            self._i2c.write(addr, out)
+            self._wait_ready(addr)
+            pos += size
+
+    def verify(self, offset: int, data: Union[bytes, bytearray]) \
+            -> Optional[int]:
+        """Compare a memory range with reference data.
+
+           :param offset: start offset
+           :param data: expected content
+           :return: offset of the first mismatch, or None if identical
+        """
+        data = memoryview(bytes(data))
+        self._check_range(offset, len(data))
+        pos = 0
+        for start, size in self._chunks(offset, len(data), self.READ_CHUNK,
+                                        self._block_size):
+            addr, out = self._locate(start)
+            chunk = self._i2c.exchange(addr, out, size)
+            if chunk != data[pos:pos+size]:
+                for idx, byte in enumerate(chunk):
+                    if byte != data[pos+idx]:
+                        return start + idx
+            pos += size
+        return None
+
+    def program(self, offset: int, data: Union[bytes, bytearray]) -> None:
+        """Write then verify a memory range.
+
+           :param offset: start offset
+           :param data: bytes to write
+           :raise I2cIOError: if the verification fails
+        """
+        self.write(offset, data)
+        mismatch = self.verify(offset, data)
+        if mismatch is not None:
+            raise I2cIOError(f'Verification failed @ 0x{mismatch:x}')
+
+    def _check_range(self, offset: int, length: Optional[int]) -> int:
+        if length is None:
+            length = self._size - offset
+        if offset < 0 or length < 0 or offset + length > self._size:
+            raise ValueError('Out of memory range')
+        return length
+
+    @staticmethod
+    def _chunks(offset: int, length: int, limit: int, boundary: int):
+        # never cross a page/block boundary: sequential access wraps there
+        end = offset + length
+        while offset < end:
+            size = min(limit, end - offset,
+                       boundary - (offset % boundary))
+            yield offset, size
+            offset += size
+
+    def _locate(self, offset: int):
+        block = offset // self._block_size
+        local = offset % self._block_size
+        out = bytearray(local.to_bytes(self._addr_width, 'big'))
+        return self._address + block, out
+
+    def _wait_ready(self, address: int) -> None:
+        # the device does not acknowledge its address till the write cycle
+        # is over
+        deadline = monotonic() + self._write_timeout
+        while not self._i2c.poll(address, write=True):
+            if monotonic() > deadline:
+                raise I2cTimeoutError(f'Write cycle timeout @ 0x{address:x}')
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('action', choices=('read', 'write', 'verify'),
+                               help='operation to perform')
+        argparser.add_argument('file',
+                               help='image file (read: output, '
+                                    'write/verify: input)')
+        argparser.add_argument('device', nargs='?', default='ftdi:///1',
+                               help='serial port device name')
+        argparser.add_argument('-t', '--type', default='24c02',
+                               choices=sorted(I2cMemory.DEVICES),
+                               help='memory device type')
+        argparser.add_argument('-a', '--address', default='0x50',
+                               help='base slave address')
+        argparser.add_argument('-o', '--offset', default='0',
+                               help='start offset')
+        argparser.add_argument('-l', '--length',
+                               help='count of bytes to read')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=I2cController.HIGH_BUS_FREQUENCY,
+                               help='I2C bus frequency in Hz')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        getLogger('pyftdi.i2c').setLevel(ERROR)
+        offset = int(args.offset, 0)
+        i2c = I2cController()
+        try:
+            i2c.configure(args.device, frequency=args.frequency)
+            mem = I2cMemory.from_device(i2c, args.type, int(args.address, 0))
+            if args.action == 'read':
+                length = int(args.length, 0) if args.length else None
+                with open(args.file, 'wb') as bfp:
+                    count = mem.dump(bfp, offset, length)
+                print(f'read {count} bytes')
+            elif args.action == 'write':
+                with open(args.file, 'rb') as bfp:
+                    data = bfp.read()
+                mem.program(offset, data)
+                print(f'wrote and verified {len(data)} bytes')
+            else:
+                with open(args.file, 'rb') as bfp:
+                    data = bfp.read()
+                mismatch = mem.verify(offset, data)
+                if mismatch is not None:
+                    raise ValueError(f'Mismatch @ 0x{mismatch:x}')
+                print(f'verified {len(data)} bytes')
+        finally:
+            i2c.terminate()
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
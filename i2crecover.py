@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+
+"""I2C transaction retry and bus recovery.
+
+   Retry transient NACKs with a bounded backoff, and recover a stuck bus in
+   place by clocking SCL until the slaves release SDA, without reopening
+   the adapter.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from logging import getLogger
+from math import ceil
+from sys import modules, stderr
+from time import sleep
+from traceback import format_exc
+from typing import Optional
+from pyftdi.ftdi import Ftdi
+from pyftdi.i2c import I2cController, I2cIOError
+
+
+def bus_clear(i2c: I2cController, clocks: int = 9) -> bool:
+    """Recover a bus whose SDA line is held low by a slave.
+
+       A slave interrupted in the middle of a read keeps driving SDA until
+       it has shifted out its byte. Up to nine SCL pulses with SDA released
+       let it complete, then a START and a STOP condition reset the slave
+       state machines. The FTDI buffers are purged first, to drop any
+       pending transfer.
+
+       :param i2c: a configured I2C controller
+       :param clocks: SCL pulse count
+       :return: whether SDA is released once done
+    """
+    if not i2c.configured:
+        raise I2cIOError("FTDI controller not initialized")
+    ftdi = i2c.ftdi
+    # each waveform command lasts one MPSSE command time, repeat them to
+    # honour the SCL high and low durations at the bus frequency
+    repeat = max(1, ceil(0.5 / i2c.frequency / ftdi.mpsse_bit_delay))
+    with i2c._lock:
+        ftdi.purge_buffers()
+        cmd = bytearray(i2c._idle * repeat)
+        for _ in range(clocks):
+            if i2c._fake_tristate:
+                cmd.extend(i2c._clk_lo_data_input * repeat)
+            else:
+                cmd.extend(i2c._clk_lo_data_hi * repeat)
+            cmd.extend(i2c._idle * repeat)
+        cmd.extend(i2c._start)
+        cmd.extend(i2c._stop)
+        cmd.extend(i2c._idle)
+        cmd.extend((Ftdi.GET_BITS_LOW, Ftdi.SEND_IMMEDIATE))
+        ftdi.write_data(cmd)
+        data = ftdi.read_data_bytes(1, 4)
+    if not data:
+        raise I2cIOError('No answer from FTDI')
+    return bool(data[0] & I2cController.SDA_I_BIT)
+
+
+class RetryStats:
+    """Retry counters of a RetryPolicy."""
+
+    def __init__(self):
+        self.transfers = 0
+        """Transactions run."""
+        self.retried = 0
+        """Transactions that needed at least one retry."""
+        self.retries = 0
+        """Retries, all transactions included."""
+        self.bus_clears = 0
+        """Bus recoveries."""
+        self.failures = 0
+        """Transactions that failed after all retries."""
+        self.max_attempts = 0
+        """Highest attempt count of a successful transaction."""
+
+    def as_dict(self) -> dict:
+        """Counters as a dictionary."""
+        return dict(vars(self))
+
+    def reset(self) -> None:
+        """Reset all counters."""
+        self.__init__()
+
+
+class RetryPolicy:
+    """Retry failed UCD92xx transactions.
+
+       A failed transaction is retried after a delay that starts at
+       ``backoff`` and is multiplied by ``factor`` on each retry, up to
+       ``backoff_max``. From the ``clear_after``-th consecutive failure on,
+       each retry is preceded by a bus clear, after which the tracked PMBus
+       page is written again, as the failed transaction may have been a
+       PAGE write or the device may have been reset.
+
+       The policy is meant for a single device, whose counters it holds in
+       :py:attr:`stats`.
+
+       :param retries: retry count, after the first attempt
+       :param backoff: first retry delay, in seconds
+       :param backoff_max: highest retry delay, in seconds
+       :param factor: backoff multiplier
+       :param clear_after: consecutive failures before bus clears, 0 to
+                           never clear the bus
+    """
+
+    def __init__(self, retries: int = 3, backoff: float = 0.0002,
+                 backoff_max: float = 0.005, factor: float = 2.0,
+                 clear_after: int = 2):
+        if retries < 0 or backoff < 0 or backoff_max < backoff or \
+                factor < 1 or clear_after < 0:
+            raise ValueError('Invalid retry policy')
+        self.log = getLogger('i2crecover')
+        self.retries = retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.factor = factor
+        self.clear_after = clear_after
+        self.stats = RetryStats()
+
+    def run(self, device, out: bytes, readlen: int = 0) -> Optional[bytes]:
+        """Run a transaction with retries.
+
+           :param device: UCD92xx device
+           :param out: command code and data to write
+           :param readlen: count of bytes to read
+           :return: bytes read, None for a write
+           :raise I2cIOError: if all attempts failed
+        """
+        stats = self.stats
+        stats.transfers += 1
+        delay = self.backoff
+        failures = 0
+        while True:
+            try:
+                data = device.transact(out, readlen)
+            except I2cIOError as exc:
+                failures += 1
+                if failures > self.retries:
+                    stats.failures += 1
+                    raise
+                self.log.info('0x%02x failed (%s), retry #%d', out[0], exc,
+                              failures)
+                stats.retries += 1
+                if failures == 1:
+                    stats.retried += 1
+                sleep(delay)
+                delay = min(delay * self.factor, self.backoff_max)
+                if self.clear_after and failures >= self.clear_after:
+                    self._recover(device, out[0])
+                continue
+            stats.max_attempts = max(stats.max_attempts, failures + 1)
+            return data
+
+    def _recover(self, device, command: int) -> None:
+        self.stats.bus_clears += 1
+        try:
+            if not bus_clear(device.i2c_master):
+                self.log.warning('SDA still held low after bus clear')
+            if command != device.commands.page and device.page is not None:
+                device.transact(bytes((device.commands.page, device.page)))
+        except I2cIOError as exc:
+            # let the next attempt fail and count
+            self.log.info('Recovery failed: %s', exc)
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('device', nargs='?', default='ftdi:///?',
+                               help='serial port device name')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=100000,
+                               help='I2C bus frequency, in Hz')
+        argparser.add_argument('-c', '--clocks', type=int, default=9,
+                               help='SCL pulse count')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        i2c = I2cController()
+        i2c.configure(args.device, frequency=args.frequency)
+        try:
+            released = bus_clear(i2c, args.clocks)
+        finally:
+            i2c.terminate()
+        print('Bus released' if released else 'SDA still held low')
+        if not released:
+            exit(3)
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
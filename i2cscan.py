@@ -12,13 +12,18 @@
 #pylint: disable-msg=too-few-public-methods
 
 from argparse import ArgumentParser, FileType
+from json import dumps
 from logging import Formatter, StreamHandler, getLogger, DEBUG, ERROR
-from sys import modules, stderr
+from math import ceil
+from sys import modules, stderr, stdout
+from time import monotonic, sleep, time
 from traceback import format_exc
+from typing import List, Optional, TextIO
 from pyftdi import FtdiLogger
 from pyftdi.ftdi import Ftdi
-from pyftdi.i2c import I2cController, I2cNackError
+from pyftdi.i2c import I2cController, I2cNackError, I2cPort
 from pyftdi.misc import add_custom_devices
+from busrec import BusRecorder
 
 
 class I2cBusScanner:
@@ -33,45 +38,41 @@ class I2cBusScanner:
     HIGHEST_I2C_SLAVE_ADDRESS = 0x78
 
     @classmethod
-    def scan(cls, url: str, smb_mode: bool = True, force: bool = False) \
-            -> None:
+    def scan(cls, url: str, smb_mode: bool = True, force: bool = False,
+             fingerprint: bool = False, refresh: bool = False,
+             signatures: Optional[str] = None,
+             recorder: Optional[BusRecorder] = None) -> None:
         """Scan an I2C bus to detect slave device.
 
            :param url: FTDI URL
            :param smb_mode: whether to use SMBbus restrictions or regular I2C
                             mode.
+           :param force: force clock mode (for FT2232D)
+           :param fingerprint: identify each responding slave
+           :param refresh: ignore cached fingerprints
+           :param signatures: optional JSON file of extra device signatures
+           :param recorder: optional bus traffic recorder
         """
         i2c = I2cController()
         slaves = []
+        fingerprints = {}
         getLogger('pyftdi.i2c').setLevel(ERROR)
         try:
             i2c.set_retry_count(1)
             i2c.force_clock_mode(force)
             i2c.configure(url)
-            for addr in range(cls.HIGHEST_I2C_SLAVE_ADDRESS+1):
-                port = i2c.get_port(addr)
-                if smb_mode:
-                    try:
-                        if addr in cls.SMB_READ_RANGE:
-                            port.read(0)
-                            slaves.append('R')
-                        else:
-                            port.write([])
-                            slaves.append('W')
-                    except I2cNackError:
-                        slaves.append('.')
-                else:
-                    try:
-                        port.read(0)
-                        slaves.append('R')
-                        continue
-                    except I2cNackError:
-                        pass
-                    try:
-                        port.write([])
-                        slaves.append('W')
-                    except I2cNackError:
-                        slaves.append('.')
+            ports = cls._ports(i2c, recorder)
+            for addr, port in enumerate(ports):
+                slaves.append(cls._probe(port, addr, smb_mode))
+            if fingerprint:
+                #pylint: disable-msg=import-outside-toplevel
+                from i2cfinger import DeviceFingerprinter
+                extra = DeviceFingerprinter.load_signatures(signatures) \
+                    if signatures else None
+                finger = DeviceFingerprinter(i2c, extra, ports.__getitem__)
+                fingerprints = finger.identify(
+                    [addr for addr, mode in enumerate(slaves) if mode != '.'],
+                    refresh)
         finally:
             i2c.terminate()
         columns = 16
@@ -83,6 +84,159 @@ class I2cBusScanner:
                 break
             print(' %1X:' % (row//columns), '  '.join(chunk))
             row += columns
+        for addr, finger in sorted(fingerprints.items()):
+            print(' 0x%02X: %s%s' % (addr, finger.name or 'unknown',
+                                     ' (cached)' if finger.cached else ''))
+
+    @classmethod
+    def watch(cls, url: str, smb_mode: bool = True, force: bool = False,
+              interval: float = 0.1, empty_interval: float = 1.0,
+              count: Optional[int] = None, out: TextIO = stdout,
+              recorder: Optional[BusRecorder] = None,
+              fingerprint: bool = False, refresh: bool = False,
+              signatures: Optional[str] = None) -> None:
+        """Watch an I2C bus for slave devices appearing or disappearing.
+
+           The controller is kept open for the whole session. After a first
+           full pass, known-present addresses are re-probed every interval,
+           while empty addresses are re-probed round-robin so that each of
+           them is visited about every empty_interval.
+
+           Each change is emitted as a JSON object, one per line::
+
+             {"event": "add", "address": 52, "mode": "W", "time": ...}
+             {"event": "remove", "address": 52, "time": ...}
+
+           A ``ready`` event, listing the present addresses, marks the end
+           of the first full pass.
+
+           When fingerprinting, ``add`` events also carry the ``name`` of the
+           identified device, and the cached fingerprint of a removed device
+           is dropped, so that another device plugged at the same address is
+           probed again.
+
+           :param url: FTDI URL
+           :param smb_mode: whether to use SMBbus restrictions or regular I2C
+                            mode.
+           :param force: force clock mode (for FT2232D)
+           :param interval: re-probe period of present addresses, in seconds
+           :param empty_interval: re-probe period of empty addresses, in
+                                  seconds
+           :param count: number of incremental passes, or None to run till
+                         interrupted
+           :param out: event output stream
+           :param recorder: optional bus traffic recorder
+           :param fingerprint: identify each appearing slave
+           :param refresh: ignore cached fingerprints on the first pass
+           :param signatures: optional JSON file of extra device signatures
+        """
+        i2c = I2cController()
+        getLogger('pyftdi.i2c').setLevel(ERROR)
+        try:
+            i2c.set_retry_count(1)
+            i2c.force_clock_mode(force)
+            i2c.configure(url)
+            ports = cls._ports(i2c, recorder)
+            finger = None
+            if fingerprint:
+                #pylint: disable-msg=import-outside-toplevel
+                from i2cfinger import DeviceFingerprinter
+                extra = DeviceFingerprinter.load_signatures(signatures) \
+                    if signatures else None
+                finger = DeviceFingerprinter(i2c, extra, ports.__getitem__)
+
+            def added(addr: int, mode: str) -> None:
+                if finger:
+                    found = finger.identify([addr], refresh)[addr]
+                    cls._emit(out, 'add', addr, mode, name=found.name)
+                else:
+                    cls._emit(out, 'add', addr, mode)
+
+            present = {}
+            for addr, port in enumerate(ports):
+                mode = cls._probe(port, addr, smb_mode)
+                if mode != '.':
+                    present[addr] = mode
+                    added(addr, mode)
+            refresh = False
+            cls._emit(out, 'ready', present=sorted(present))
+            # count of empty addresses to visit on each pass
+            ratio = interval / max(empty_interval, interval)
+            cursor = 0
+            deadline = monotonic()
+            while count is None or count > 0:
+                if count is not None:
+                    count -= 1
+                deadline += interval
+                delay = deadline - monotonic()
+                if delay > 0:
+                    sleep(delay)
+                else:
+                    # do not try to catch up with missed passes
+                    deadline = monotonic()
+                for addr in sorted(present):
+                    if cls._probe(ports[addr], addr, smb_mode) == '.':
+                        del present[addr]
+                        if finger:
+                            finger.forget([addr])
+                        cls._emit(out, 'remove', addr)
+                empty = [addr for addr in range(len(ports))
+                         if addr not in present]
+                if not empty:
+                    continue
+                batch = min(len(empty), max(1, ceil(len(empty) * ratio)))
+                for pos in range(batch):
+                    addr = empty[(cursor + pos) % len(empty)]
+                    mode = cls._probe(ports[addr], addr, smb_mode)
+                    if mode != '.':
+                        present[addr] = mode
+                        added(addr, mode)
+                cursor = (cursor + batch) % len(empty)
+        finally:
+            i2c.terminate()
+
+    @classmethod
+    def _ports(cls, i2c: I2cController,
+               recorder: Optional[BusRecorder]) -> List[I2cPort]:
+        ports = [i2c.get_port(addr)
+                 for addr in range(cls.HIGHEST_I2C_SLAVE_ADDRESS+1)]
+        if recorder:
+            ports = [recorder.port(port) for port in ports]
+        return ports
+
+    @classmethod
+    def _probe(cls, port: I2cPort, addr: int, smb_mode: bool) -> str:
+        if smb_mode:
+            try:
+                if addr in cls.SMB_READ_RANGE:
+                    port.read(0)
+                    return 'R'
+                port.write([])
+                return 'W'
+            except I2cNackError:
+                return '.'
+        try:
+            port.read(0)
+            return 'R'
+        except I2cNackError:
+            pass
+        try:
+            port.write([])
+            return 'W'
+        except I2cNackError:
+            return '.'
+
+    @staticmethod
+    def _emit(out: TextIO, event: str, addr: Optional[int] = None,
+              mode: Optional[str] = None, **kwargs) -> None:
+        record = {'event': event}
+        if addr is not None:
+            record['address'] = addr
+        if mode is not None:
+            record['mode'] = mode
+        record.update(kwargs)
+        record['time'] = time()
+        print(dumps(record), file=out, flush=True)
 
 
 def main():
@@ -106,6 +260,24 @@ def main():
                                help='enable debug mode')
         argparser.add_argument('-F', '--force', action='store_true',
                                help='force clock mode (for FT2232D)')
+        argparser.add_argument('-w', '--watch', action='store_true',
+                               help='keep watching the bus, emit JSON '
+                                    'add/remove events')
+        argparser.add_argument('-i', '--interval', type=float, default=0.1,
+                               help='watch: re-probe period of present '
+                                    'addresses, in seconds')
+        argparser.add_argument('-e', '--empty-interval', type=float,
+                               default=1.0,
+                               help='watch: re-probe period of empty '
+                                    'addresses, in seconds')
+        argparser.add_argument('-f', '--fingerprint', action='store_true',
+                               help='identify responding devices')
+        argparser.add_argument('-r', '--refresh', action='store_true',
+                               help='ignore cached fingerprints')
+        argparser.add_argument('-s', '--signatures',
+                               help='JSON file of extra device signatures')
+        argparser.add_argument('-R', '--record',
+                               help='record bus traffic into a file')
         args = argparser.parse_args()
         debug = args.debug
 
@@ -138,7 +310,22 @@ def main():
         except ValueError as exc:
             argparser.error(str(exc))
 
-        I2cBusScanner.scan(args.device, not args.no_smb, args.force)
+        recorder = BusRecorder(args.record) if args.record else None
+        try:
+            if args.watch:
+                I2cBusScanner.watch(args.device, not args.no_smb, args.force,
+                                    args.interval, args.empty_interval,
+                                    recorder=recorder,
+                                    fingerprint=args.fingerprint,
+                                    refresh=args.refresh,
+                                    signatures=args.signatures)
+            else:
+                I2cBusScanner.scan(args.device, not args.no_smb, args.force,
+                                   args.fingerprint, args.refresh,
+                                   args.signatures, recorder)
+        finally:
+            if recorder:
+                recorder.close()
 
     except (ImportError, IOError, NotImplementedError, ValueError) as exc:
         print('\nError: %s' % exc, file=stderr)
@@ -0,0 +1,289 @@
+#!/usr/bin/env python3
+
+"""Voltage margining sweep of UCD92xx rails.
+
+   Step VOUT_COMMAND across a range on one or more rails, wait for the
+   output to settle at each step, and collect the rail telemetry into
+   NumPy arrays.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from logging import getLogger
+from sys import modules, stderr
+from time import perf_counter, sleep
+from traceback import format_exc
+from typing import Callable, Dict, Optional, Sequence
+import numpy as np
+from pmbus import UCD92xx
+
+
+class MarginResult:
+    """Sweep results, as arrays of shape (pages, steps).
+
+       ``target`` holds the commanded voltages, ``settled`` whether the
+       settle condition was met, ``settle_time`` the time from the
+       VOUT_COMMAND write to the recorded sample, and one array per read
+       command (NaN where the read failed).
+    """
+
+    def __init__(self, pages: Sequence[int], reads: Sequence[str],
+                 steps: int):
+        shape = (len(pages), steps)
+        self.pages = np.array(pages, dtype=np.uint8)
+        self.target = np.full(shape, np.nan)
+        self.settled = np.zeros(shape, dtype=bool)
+        self.settle_time = np.full(shape, np.nan)
+        self.values: Dict[str, np.ndarray] = \
+            {name: np.full(shape, np.nan) for name in reads}
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.values[name]
+
+    def arrays(self) -> Dict[str, np.ndarray]:
+        """All result arrays, by name."""
+        arrays = {'page': self.pages, 'target': self.target,
+                  'settled': self.settled, 'settle_time': self.settle_time}
+        arrays.update(self.values)
+        return arrays
+
+    def save(self, path: str) -> None:
+        """Export the results.
+
+           A ``.csv`` path is written as one row per page and step, any other
+           path as a NumPy ``.npz`` archive.
+
+           :param path: output file
+        """
+        if not path.endswith('.csv'):
+            np.savez(path, **self.arrays())
+            return
+        rows, steps = self.target.shape
+        columns = ['target', 'settled', 'settle_time'] + list(self.values)
+        table = np.column_stack(
+            [np.repeat(self.pages, steps), np.tile(np.arange(steps), rows)] +
+            [self.arrays()[name].ravel().astype(np.float64)
+             for name in columns])
+        np.savetxt(path, table, delimiter=',', fmt='%.6g', comments='',
+                   header=','.join(['page', 'step'] + columns))
+
+
+class MarginSweep:
+    """Characterize rails across a range of output voltages.
+
+       All rails are stepped together: at each step, the VOUT_COMMAND writes
+       of every rail are issued in one batch, then every rail that has not
+       settled yet is read in one batch per poll. A rail is settled when its
+       READ_VOUT is within ``tolerance`` of the target, unless a custom
+       ``settle`` condition is given. The original VOUT_COMMAND of each rail
+       is restored once the sweep completes or fails. If the restore fails
+       after a failed sweep, it is logged and the sweep error is raised.
+
+       Targets outside the UV/OV fault limits or above VOUT_MAX are refused,
+       as they would trip or be clamped by the sequencer.
+
+       :param device: UCD92xx device
+       :param pages: rails to sweep
+       :param reads: commands to sample at each step
+       :param tolerance: settle tolerance on READ_VOUT, in volts
+       :param timeout: maximum settle time per step, in seconds
+       :param interval: settle poll period, in seconds
+       :param settle: custom settle condition, called with the page, the
+                      target voltage and the sampled values
+    """
+
+    READS = ('read_vout', 'read_iout', 'read_temperature_1', 'status_word')
+
+    def __init__(self, device: UCD92xx, pages: Sequence[int],
+                 reads: Sequence[str] = READS, tolerance: float = 0.01,
+                 timeout: float = 1.0, interval: float = 0.005,
+                 settle: Optional[Callable[[int, float, dict], bool]] = None):
+        if not pages:
+            raise ValueError('No page to sweep')
+        if settle is None and 'read_vout' not in reads:
+            raise ValueError('read_vout is required to detect settling')
+        self.log = getLogger('margin')
+        self._device = device
+        self._pages = list(pages)
+        self._reads = list(reads)
+        self._tolerance = tolerance
+        self._timeout = timeout
+        self._interval = interval
+        self._settle = settle or self._vout_settled
+
+    def targets(self, low: float, high: float, steps: int,
+                relative: bool = True) -> np.ndarray:
+        """Compute the target voltages of a linear sweep.
+
+           :param low: first voltage, or ratio to the nominal voltage
+           :param high: last voltage, or ratio to the nominal voltage
+           :param steps: step count
+           :param relative: low and high are relative to the current
+                            VOUT_COMMAND of each rail, e.g. -0.05 for -5%
+           :return: array of shape (pages, steps)
+        """
+        if steps < 1:
+            raise ValueError('At least one step is required')
+        ramp = np.linspace(low, high, steps)
+        if not relative:
+            return np.tile(ramp, (len(self._pages), 1))
+        nominal = self._read_all('vout_command')
+        return np.outer(nominal, 1.0 + ramp)
+
+    def run(self, targets: np.ndarray) -> MarginResult:
+        """Run the sweep.
+
+           :param targets: target voltages, of shape (pages, steps), see
+                           :py:meth:`targets`
+           :return: the sweep results
+        """
+        targets = np.asarray(targets, dtype=np.float64)
+        if targets.ndim != 2 or targets.shape[0] != len(self._pages):
+            raise ValueError('Targets do not match the swept pages')
+        self._check_limits(targets)
+        result = MarginResult(self._pages, self._reads, targets.shape[1])
+        result.target[:] = targets
+        nominal = self._read_all('vout_command')
+        try:
+            for step in range(targets.shape[1]):
+                self._run_step(step, targets[:, step], result)
+        except BaseException:
+            try:
+                self._restore(nominal)
+            except Exception as exc:
+                # do not hide the root cause
+                self.log.error('Cannot restore VOUT_COMMAND: %s', exc)
+            raise
+        self._restore(nominal)
+        return result
+
+    def _restore(self, nominal: np.ndarray) -> None:
+        batch = self._device.batch()
+        for page, vout in zip(self._pages, nominal):
+            batch.write('vout_command', vout, page)
+        batch.execute()
+
+    def _run_step(self, step: int, targets: np.ndarray,
+                  result: MarginResult) -> None:
+        batch = self._device.batch()
+        for page, vout in zip(self._pages, targets):
+            batch.write('vout_command', float(vout), page)
+        batch.execute()
+        start = perf_counter()
+        pending = dict(enumerate(self._pages))
+        while pending:
+            batch = self._device.batch()
+            for row, page in pending.items():
+                for name in self._reads:
+                    batch.read(name, page, (row, name))
+            values = batch.execute(check=False)
+            now = perf_counter() - start
+            timed_out = now >= self._timeout
+            for row, page in list(pending.items()):
+                sample = {name: values.get((row, name))
+                          for name in self._reads}
+                settled = self._settle(page, float(targets[row]), sample)
+                if not (settled or timed_out):
+                    continue
+                del pending[row]
+                result.settled[row, step] = settled
+                result.settle_time[row, step] = now
+                for name, value in sample.items():
+                    if value is not None:
+                        result.values[name][row, step] = value
+            if pending:
+                sleep(self._interval)
+
+    def _vout_settled(self, page: int, target: float, sample: dict) -> bool:
+        #pylint: disable-msg=unused-argument
+        vout = sample.get('read_vout')
+        return vout is not None and abs(vout - target) <= self._tolerance
+
+    def _check_limits(self, targets: np.ndarray) -> None:
+        vmax = self._read_all('vout_max')
+        ov_fault = self._read_all('vout_ov_fault_limit')
+        uv_fault = self._read_all('vout_uv_fault_limit')
+        for row, page in enumerate(self._pages):
+            low, high = targets[row].min(), targets[row].max()
+            if high > min(vmax[row], ov_fault[row]) or low < uv_fault[row]:
+                raise ValueError(f'Page {page}: targets {low:.3f}..'
+                                 f'{high:.3f}V exceed limits '
+                                 f'{uv_fault[row]:.3f}..'
+                                 f'{min(vmax[row], ov_fault[row]):.3f}V')
+
+    def _read_all(self, name: str) -> np.ndarray:
+        batch = self._device.batch()
+        for row, page in enumerate(self._pages):
+            batch.read(name, page, row)
+        values = batch.execute()
+        return np.array([values[row] for row in range(len(self._pages))])
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('-u', '--url',
+                               help='FTDI interface URL')
+        argparser.add_argument('-a', '--address', default='0x34',
+                               help='PMBus slave address')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=100000,
+                               help='I2C bus frequency, in Hz')
+        argparser.add_argument('-p', '--pages', default='0',
+                               help='comma-separated rails to sweep')
+        argparser.add_argument('-l', '--low', type=float, default=-0.05,
+                               help='first step, ratio to nominal or volts')
+        argparser.add_argument('-H', '--high', type=float, default=0.05,
+                               help='last step, ratio to nominal or volts')
+        argparser.add_argument('-n', '--steps', type=int, default=11,
+                               help='step count')
+        argparser.add_argument('-A', '--absolute', action='store_true',
+                               help='low and high are voltages')
+        argparser.add_argument('-t', '--tolerance', type=float, default=0.01,
+                               help='settle tolerance, in volts')
+        argparser.add_argument('-T', '--timeout', type=float, default=1.0,
+                               help='settle timeout per step, in seconds')
+        argparser.add_argument('-o', '--output',
+                               help='export results (.npz or .csv)')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        pages = [int(page, 0) for page in args.pages.split(',')]
+        device = UCD92xx(int(args.address, 0), args.frequency, url=args.url)
+        try:
+            sweep = MarginSweep(device, pages, tolerance=args.tolerance,
+                                timeout=args.timeout)
+            targets = sweep.targets(args.low, args.high, args.steps,
+                                    not args.absolute)
+            result = sweep.run(targets)
+        finally:
+            device.close()
+        for row, page in enumerate(pages):
+            for step in range(targets.shape[1]):
+                values = ' '.join(f'{name}={result[name][row, step]:.4g}'
+                                  for name in result.values)
+                print(f'page {page} {result.target[row, step]:.4f}V '
+                      f'{"ok " if result.settled[row, step] else "NOK"} '
+                      f'{result.settle_time[row, step]*1E3:7.1f}ms {values}')
+        if args.output:
+            result.save(args.output)
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
@@ -4,15 +4,105 @@ from io import StringIO
 from contextlib import redirect_stdout
 from collections import namedtuple
 import struct
-from pyftdi.i2c import I2cController, I2cNackError
+from types import SimpleNamespace
+from typing import Optional
 from time import sleep
-from pyftdi.ftdi import Ftdi
+# pyftdi, and i2cbatch which depends on it, are only imported on first use:
+# importing them costs more than all the rest of this module
 
 def toNametuple(dict_data) -> namedtuple:
     return namedtuple("X", dict_data.keys())(*tuple(map(
         lambda x: x if not isinstance(x, dict) else toNametuple(x),
         dict_data.values())))
 
+VerifyResult = namedtuple('VerifyResult',
+                          'name page value expected readback ok')
+"""Outcome of a verified write: the requested value, the value actually
+   encoded, the decoded readback (None if not read back) and the verdict."""
+
+# precompiled struct codecs, shared by all PMBus accessors
+U8 = struct.Struct('<B')
+U16_LE = struct.Struct('<H')
+U16_BE = struct.Struct('>H')
+U32_LE = struct.Struct('<I')
+U32_BE = struct.Struct('>I')
+
+def _decode_byte(dev, data):
+    return data[0]
+
+def _decode_word(dev, data):
+    return U16_LE.unpack(data)[0]
+
+def _decode_lin11(dev, data):
+    return dev.decode_lin11(U16_LE.unpack(data)[0])
+
+def _decode_ulin16(dev, data):
+    return dev.decode_ulin16(U16_LE.unpack(data)[0])
+
+def _decode_slin16(dev, data):
+    return dev.decode_slin16(U16_LE.unpack(data)[0])
+
+def _decode_block(dev, data):
+    return bytes(data[1:1+data[0]])
+
+def _decode_raw(dev, data):
+    return bytes(data)
+
+def _encode_byte(dev, value):
+    return U8.pack(value)
+
+def _encode_word(dev, value):
+    return U16_LE.pack(value)
+
+def _encode_lin11(dev, value):
+    return U16_LE.pack(dev.encode_lin11(value, dev.lin11_exponent(value)))
+
+def _encode_ulin16(dev, value):
+    return U16_LE.pack(dev.encode_ulin16(value))
+
+def _encode_slin16(dev, value):
+    return U16_LE.pack(dev.encode_slin16(value))
+
+def _encode_block(dev, value):
+    return U8.pack(len(value)) + bytes(value)
+
+def _stale_page_steps(page_steps, failed, count: int) -> set:
+    # steps that followed a PAGE write that failed, up to the next
+    # successful one: they reached the previously selected page
+    failed = set(failed)
+    stale = set()
+    lost = False
+    for step in range(min(failed, default=count), count):
+        if step in page_steps:
+            lost = step in failed
+        elif lost:
+            stale.add(step)
+    return stale
+
+def build_command_table(commands: dict, formats: dict, block_length: int) \
+        -> dict:
+    """
+    Build the PMBus accessor table.
+
+    Args:
+        commands (dict): command name to command code
+        formats (dict): command name to data format
+        block_length (int): maximum length of block reads
+
+    Returns:
+        dict: command name to (code, format, read length, decoder, encoder),
+              read length is None for send-byte commands
+    """
+    codecs = {'send': (None, None, None),
+              'byte': (1, _decode_byte, _encode_byte),
+              'word': (2, _decode_word, _encode_word),
+              'linear11': (2, _decode_lin11, _encode_lin11),
+              'ulinear16': (2, _decode_ulin16, _encode_ulin16),
+              'slinear16': (2, _decode_slin16, _encode_slin16),
+              'block': (1 + block_length, _decode_block, _encode_block)}
+    return {name: (commands[name], fmt) + codecs[fmt]
+            for name, fmt in formats.items()}
+
 class UCD92xx:
     pmbus_dict = {'page'            : 0x00, 
                   'operation'       : 0x01, 
@@ -271,11 +361,277 @@ class UCD92xx:
                   'mfr_specific_command': 0xfe, 
                   'pmbus_command_ext': 0xff}  # noqa: E501
 
-    commands = toNametuple(pmbus_dict)
+    # a namespace rather than toNametuple(): creating a 256-field namedtuple
+    # class dominates the import time of this module
+    commands = SimpleNamespace(**pmbus_dict)
+
+    # PMBus data formats
+    SEND = 'send'           # send byte, no data
+    BYTE = 'byte'           # unsigned byte
+    WORD = 'word'           # unsigned little-endian word
+    LINEAR11 = 'linear11'   # 5-bit exponent, 11-bit mantissa
+    ULINEAR16 = 'ulinear16' # unsigned mantissa, VOUT_MODE exponent
+    SLINEAR16 = 'slinear16' # two's complement mantissa, VOUT_MODE exponent
+    BLOCK = 'block'         # SMBus block, byte count first
+
+    BLOCK_MAX_LENGTH = 32
+    PAGE_COUNT = 4
+
+    pmbus_formats = {'page'                     : BYTE,
+                     'operation'                : BYTE,
+                     'on_off_config'            : BYTE,
+                     'clear_faults'             : SEND,
+                     'phase'                    : BYTE,
+                     'zone_config'              : WORD,
+                     'zone_active'              : WORD,
+                     'write_protect'            : BYTE,
+                     'store_default_all'        : SEND,
+                     'restore_default_all'      : SEND,
+                     'store_default_code'       : BYTE,
+                     'restore_default_code'     : BYTE,
+                     'store_user_all'           : SEND,
+                     'restore_user_all'         : SEND,
+                     'store_user_code'          : BYTE,
+                     'restore_user_code'        : BYTE,
+                     'capability'               : BYTE,
+                     'vout_mode'                : BYTE,
+                     'vout_command'             : ULINEAR16,
+                     'vout_trim'                : SLINEAR16,
+                     'vout_cal_offset'          : SLINEAR16,
+                     'vout_max'                 : ULINEAR16,
+                     'vout_margin_high'         : ULINEAR16,
+                     'vout_margin_low'          : ULINEAR16,
+                     'vout_transition_rate'     : LINEAR11,
+                     'vout_droop'               : LINEAR11,
+                     'vout_scale_loop'          : LINEAR11,
+                     'vout_scale_monitor'       : LINEAR11,
+                     'vout_min'                 : ULINEAR16,
+                     'pout_max'                 : LINEAR11,
+                     'max_duty'                 : LINEAR11,
+                     'frequency_switch'         : LINEAR11,
+                     'power_mode'               : BYTE,
+                     'vin_on'                   : LINEAR11,
+                     'vin_off'                  : LINEAR11,
+                     'interleave'               : WORD,
+                     'iout_cal_gain'            : LINEAR11,
+                     'iout_cal_offset'          : LINEAR11,
+                     'fan_config_1_2'           : BYTE,
+                     'fan_command_1'            : LINEAR11,
+                     'fan_command_2'            : LINEAR11,
+                     'fan_config_3_4'           : BYTE,
+                     'fan_command_3'            : LINEAR11,
+                     'fan_command_4'            : LINEAR11,
+                     'vout_ov_fault_limit'      : ULINEAR16,
+                     'vout_ov_fault_response'   : BYTE,
+                     'vout_ov_warn_limit'       : ULINEAR16,
+                     'vout_uv_warn_limit'       : ULINEAR16,
+                     'vout_uv_fault_limit'      : ULINEAR16,
+                     'vout_uv_fault_response'   : BYTE,
+                     'iout_oc_fault_limit'      : LINEAR11,
+                     'iout_oc_fault_response'   : BYTE,
+                     'iout_oc_lv_fault_limit'   : LINEAR11,
+                     'iout_oc_lv_fault_response': BYTE,
+                     'iout_oc_warn_limit'       : LINEAR11,
+                     'iout_uc_fault_limit'      : LINEAR11,
+                     'iout_uc_fault_response'   : BYTE,
+                     'ot_fault_limit'           : LINEAR11,
+                     'ot_fault_response'        : BYTE,
+                     'ot_warn_limit'            : LINEAR11,
+                     'ut_warn_limit'            : LINEAR11,
+                     'ut_fault_limit'           : LINEAR11,
+                     'ut_fault_response'        : BYTE,
+                     'vin_ov_fault_limit'       : LINEAR11,
+                     'vin_ov_fault_response'    : BYTE,
+                     'vin_ov_warn_limit'        : LINEAR11,
+                     'vin_uv_warn_limit'        : LINEAR11,
+                     'vin_uv_fault_limit'       : LINEAR11,
+                     'vin_uv_fault_response'    : BYTE,
+                     'iin_oc_fault_limit'       : LINEAR11,
+                     'iin_oc_fault_response'    : BYTE,
+                     'iin_oc_warn_limit'        : LINEAR11,
+                     'power_good_on'            : ULINEAR16,
+                     'power_good_off'           : ULINEAR16,
+                     'ton_delay'                : LINEAR11,
+                     'ton_rise'                 : LINEAR11,
+                     'ton_max_fault_limit'      : LINEAR11,
+                     'ton_max_fault_response'   : BYTE,
+                     'toff_delay'               : LINEAR11,
+                     'toff_fall'                : LINEAR11,
+                     'toff_max_warn_limit'      : LINEAR11,
+                     'pout_op_fault_limit'      : LINEAR11,
+                     'pout_op_fault_response'   : BYTE,
+                     'pout_op_warn_limit'       : LINEAR11,
+                     'pin_op_warn_limit'        : LINEAR11,
+                     'status_byte'              : BYTE,
+                     'status_word'              : WORD,
+                     'status_vout'              : BYTE,
+                     'status_iout'              : BYTE,
+                     'status_input'             : BYTE,
+                     'status_temperature'       : BYTE,
+                     'status_cml'               : BYTE,
+                     'status_other'             : BYTE,
+                     'status_mfr_specific'      : BYTE,
+                     'status_fans_1_2'          : BYTE,
+                     'status_fans_3_4'          : BYTE,
+                     'read_ein'                 : BLOCK,
+                     'read_eout'                : BLOCK,
+                     'read_vin'                 : LINEAR11,
+                     'read_iin'                 : LINEAR11,
+                     'read_vcap'                : LINEAR11,
+                     'read_vout'                : ULINEAR16,
+                     'read_iout'                : LINEAR11,
+                     'read_temperature_1'       : LINEAR11,
+                     'read_temperature_2'       : LINEAR11,
+                     'read_temperature_3'       : LINEAR11,
+                     'read_fan_speed_1'         : LINEAR11,
+                     'read_fan_speed_2'         : LINEAR11,
+                     'read_fan_speed_3'         : LINEAR11,
+                     'read_fan_speed_4'         : LINEAR11,
+                     'read_duty_cycle'          : LINEAR11,
+                     'read_frequency'           : LINEAR11,
+                     'read_pout'                : LINEAR11,
+                     'read_pin'                 : LINEAR11,
+                     'pmbus_revision'           : BYTE,
+                     'mfr_id'                   : BLOCK,
+                     'mfr_model'                : BLOCK,
+                     'mfr_revision'             : BLOCK,
+                     'mfr_location'             : BLOCK,
+                     'mfr_date'                 : BLOCK,
+                     'mfr_serial'               : BLOCK,
+                     'app_profile_support'      : BLOCK,
+                     'mfr_vin_min'              : LINEAR11,
+                     'mfr_vin_max'              : LINEAR11,
+                     'mfr_iin_max'              : LINEAR11,
+                     'mfr_pin_max'              : LINEAR11,
+                     'mfr_vout_min'             : ULINEAR16,
+                     'mfr_vout_max'             : ULINEAR16,
+                     'mfr_iout_max'             : LINEAR11,
+                     'mfr_pout_max'             : LINEAR11,
+                     'mfr_tambient_max'         : LINEAR11,
+                     'mfr_tambient_min'         : LINEAR11,
+                     'mfr_efficiency_ll'        : BLOCK,
+                     'mfr_efficiency_hl'        : BLOCK,
+                     'mfr_pin_accuracy'         : BYTE,
+                     'ic_device_id'             : BLOCK,
+                     'ic_device_rev'            : BLOCK,
+                     'user_data_00'             : BLOCK,
+                     'user_data_01'             : BLOCK,
+                     'user_data_02'             : BLOCK,
+                     'user_data_03'             : BLOCK,
+                     'user_data_04'             : BLOCK,
+                     'user_data_05'             : BLOCK,
+                     'user_data_06'             : BLOCK,
+                     'user_data_07'             : BLOCK,
+                     'user_data_08'             : BLOCK,
+                     'user_data_09'             : BLOCK,
+                     'user_data_10'             : BLOCK,
+                     'user_data_11'             : BLOCK,
+                     'user_data_12'             : BLOCK,
+                     'user_data_13'             : BLOCK,
+                     'user_data_14'             : BLOCK,
+                     'user_data_15'             : BLOCK,
+                     'mfr_max_temp_1'           : LINEAR11,
+                     'mfr_max_temp_2'           : LINEAR11,
+                     'mfr_max_temp_3'           : LINEAR11}  # noqa: E501
+
+    # name -> (code, format, read length, decoder, encoder)
+    command_table = build_command_table(pmbus_dict, pmbus_formats,
+                                        BLOCK_MAX_LENGTH)
+
+    # attributes only available once connected, see _connect()
+    _CONNECTED_ATTRS = frozenset(('url', 'i2c_master', 'i2c_slave', 'gpio',
+                                  'gpio_width', 'gpio_pins',
+                                  'gpio_master_mask'))
+
+    def __init__(self, pmbus_addr:int, frequency=1000, clockstretching=False,
+                 recorder=None, url: Optional[str] = None,
+                 lazy: bool = False, retry=None) -> None:
+        """
+        Args:
+            pmbus_addr (int): PMBus slave address
+            frequency (int, optional): I2C bus frequency in Hz
+            clockstretching (bool, optional): enable I2C clock stretching
+            recorder (BusRecorder, optional): record all I2C and GPIO
+                                              transactions, see busrec.py
+            url (str, optional): FTDI interface URL, e.g. ftdi://ftdi:2232h/1.
+                                 Defaults to the only connected interface,
+                                 or to an interactive selection.
+            lazy (bool, optional): defer the interface lookup, the controller
+                                   configuration and the VOUT_MODE read to
+                                   the first access that needs them.
+                                   Defaults to False.
+            retry (RetryPolicy, optional): retry failed transactions and
+                                           recover the bus, see
+                                           i2crecover.py
+        """
+
+        self._ftdi_options = {'frequency': int(frequency), 'clockstretching': clockstretching, 'initial': 0xff78, 'direction': 0xff78}
+        self._pmbus_addr = pmbus_addr
+        self._recorder = recorder
+        self._url = url
+        self.gpio_ctrl_mask = 0x0008
+        self.page = None
+        self.retry = retry
+        # verify all writes, see write_verified()
+        self.verify_writes = False
+
+        if not lazy:
+            self._connect()
+            self.exponent = self.get_vout_mode()
+
+        return None
+
+    def __getattr__(self, name: str):
+        # only called for missing attributes: connect on first use in lazy
+        # mode, then the attributes are found without this hook
+        if name in self._CONNECTED_ATTRS:
+            self._connect()
+        elif name == 'exponent':
+            self.exponent = self.get_vout_mode()
+        else:
+            raise AttributeError(f"'{type(self).__name__}' object has no "
+                                 f"attribute '{name}'")
+        return self.__dict__[name]
 
-    def __init__(self, pmbus_addr:int, frequency=1000, clockstretching=False) -> None:
+    def _connect(self) -> None:
+        if 'i2c_master' in self.__dict__:
+            return
+        #pylint: disable-msg=import-outside-toplevel
+        from pyftdi.i2c import I2cController
 
-        ftdi_options = {'frequency': int(frequency), 'clockstretching': clockstretching, 'initial': 0xff78, 'direction': 0xff78}
+        self.url = self._url or self.find_url()
+
+        # Create ftdi connection
+        i2c_master = I2cController()
+        i2c_master.configure(self.url, **self._ftdi_options)
+        self.i2c_master = i2c_master
+        self.i2c_slave = self.i2c_master.get_port(self._pmbus_addr)
+        
+        self.gpio = self.i2c_master.get_gpio()
+        if self._recorder:
+            self.i2c_slave = self._recorder.port(self.i2c_slave)
+            self.gpio = self._recorder.gpio(self.gpio)
+        self.gpio_width = self.gpio.width
+        self.gpio_pins = self.gpio.all_pins & ((1 << self.gpio_width) - 1)
+        self.gpio_master_mask = self.i2c_master._gpio_mask
+
+    @staticmethod
+    def find_url() -> str:
+        """
+        find_url()
+
+        Finds the URL of the FTDI interface to use. If several interfaces
+        are connected, the user is prompted to select one.
+
+        Raises:
+            ValueError: no USB backend
+            IOError: no FTDI interface
+
+        Returns:
+            str: FTDI interface URL
+        """
+        #pylint: disable-msg=import-outside-toplevel
+        from pyftdi.ftdi import Ftdi
 
         io_buffer = StringIO()
         with redirect_stdout(io_buffer):
@@ -305,24 +661,8 @@ class UCD92xx:
             for i in range (0, len(connections)):
                 print ("[%d] %s" % (i, connections[i]))
             selected = int(input ("Select an interface: "))
-            self.url = connections[selected]
-        else:
-            self.url = connections[0]
-        
-        # Create ftdi connection
-        self.i2c_master = I2cController()
-        self.i2c_master.configure(self.url, **ftdi_options)
-        self.i2c_slave = self.i2c_master.get_port(pmbus_addr)
-        
-        self.gpio = self.i2c_master.get_gpio()
-        self.gpio_width = self.gpio.width
-        self.gpio_pins = self.gpio.all_pins & ((1 << self.gpio_width) - 1)
-        self.gpio_master_mask = self.i2c_master._gpio_mask
-        self.gpio_ctrl_mask = 0x0008
-
-        self.exponent = self.get_vout_mode()
-        
-        return None
+            return connections[selected]
+        return connections[0]
 
     def get_crc(self, val, byteorder: str = 'big'):
         """
@@ -395,24 +735,21 @@ class UCD92xx:
         if n < 1:
             return None
         elif n == 1:
-            return struct.unpack('B', byte_array)[0]
+            return byte_array[0]
 
         endian = endian.lower()
-        end_char = '<' if endian == 'little' else '>'
+        little = endian == 'little'
 
         if split_bytes:
-            return tuple(struct.unpack(end_char + 'B'*n, byte_array))
+            return tuple(byte_array)
 
         if n == 2:
-            return struct.unpack(f'{end_char}H', byte_array)[0]
+            return (U16_LE if little else U16_BE).unpack(byte_array)[0]
         elif n == 4:
-            return struct.unpack(f'{end_char}I', byte_array)[0]
+            return (U32_LE if little else U32_BE).unpack(byte_array)[0]
 
         # handles arbitrary lengths
-        acc = 0
-        for i, b in enumerate(struct.unpack(end_char + 'B'*n, byte_array)):
-            acc += b << ((8*i) if endian == 'little' else (8*(n - i - 1)))
-        return acc
+        return int.from_bytes(byte_array, 'little' if little else 'big')
 
     @staticmethod
     def uint2bytes(value: int, n_bytes: int, endian: str = 'little'):
@@ -445,17 +782,21 @@ class UCD92xx:
             raise ValueError('Function can only convert positive integers')
 
         endian = endian.lower()
-        end_char = '<' if endian == 'little' else '>'
-
-        if endian == 'little':
-            gen = ((value >> (8*i)) & 255 for i in range(n_bytes))
-        elif endian == 'big':
-            gen = ((value >> (8*i)) & 255 for i in range(n_bytes - 1, -1, -1))
-        else:
+        if endian not in ('little', 'big'):
             raise ValueError('Invalid value for kwarg "endian"')
 
-        byte_array = struct.pack(f"{end_char}{'B'*n_bytes}", *gen)
-        return byte_array
+        if n_bytes == 1:
+            return U8.pack(value & 0xff)
+        if n_bytes == 2:
+            return (U16_LE if endian == 'little' else U16_BE).pack(
+                value & 0xffff)
+        if n_bytes == 4:
+            return (U32_LE if endian == 'little' else U32_BE).pack(
+                value & 0xffffffff)
+
+        # handles arbitrary lengths
+        mask = (1 << (8*n_bytes)) - 1
+        return (value & mask).to_bytes(n_bytes, endian)
     
     @staticmethod
     def twos_complement(value: int, n_bits: int, reverse=False):
@@ -593,6 +934,26 @@ class UCD92xx:
 
         return ((formatted_exp << 11) | (formatted_mant))
 
+    @staticmethod
+    def lin11_exponent(value: float) -> int:
+        """
+        lin11_exponent(value)
+
+        Selects the "linear 11" exponent giving the best resolution for a
+        value, i.e. the smallest exponent whose mantissa still fits in 11
+        signed bits.
+
+        Arguments:
+            value {float} -- value to encode
+
+        Returns:
+            out {int} -- exponent, in [-16, 15]
+        """
+        for exp in range(-16, 16):
+            if -1024 <= round(value*(2**-exp)) <= 1023:
+                return exp
+        raise ValueError(f'{value} cannot be encoded as linear 11')
+
     def decode_ulin16(self, value: int) -> float:
         """
         decode_ulin16(value)
@@ -647,46 +1008,293 @@ class UCD92xx:
 
         return round(value/(2**self.exponent))                
 
-    def send_byte(self, command):
-        self.set_control_signal()
+    def decode_slin16(self, value: int) -> float:
+        """
+        decode_slin16(value)
+
+        Decodes a "signed linear 16" formatted integer into a floating point
+        number. This is the unsigned linear 16 format with a two's complement
+        mantissa, used by offsets such as VOUT_TRIM and VOUT_CAL_OFFSET.
+
+        Arguments:
+            value {int} -- integer value to decode
+
+        Returns:
+            out {float} -- decoded value
+        """
+
+        return self.twos_complement(value, 16)*(2**self.exponent)
+
+    def encode_slin16(self, value: float) -> int:
+        """
+        encode_slin16(value)
+
+        Encodes a floating point number into a "signed linear 16" formatted
+        integer number, see decode_slin16().
+
+        Arguments:
+            value -- float value to encode
+
+        Returns:
+            out {int} -- encoded slin16 integer value
+
+        Raises:
+            ValueError: the value is out of the signed 16 bit range
+        """
 
-        self.i2c_slave.write([command], relax=True, start=True)
+        mantissa = round(value/(2**self.exponent))
+        if not -0x8000 <= mantissa <= 0x7fff:
+            raise ValueError(f'{value} cannot be encoded as signed linear 16')
+        return self.twos_complement(mantissa, 16, reverse=True)
 
-        self.clear_control_signal()
+    def send_byte(self, command):
+        self._transfer(U8.pack(command))
         return None
 
     def write_byte(self, command, data: int):
-        self.set_control_signal()
+        self._transfer(U8.pack(command) + U8.pack(data))
+        return None
 
-        #byte_data = data.to_bytes(1)
-        self.i2c_slave.write([command, data], relax=True, start=True)
+    def write_word(self, command, data: int):
+        self.write_bytes(command, self.uint2bytes(data, 2))
 
-        self.clear_control_signal()
+        return None
 
+    def write_bytes(self, command, data: bytes):
+        self._transfer(U8.pack(command) + data)
         return None
 
-    def write_word(self, command, data: int):
+    def read_word(self, command):
+        return self.read_bytes(command, 2)
+
+    def read_bytes(self, command, readlen: int):
+        return self._transfer(U8.pack(command), readlen)
+
+    def transact(self, out: bytes, readlen: int = 0):
+        """
+        transact(out, readlen=0)
+
+        Runs a single transaction bracketed by the control signal, without
+        retry: a write, or a write then a repeated-start read.
+
+        Args:
+            out (bytes): command code and data to write
+            readlen (int, optional): count of bytes to read. Defaults to 0.
+
+        Returns:
+            bytes read, None for a write
+        """
         self.set_control_signal()
+        try:
+            if not readlen:
+                self.i2c_slave.write(out, relax=True, start=True)
+                return None
+            return self.i2c_slave.exchange(out, readlen, relax=True,
+                                           start=True)
+        finally:
+            self.clear_control_signal()
+
+    def _transfer(self, out: bytes, readlen: int = 0):
+        if self.retry is None:
+            return self.transact(out, readlen)
+        return self.retry.run(self, out, readlen)
+
+    def read(self, name: str, page: Optional[int] = None):
+        """
+        read(name, page=None)
 
-        byte_data = self.uint2bytes(data, 2)
+        Reads a PMBus command and decodes it according to its format in
+        pmbus_formats: an integer for byte and word commands, a float for
+        LINEAR11, ULINEAR16 and SLINEAR16 commands, and bytes for block
+        commands.
 
-        self.i2c_slave.write([command], relax=False, start=True)
-        self.i2c_slave.write(byte_data, relax=True, start=False)
+        Args:
+            name (str): command name, as in pmbus_dict
+            page (int, optional): page to select first, if it is not the
+                                  current page. Defaults to the current page.
+
+        Raises:
+            ValueError: unknown command, or send-byte command
+
+        Returns:
+            decoded value
+        """
+        code, _, readlen, decode, _ = self._lookup(name)
+        if readlen is None:
+            raise ValueError(f'{name} is a send-byte command')
+        self._select_page(page)
+        return decode(self, self.read_bytes(code, readlen))
+
+    def write(self, name: str, value=None, page: Optional[int] = None,
+              verify: Optional[bool] = None):
+        """
+        write(name, value=None, page=None, verify=None)
+
+        Encodes a value according to the command format in pmbus_formats and
+        writes it. Send-byte commands take no value. LINEAR11 values are
+        encoded with the exponent giving the best resolution.
 
-        self.clear_control_signal()
+        Args:
+            name (str): command name, as in pmbus_dict
+            value (optional): value to write
+            page (int, optional): page to select first, if it is not the
+                                  current page. Defaults to the current page.
+            verify (bool, optional): read the command back in the same
+                                     transaction, see write_verified().
+                                     Defaults to the verify_writes attribute.
 
+        Raises:
+            ValueError: unknown command, or value cannot be encoded
+            IOError: the readback does not match
+        """
+        code, fmt, readlen, _, encode = self._lookup(name)
+        if verify is None:
+            verify = self.verify_writes
+        if verify and readlen is not None and encode is not None and \
+                name != 'page':
+            result = self.write_verified({name: value}, page)[0]
+            if not result.ok:
+                raise IOError(f'{name} page {result.page}: wrote '
+                              f'{result.expected}, read {result.readback}')
+            return None
+        data = None
+        if encode is not None:
+            # encode first, not to change the page for an invalid value
+            try:
+                data = encode(self, value)
+            except (struct.error, TypeError) as exc:
+                raise ValueError(f'Cannot encode {value!r} as {fmt}') \
+                    from exc
+        if name == 'page':
+            self.set_page(value)
+            return None
+        self._select_page(page)
+        if data is None:
+            self.send_byte(code)
+        else:
+            self.write_bytes(code, data)
         return None
-    
-    def read_word(self, command):
-        self.set_control_signal()
-        
-        bytes_reads = []
-        self.i2c_slave.write([command], relax=False, start=True)
-        bytes_reads = self.i2c_slave.read(readlen=2, relax=True, start=True)
-        
-        self.clear_control_signal()
 
-        return bytes_reads
+    def write_verified(self, values: dict, page: Optional[int] = None,
+                       tolerance: float = 0.0) -> list:
+        """
+        write_verified(values, page=None, tolerance=0.0)
+
+        Writes several PMBus commands, each one followed by its readback, in
+        a single batched transaction. Each readback is compared with the
+        value the write actually encoded: LINEAR11 and linear 16 values may
+        differ by one LSB of the coarser of the written and read back
+        encodings, as the device may quantize them again. A write that was
+        not acknowledged, or not sent to its page as the PAGE write failed,
+        is not verified.
+
+        Args:
+            values (dict): command name to value
+            page (int, optional): page to select first. Defaults to the
+                                  current page.
+            tolerance (float, optional): additional absolute tolerance of
+                                         LINEAR11 and linear 16 values
+
+        Raises:
+            ValueError: unknown or write-only command, or value cannot be
+                        encoded
+
+        Returns:
+            list: a VerifyResult per command, in order
+        """
+        # a failed PAGE write must not write nor verify another page
+        batch = self.batch(page_fence=True)
+        checks = []
+        for name, value in values.items():
+            code, fmt, readlen, decode, encode = self._lookup(name)
+            if readlen is None or encode is None or name == 'page':
+                raise ValueError(f'{name} cannot be verified')
+            try:
+                data = encode(self, value)
+            except (struct.error, TypeError) as exc:
+                raise ValueError(f'Cannot encode {value!r} as {fmt}') \
+                    from exc
+            step = batch.write_bytes(code, data, page)
+            batch.read_bytes(code, readlen, page, name)
+            checks.append((name, value, fmt, data, decode, step, batch.page))
+        readbacks = batch.execute(check=False)
+        failed = batch.failed
+        results = []
+        for name, value, fmt, data, decode, step, wpage in checks:
+            expected = decode(self, data)
+            raw = readbacks.get(name)
+            if raw is None:
+                results.append(VerifyResult(name, wpage, value, expected,
+                                            None, False))
+                continue
+            readback = decode(self, raw)
+            if fmt in (self.LINEAR11, self.ULINEAR16, self.SLINEAR16):
+                lsb = max(self._lsb(fmt, data), self._lsb(fmt, raw))
+                ok = abs(readback - expected) <= lsb + tolerance
+            else:
+                ok = readback == expected
+            results.append(VerifyResult(name, wpage, value, expected,
+                                        readback, ok and step not in failed))
+        return results
+
+    def _lsb(self, fmt: str, data: bytes) -> float:
+        if fmt in (self.ULINEAR16, self.SLINEAR16):
+            return 2.0**self.exponent
+        return 2.0**self.extract_lin11(U16_LE.unpack(data)[0])[0]
+
+    def read_many(self, names, page: Optional[int] = None) -> dict:
+        """
+        read_many(names, page=None)
+
+        Reads several PMBus commands from the same page, in a single batched
+        transaction.
+
+        Args:
+            names (iterable): command names
+            page (int, optional): page to select first. Defaults to the
+                                  current page.
+
+        Returns:
+            dict: command name to decoded value
+        """
+        batch = self.batch()
+        for name in names:
+            batch.read(name, page=page)
+        return batch.execute()
+
+    def batch(self, reset_page: bool = False,
+              page_fence: bool = False) -> 'PmbusBatch':
+        """
+        batch(reset_page=False, page_fence=False)
+
+        Starts a batch of PMBus accesses, executed as a single MPSSE
+        transaction, see PmbusBatch.
+
+        Args:
+            reset_page (bool, optional): make the batch independent of the
+                                         current page, for templates
+            page_fence (bool, optional): check each PAGE write before
+                                         sending the next accesses
+
+        Returns:
+            PmbusBatch: empty batch
+        """
+        return PmbusBatch(self, reset_page=reset_page, page_fence=page_fence)
+
+    def _lookup(self, name: str):
+        try:
+            return self.command_table[name]
+        except KeyError as exc:
+            raise ValueError(f'No known format for PMBus command {name}') \
+                from exc
+
+    def _select_page(self, page: Optional[int]):
+        if page is None or page == self.page:
+            return None
+        if not 0 <= page < self.PAGE_COUNT:
+            raise ValueError(f'Invalid page: {page}')
+        self.set_page(page)
+        return None
 
     def set_control_signal(self):
         pins = self.gpio.read()
@@ -703,7 +1311,18 @@ class UCD92xx:
         self.gpio.write(pins)
 
         return None
-    
+
+    def _release_ctrl(self) -> None:
+        # release the control signal after an interrupted batch, leaving
+        # the other GPIO outputs as the batch left them
+        #pylint: disable-msg=import-outside-toplevel
+        from i2cbatch import I2cBatch
+        release = I2cBatch(self.i2c_master)
+        release.set_gpio(self.gpio_ctrl_mask, 0, 'ctrl clear')
+        result = release.execute()
+        if self._recorder:
+            self._recorder.record_batch(release.operations, result.data)
+
     def get_vout_mode (self):
         bytes_reads = []
         bytes_reads = self.read_word(self.commands.vout_mode)
@@ -711,102 +1330,74 @@ class UCD92xx:
         return self.twos_complement(bytes_reads[0], 5)
     
     def set_page (self, page: int):
-        if (page >= 0) and (page < 4):
+        if not 0 <= page < self.PAGE_COUNT:
+            raise ValueError(f'Invalid page: {page}')
+        try:
             self.write_byte(self.commands.page, page)
+        except Exception:
+            # the device page is unknown
+            self.page = None
+            raise
+        self.page = page
         return None
 
     def get_vout_max (self):
-        bytes_reads = []
-        bytes_reads = self.read_word(self.commands.vout_max)
-        value = self.bytes2uint(bytes_reads)
-        return self.decode_ulin16(value=value)
+        return self.read('vout_max')
 
     def set_vout_max (self, data: float):
-        encoded_value = self.encode_ulin16(data)
-        self.write_word(self.commands.vout_max, encoded_value)
+        self.write('vout_max', data)
         return None
 
     def get_vout_command (self):
-        bytes_reads = []
-        bytes_reads = self.read_word(self.commands.vout_command)
-        value = self.bytes2uint(bytes_reads)
-        return self.decode_ulin16(value=value)
+        return self.read('vout_command')
 
     def set_vout_command (self, data: float):
-        encoded_value = self.encode_ulin16(data)
-        self.write_word(self.commands.vout_command, encoded_value)
+        self.write('vout_command', data)
         return None
-        
+
     def get_vout_cal_offset (self):
-        bytes_reads = []
-        bytes_reads = self.read_word(self.commands.vout_cal_offset)
-        value = self.bytes2uint(bytes_reads)
-        return self.decode_ulin16(value=value)
-    
+        return self.read('vout_cal_offset')
+
     def get_vout_margin_high (self):
-        bytes_reads = []
-        bytes_reads = self.read_word(self.commands.vout_margin_high)
-        value = self.bytes2uint(bytes_reads)
-        return self.decode_ulin16(value=value)
+        return self.read('vout_margin_high')
 
     def set_vout_margin_high (self, data: float):
-        encoded_value = self.encode_ulin16(data)
-        self.write_word(self.commands.vout_margin_high, encoded_value)
+        self.write('vout_margin_high', data)
         return None
-    
+
     def get_vout_margin_low (self):
-        bytes_reads = []
-        bytes_reads = self.read_word(self.commands.vout_margin_low)
-        value = self.bytes2uint(bytes_reads)
-        return self.decode_ulin16(value=value)
+        return self.read('vout_margin_low')
 
     def set_vout_margin_low (self, data: float):
-        encoded_value = self.encode_ulin16(data)
-        self.write_word(self.commands.vout_margin_low, encoded_value)
+        self.write('vout_margin_low', data)
         return None
-    
+
     def get_vout_ov_fault_limit (self):
-        bytes_reads = []
-        bytes_reads = self.read_word(self.commands.vout_ov_fault_limit)
-        value = self.bytes2uint(bytes_reads)
-        return self.decode_ulin16(value=value)
+        return self.read('vout_ov_fault_limit')
 
     def set_vout_ov_fault_limit (self, data: float):
-        encoded_value = self.encode_ulin16(data)
-        self.write_word(self.commands.vout_ov_fault_limit, encoded_value)
+        self.write('vout_ov_fault_limit', data)
         return None
-    
+
     def get_vout_uv_fault_limit (self):
-        bytes_reads = []
-        bytes_reads = self.read_word(self.commands.vout_uv_fault_limit)
-        value = self.bytes2uint(bytes_reads)
-        return self.decode_ulin16(value=value)
+        return self.read('vout_uv_fault_limit')
 
     def set_vout_uv_fault_limit (self, data: float):
-        encoded_value = self.encode_ulin16(data)
-        self.write_word(self.commands.vout_uv_fault_limit, encoded_value)
+        self.write('vout_uv_fault_limit', data)
         return None
 
     def get_power_good_on (self):
-        bytes_reads = []
-        bytes_reads = self.read_word(self.commands.power_good_on)
-        value = self.bytes2uint(bytes_reads)
-        return self.decode_ulin16(value=value)
-    
+        return self.read('power_good_on')
+
     def set_power_good_on (self, data: float):
-        encoded_value = self.encode_ulin16(data)
-        self.write_word(self.commands.power_good_on, encoded_value)
+        self.write('power_good_on', data)
         return None
-    
+
     def get_power_good_off (self):
-        bytes_reads = []
-        bytes_reads = self.read_word(self.commands.power_good_off)
-        value = self.bytes2uint(bytes_reads)
-        return self.decode_ulin16(value=value)
+        return self.read('power_good_off')
 
     def set_power_good_off (self, data: float):
-        encoded_value = self.encode_ulin16(data)
-        self.write_word(self.commands.power_good_off, encoded_value)
+        self.write('power_good_off', data)
         return None
 
     def store_default_all (self):
@@ -814,51 +1405,413 @@ class UCD92xx:
         return None
                                        
     def close(self):
+        if 'i2c_master' not in self.__dict__:
+            # lazy device never connected
+            return
         self.i2c_slave.flush()
         self.i2c_master.close()
 
 
+class PmbusBatch:
+    """
+    PmbusBatch(device, ctrl=True, reset_page=False, page_fence=False)
+
+    Batch of PMBus accesses to a UCD92xx, compiled into as few MPSSE buffers
+    as possible and executed in one go by execute(). The control signal is
+    raised at the start of the batch and released at its end, as for single
+    accesses. PAGE writes are only emitted when the page changes.
+
+    Once an access is not acknowledged, the MPSSE buffers that follow are
+    not sent, see I2cBatch.execute(). The accesses sent after a PAGE write
+    that failed reached another rail: they are listed in the failed
+    attribute along with the NACKed and skipped steps, and their reads are
+    dropped. The bus recorder of the device, if any, receives the executed
+    steps once the batch has run.
+
+    With page_fence, each PAGE write ends its buffer, so that the accesses
+    to a rail are never sent once its selection failed, at the cost of a
+    USB round trip per page change.
+
+    Args:
+        device (UCD92xx): target device
+        ctrl (bool, optional): bracket the batch with the control signal.
+                               Disable it to drive the signal from the batch
+                               steps. Defaults to True.
+        reset_page (bool, optional): ignore the current device page, so
+                                     that the first paged access always
+                                     writes PAGE. Defaults to False.
+        page_fence (bool, optional): end the MPSSE buffer after each PAGE
+                                     write. Defaults to False.
+    """
+
+    def __init__(self, device: UCD92xx, ctrl: bool = True,
+                 reset_page: bool = False, page_fence: bool = False):
+        self.device = device
+        self.address = device.i2c_slave.address
+        self.page = None if reset_page else device.page
+        self.entry_page = self.page
+        #pylint: disable-msg=import-outside-toplevel
+        from i2cbatch import I2cBatch
+        self.batch = I2cBatch(device.i2c_master)
+        self.result = None
+        self.failed = frozenset()
+        self._ctrl = ctrl
+        self._page_fence = page_fence
+        self._reads = []
+        self._page_steps = set()
+        if ctrl:
+            self.batch.set_gpio(device.gpio_ctrl_mask, device.gpio_ctrl_mask,
+                                'ctrl set')
+
+    def set_page(self, page: int) -> Optional[int]:
+        """
+        set_page(page)
+
+        Appends a PAGE write, unless the page is already selected.
+
+        Returns:
+            int: batch step index, None if the page is unchanged
+        """
+        if page is None or page == self.page:
+            return None
+        if not 0 <= page < self.device.PAGE_COUNT:
+            raise ValueError(f'Invalid page: {page}')
+        step = self.batch.write(self.address,
+                                (self.device.commands.page, page),
+                                f'page {page}')
+        if self._page_fence:
+            self.batch.fence()
+        self._page_steps.add(step)
+        self.page = page
+        return step
+
+    def write(self, name: str, value=None, page: Optional[int] = None) \
+            -> Optional[int]:
+        """
+        write(name, value=None, page=None)
+
+        Appends a PMBus write, encoded as UCD92xx.write() does.
+
+        Returns:
+            int: batch step index, None for a PAGE write to the current page
+        """
+        code, fmt, _, _, encode = self.device._lookup(name)
+        if name == 'page':
+            return self.set_page(value)
+        self.set_page(page)
+        out = bytes((code,))
+        if encode is not None:
+            try:
+                out += encode(self.device, value)
+            except (struct.error, TypeError) as exc:
+                raise ValueError(f'Cannot encode {value!r} as {fmt}') \
+                    from exc
+        return self.batch.write(self.address, out,
+                                f'{name} page {self.page} = {value}')
+
+    def read(self, name: str, page: Optional[int] = None, key=None) -> int:
+        """
+        read(name, page=None, key=None)
+
+        Appends a PMBus read, decoded as UCD92xx.read() does.
+
+        Args:
+            name (str): command name
+            page (int, optional): page to select first
+            key (optional): key of the value in the execute() result.
+                            Defaults to the command name.
+
+        Returns:
+            int: batch step index
+        """
+        code, _, readlen, decode, _ = self.device._lookup(name)
+        if readlen is None:
+            raise ValueError(f'{name} is a send-byte command')
+        self.set_page(page)
+        step = self.batch.exchange(self.address, (code,), readlen,
+                                   f'{name} page {self.page}')
+        self._reads.append((name if key is None else key, step, decode))
+        return step
+
+    def write_bytes(self, command: int, data: bytes,
+                    page: Optional[int] = None) -> int:
+        """
+        write_bytes(command, data, page=None)
+
+        Appends a raw PMBus write, as UCD92xx.write_bytes() does.
+
+        Returns:
+            int: batch step index
+        """
+        self.set_page(page)
+        return self.batch.write(self.address, U8.pack(command) + bytes(data),
+                                f'0x{command:02x} page {self.page}')
+
+    def read_bytes(self, command: int, readlen: int,
+                   page: Optional[int] = None, key=None) -> int:
+        """
+        read_bytes(command, readlen, page=None, key=None)
+
+        Appends a raw PMBus read, whose result is the bytes read.
+
+        Returns:
+            int: batch step index
+        """
+        self.set_page(page)
+        step = self.batch.exchange(self.address, (command,), readlen,
+                                   f'0x{command:02x} page {self.page}')
+        self._reads.append((command if key is None else key, step,
+                            _decode_raw))
+        return step
+
+    def set_gpio(self, pins: int, value: int) -> int:
+        """
+        set_gpio(pins, value)
+
+        Appends a GPIO output change, see I2cBatch.set_gpio().
+
+        Returns:
+            int: batch step index
+        """
+        return self.batch.set_gpio(pins, value)
+
+    def delay(self, seconds: float) -> int:
+        """
+        delay(seconds)
+
+        Appends a bus-clocked delay, see I2cBatch.delay().
+
+        Returns:
+            int: batch step index
+        """
+        return self.batch.delay(seconds)
+
+    def execute(self, check: bool = True) -> dict:
+        """
+        execute(check=True)
+
+        Executes the batch. The raw BatchResult, with the step timings, is
+        kept in the result attribute, and the steps that failed in the
+        failed attribute: not acknowledged, not sent, or sent after a PAGE
+        write that failed. If the batch stopped on a NACK, the control
+        signal is released.
+
+        Args:
+            check (bool, optional): raise I2cNackError if any step was not
+                                    acknowledged. Defaults to True.
+
+        Returns:
+            dict: decoded value of each read that did not fail, by key
+        """
+        if self._ctrl:
+            self.batch.set_gpio(self.device.gpio_ctrl_mask, 0, 'ctrl clear')
+        try:
+            self.result = self.batch.execute(check=False)
+        except Exception:
+            self.device.page = None
+            raise
+        if self.device._recorder:
+            self.device._recorder.record_batch(self.batch.operations,
+                                               self.result.data,
+                                               self.result.nacks,
+                                               self.result.skipped)
+        # the device page is unknown if a PAGE write was not acknowledged
+        # or not sent
+        if self._page_steps.intersection(self.result.nacks +
+                                         self.result.skipped):
+            self.device.page = None
+        else:
+            self.device.page = self.page
+        if self._ctrl and self.result.skipped:
+            self.device._release_ctrl()
+        if check:
+            self.batch.check(self.result)
+        failed = set(self.result.nacks + self.result.skipped)
+        if failed:
+            failed |= _stale_page_steps(self._page_steps, failed,
+                                        len(self.batch.steps))
+        self.failed = frozenset(failed)
+        data = self.result.data
+        return {key: decode(self.device, data[step])
+                for key, step, decode in self._reads
+                if step in data and step not in failed}
+
+    def freeze(self) -> 'PmbusTemplate':
+        """
+        freeze()
+
+        Compiles the batch into a reusable template, see PmbusTemplate.
+        The control signal release is appended as execute() does.
+
+        Returns:
+            PmbusTemplate: the template
+        """
+        if self._ctrl:
+            self.batch.set_gpio(self.device.gpio_ctrl_mask, 0, 'ctrl clear')
+        return PmbusTemplate(self.device, self.batch.freeze(), self._reads,
+                             self.page, self._page_steps, self.entry_page,
+                             self._ctrl)
+
+
+class PmbusTemplate:
+    """
+    PmbusTemplate(device, template, reads, page, page_steps, entry_page,
+                  ctrl)
+
+    Immutable, precompiled PMBus batch, built by PmbusBatch.freeze(), for
+    tight polling loops. Each execution writes the raw read data into a
+    caller-supplied buffer, at the offsets given by layout; decode() turns
+    them into values when needed.
+
+    A template compiled while a page was selected relies on that page: it
+    is selected again first if the device page has changed since.
+
+    Args:
+        device (UCD92xx): target device
+        template (BatchTemplate): compiled batch
+        reads (list): (key, step, decoder) of each read
+        page (int): page selected at the end of the batch
+        page_steps (set): steps of the PAGE writes
+        entry_page (int): page the batch was compiled for, None if the
+                          batch does not depend on the device page
+        ctrl (bool): whether the batch ends with the control signal release
+    """
+
+    __slots__ = ('device', 'template', 'layout', 'size', '_decoders',
+                 '_page', '_page_steps', '_entry_page', '_ctrl')
+
+    def __init__(self, device: UCD92xx, template: 'BatchTemplate', reads,
+                 page: Optional[int], page_steps,
+                 entry_page: Optional[int] = None,
+                 ctrl: bool = False) -> None:
+        steps = template.layout
+        self.device = device
+        self.template = template
+        self.layout = {key: steps[step] for key, step, _ in reads}
+        self.size = template.size
+        self._decoders = tuple((key, step, steps[step][0], steps[step][1],
+                                decode) for key, step, decode in reads)
+        self._page = page
+        self._page_steps = frozenset(page_steps)
+        self._entry_page = entry_page
+        self._ctrl = ctrl
+
+    def buffer(self) -> bytearray:
+        """
+        buffer()
+
+        Returns:
+            bytearray: a buffer sized for one execution
+        """
+        return bytearray(self.size)
+
+    def execute_into(self, buf, offset: int = 0, check: bool = True) \
+            -> tuple:
+        """
+        execute_into(buf, offset=0, check=True)
+
+        Executes the template.
+
+        Args:
+            buf (bytearray): output buffer of at least offset + size bytes
+            offset (int, optional): position of the read data in buf
+            check (bool, optional): raise I2cNackError if any step was not
+                                    acknowledged. Defaults to True.
+
+        Returns:
+            tuple: steps that were not acknowledged, then the steps skipped
+                   after them
+        """
+        if self._entry_page is not None and \
+                self.device.page != self._entry_page:
+            self.device.set_page(self._entry_page)
+        try:
+            nacks = self.template.execute_into(buf, offset)
+        except Exception:
+            self.device.page = None
+            raise
+        if self.device._recorder:
+            self._record(buf, offset, nacks)
+        if nacks and self._page_steps.intersection(nacks):
+            self.device.page = None
+        else:
+            self.device.page = self._page
+        # the last step, the control signal release, cannot be NACKed: it
+        # is only reported when skipped
+        if self._ctrl and nacks and nacks[-1] == len(self.template.steps) - 1:
+            self.device._release_ctrl()
+        if check and nacks:
+            self.template.check(nacks)
+        return nacks
+
+    def _record(self, buf, offset: int, nacks: tuple) -> None:
+        template = self.template
+        skipped = template.skipped(nacks)
+        data = {step: buf[offset+pos:offset+pos+length]
+                for step, (pos, length) in template.layout.items()}
+        self.device._recorder.record_batch(
+            template.operations, data,
+            [step for step in nacks if step not in skipped], skipped)
+
+    def decode(self, buf, offset: int = 0, nacks=()) -> dict:
+        """
+        decode(buf, offset=0, nacks=())
+
+        Decodes the read data of an execution.
+
+        Args:
+            buf (bytearray): buffer filled by execute_into()
+            offset (int, optional): position of the read data in buf
+            nacks (tuple, optional): value returned by execute_into(), the
+                                     reads that were not acknowledged, or
+                                     sent after a PAGE write that failed,
+                                     are omitted
+
+        Returns:
+            dict: decoded value of each read, by key
+        """
+        if nacks:
+            nacks = set(nacks)
+            nacks |= _stale_page_steps(self._page_steps, nacks,
+                                       len(self.template.steps))
+        return {key: decode(self.device, buf[offset+pos:offset+pos+length])
+                for key, step, pos, length, decode in self._decoders
+                if step not in nacks}
+
+
 if __name__ == "__main__":
     u0 = UCD92xx(0x34)
 
     voltage = 3.3
     u0.set_page(3) # rail 4
 
+    registers = ('vout_max', 'vout_command', 'vout_cal_offset',
+                 'vout_margin_high', 'vout_margin_low',
+                 'vout_ov_fault_limit', 'vout_uv_fault_limit',
+                 'power_good_on', 'power_good_off')
+
     print ("====== Before setting ======")
-    print(f"VOUT_MAX = {u0.get_vout_max()}")
-    print(f"VOUT_COMMAND = {u0.get_vout_command()}")
-    print(f"VOUT_CAL_OFFSET = {u0.get_vout_cal_offset()}")
-    print(f"VOUT_MARGIN_HIGH = {u0.get_vout_margin_high()}")
-    print(f"VOUT_MARGIN_LOW = {u0.get_vout_margin_low()}")
-    print(f"VOUT_OV_FAULT_LIMIT = {u0.get_vout_ov_fault_limit()}")
-    print(f"VOUT_UV_FAULT_LIMIT = {u0.get_vout_uv_fault_limit()}")
-    print(f"POWER_GOOD_ON = {u0.get_power_good_on()}")
-    print(f"POWER_GOOD_OFF = {u0.get_power_good_off()}")
+    for name, value in u0.read_many(registers).items():
+        print(f"{name.upper()} = {value}")
 
     print ("====== Setting ======")
-    u0.set_vout_max(voltage * 1.3)
-    u0.set_vout_margin_high(voltage * 1.15)
-    u0.set_vout_margin_low(voltage * 0.85)
-    u0.set_vout_ov_fault_limit(voltage * 1.15)
-    u0.set_vout_uv_fault_limit(voltage * 0.85)
-    u0.set_power_good_on(voltage * 0.95)
-    u0.set_power_good_off(voltage * 0.85)
-
-    u0.set_vout_command(voltage)
-
-    print ("====== After setting ======")
-    print(f"VOUT_MAX = {u0.get_vout_max()}")
-    print(f"VOUT_COMMAND = {u0.get_vout_command()}")
-    print(f"VOUT_CAL_OFFSET = {u0.get_vout_cal_offset()}")
-    print(f"VOUT_MARGIN_HIGH = {u0.get_vout_margin_high()}")
-    print(f"VOUT_MARGIN_LOW = {u0.get_vout_margin_low()}")
-    print(f"VOUT_OV_FAULT_LIMIT = {u0.get_vout_ov_fault_limit()}")
-    print(f"VOUT_UV_FAULT_LIMIT = {u0.get_vout_uv_fault_limit()}")
-    print(f"POWER_GOOD_ON = {u0.get_power_good_on()}")
-    print(f"POWER_GOOD_OFF = {u0.get_power_good_off()}")
-
-    accept = int(input("Please measure the voltage then press 1 to save: "))
-    if accept == 1:
-        u0.store_default_all()
-
-    u0.close()
\ No newline at end of file
+    report = u0.write_verified({'vout_max': voltage * 1.3,
+                                'vout_margin_high': voltage * 1.15,
+                                'vout_margin_low': voltage * 0.85,
+                                'vout_ov_fault_limit': voltage * 1.15,
+                                'vout_uv_fault_limit': voltage * 0.85,
+                                'power_good_on': voltage * 0.95,
+                                'power_good_off': voltage * 0.85,
+                                'vout_command': voltage})
+    for result in report:
+        print(f"{result.name.upper()} = {result.readback} "
+              f"({'ok' if result.ok else 'MISMATCH, wrote %s' % result.expected})")
+
+    if all(result.ok for result in report):
+        accept = int(input("Please measure the voltage then press 1 to save: "))
+        if accept == 1:
+            u0.store_default_all()
+    else:
+        print("Verification failed, not saving")
+
+    u0.close()
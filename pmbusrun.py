@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+
+"""Non-interactive PMBus script runner.
+
+   Execute scripts of PMBus operations on a UCD92xx in a single session,
+   and report the outcome of each operation as JSON.
+"""
+
+#pylint: disable-msg=broad-except
+
+import struct
+from argparse import ArgumentParser
+from itertools import chain
+from json import dumps
+from operator import eq, ge, gt, le, lt, ne
+from sys import modules, stderr, stdin
+from traceback import format_exc
+from typing import Iterable, List, NamedTuple, Optional, Tuple
+from pyftdi.i2c import I2cIOError
+from pmbus import PmbusBatch, UCD92xx
+
+
+class ScriptOp(NamedTuple):
+    """A parsed script line."""
+    line: int
+    op: str
+    args: tuple
+
+
+class ScriptRunner:
+    """Run PMBus scripts on a UCD92xx.
+
+       A script holds one operation per line; ``#`` starts a comment::
+
+         page 3                       # select a rail
+         read vout_command
+         write vout_command 1.2       # values are int, float, "text"
+         write clear_faults           # send-byte command
+         assert read_vout == 1.2 0.05 # optional tolerance
+         assert status_word == 0      # also != < <= > >=
+         delay 0.002
+         store                        # store_default_all if no assert failed
+         store force                  # store_default_all unconditionally
+
+       Consecutive operations are compiled into a single PMBus batch. A
+       batch is only executed before a ``store``, whose condition depends on
+       the preceding asserts, and at the end of the script. A batch stops
+       at the first MPSSE buffer boundary after a NACK, each PAGE write
+       ending a buffer: the operations not sent are reported as skipped.
+
+       A write whose value cannot be encoded, which can only be told once
+       the VOUT_MODE exponent is known for some formats, fails without
+       stopping the script; the other malformed lines are rejected when
+       the script is parsed.
+
+       ``abort`` selects what a failed assert stops: nothing (``none``),
+       the writes that follow it (``write``), or the rest of the script
+       (``all``). Unless it is ``none``, a batch holding an assert is
+       executed before the first operation the assert may stop.
+
+       :param device: target device
+       :param abort: operations stopped by a failed assert
+    """
+
+    OPERATORS = {'==': eq, '!=': ne, '<': lt, '<=': le, '>': gt, '>=': ge}
+    ABORT_MODES = ('none', 'write', 'all')
+
+    def __init__(self, device: UCD92xx, abort: str = 'write'):
+        if abort not in self.ABORT_MODES:
+            raise ValueError(f'Unknown abort mode: {abort}')
+        self._device = device
+        self._abort = abort
+
+    @classmethod
+    def parse(cls, lines: Iterable[str]) -> List[ScriptOp]:
+        """Parse a script.
+
+           :param lines: script lines
+           :return: operations
+           :raise ValueError: on a syntax error
+        """
+        ops = []
+        for num, line in enumerate(lines, start=1):
+            words = line.split('#', 1)[0].split()
+            if not words:
+                continue
+            op, args = words[0].lower(), words[1:]
+            try:
+                ops.append(ScriptOp(num, op, cls._parse_args(op, args)))
+            except (IndexError, ValueError) as exc:
+                raise ValueError(f'Line {num}: {exc or "syntax error"}: '
+                                 f'{line.strip()}') from exc
+        return ops
+
+    def run(self, ops: List[ScriptOp]) -> dict:
+        """Execute a parsed script.
+
+           :param ops: operations
+           :return: outcome of the script, with a result per operation
+        """
+        device = self._device
+        results = []
+        failed = False
+        assert_failed = False
+        # whether the batch holds an assert not evaluated yet
+        checking = False
+        # the board may have changed since the previous script
+        device.page = None
+        device.exponent = device.get_vout_mode()
+        batch = device.batch(page_fence=True)
+        pending = []
+        for op in ops:
+            if checking and self._stopped_by_assert(op):
+                fail, assert_fail = self._flush(batch, pending, results)
+                failed |= fail
+                assert_failed |= assert_fail
+                batch = device.batch(page_fence=True)
+                checking = False
+            if assert_failed and self._stopped_by_assert(op):
+                results.append(self._report(op, device.page, ok=False,
+                                            error='aborted'))
+                continue
+            if op.op == 'store':
+                fail, assert_fail = self._flush(batch, pending, results)
+                failed |= fail
+                assert_failed |= assert_fail
+                checking = False
+                stored = op.args[0] or not failed
+                if stored:
+                    batch = device.batch(page_fence=True)
+                    step = batch.write('store_default_all')
+                    failed |= self._flush(batch, [(op, step, None, None)],
+                                          results)[0]
+                else:
+                    results.append(self._report(op, device.page, ok=False,
+                                                error='skipped'))
+                batch = device.batch(page_fence=True)
+                continue
+            error = None
+            if op.op == 'page':
+                step = batch.set_page(op.args[0])
+            elif op.op == 'write':
+                try:
+                    step = batch.write(op.args[0], op.args[1])
+                except ValueError as exc:
+                    step, error = None, str(exc)
+            elif op.op == 'delay':
+                step = batch.delay(op.args[0])
+            else:
+                step = batch.read(op.args[0], key=len(pending))
+                checking |= op.op == 'assert'
+            pending.append((op, step, batch.page, error))
+        failed |= self._flush(batch, pending, results)[0]
+        return {'ok': not failed, 'results': results}
+
+    def run_file(self, path: str) -> dict:
+        """Parse and execute a script file.
+
+           Errors are reported in the outcome rather than raised.
+
+           :param path: script file
+           :return: outcome of the script
+        """
+        try:
+            with open(path, 'rt') as sfp:
+                ops = self.parse(sfp)
+            outcome = self.run(ops)
+        except (IOError, ValueError) as exc:
+            outcome = {'ok': False, 'error': str(exc), 'results': []}
+        return dict(script=path, **outcome)
+
+    def _stopped_by_assert(self, op: ScriptOp) -> bool:
+        return self._abort == 'all' or \
+            (self._abort == 'write' and op.op == 'write')
+
+    def _flush(self, batch: PmbusBatch, pending: list, results: list) \
+            -> Tuple[bool, bool]:
+        # return whether any operation failed, and whether an assert failed
+        if not pending:
+            return False, False
+        values = batch.execute(check=False)
+        nacks = batch.result.nacks
+        skipped = batch.result.skipped
+        failed = False
+        assert_failed = False
+        for key, (op, step, page, error) in enumerate(pending):
+            if error:
+                results.append(self._report(op, page, ok=False, error=error))
+                failed = True
+            elif step in nacks:
+                results.append(self._report(op, page, ok=False, error='nack'))
+                failed = True
+            elif step in skipped:
+                results.append(self._report(op, page, ok=False,
+                                            error='skipped'))
+                failed = True
+            elif op.op == 'read':
+                results.append(self._report(op, page, value=values[key]))
+            elif op.op == 'assert':
+                value = values[key]
+                ok = self._check(value, *op.args[1:])
+                results.append(self._report(op, page, value=value, ok=ok))
+                assert_failed |= not ok
+            else:
+                results.append(self._report(op, page))
+        pending.clear()
+        return failed or assert_failed, assert_failed
+
+    @classmethod
+    def _parse_args(cls, op: str, args: List[str]) -> tuple:
+        if op == 'page':
+            if len(args) != 1:
+                raise ValueError('page expects a page number')
+            page = int(args[0], 0)
+            if not 0 <= page < UCD92xx.PAGE_COUNT:
+                raise ValueError(f'Invalid page {page}')
+            return (page,)
+        if op == 'delay':
+            if len(args) != 1:
+                raise ValueError('delay expects a duration')
+            return (float(args[0]),)
+        if op == 'store':
+            if args not in ([], ['force']):
+                raise ValueError('store only accepts "force"')
+            return (bool(args),)
+        if op not in ('read', 'write', 'assert'):
+            raise ValueError(f'Unknown operation "{op}"')
+        name = args[0].lower()
+        if name not in UCD92xx.command_table:
+            raise ValueError(f'Unknown command "{name}"')
+        readable = UCD92xx.command_table[name][2] is not None
+        if op == 'read':
+            if len(args) != 1 or not readable:
+                raise ValueError(f'Cannot read "{name}"')
+            return (name,)
+        if op == 'write':
+            if len(args) > 2 or name == 'store_default_all':
+                raise ValueError(f'Cannot write "{name}"')
+            return (name, cls._parse_write_value(name, args[1:]))
+        if not 3 <= len(args) <= 4 or not readable or \
+                args[1] not in cls.OPERATORS:
+            raise ValueError('assert expects: name operator value '
+                             '[tolerance]')
+        tolerance = float(args[3]) if len(args) > 3 else None
+        value = cls._parse_value(args[2])
+        if tolerance is not None:
+            if args[1] != '==':
+                raise ValueError('A tolerance requires the == operator')
+            if UCD92xx.command_table[name][1] == UCD92xx.BLOCK or \
+                    isinstance(value, bytes):
+                raise ValueError('A tolerance requires a numeric value')
+        return (name, args[1], value, tolerance)
+
+    @classmethod
+    def _parse_write_value(cls, name: str, args: List[str]):
+        _, fmt, _, _, encode = UCD92xx.command_table[name]
+        if encode is None:
+            if args:
+                raise ValueError(f'"{name}" takes no value')
+            return None
+        if not args:
+            raise ValueError(f'"{name}" requires a value')
+        value = cls._parse_value(args[0])
+        if isinstance(value, bytes) != (fmt == UCD92xx.BLOCK):
+            raise ValueError(f'Cannot encode {value!r} as {fmt}')
+        if fmt in (UCD92xx.BYTE, UCD92xx.WORD, UCD92xx.BLOCK):
+            # these encodings do not depend on the device
+            try:
+                encode(None, value)
+            except (struct.error, TypeError) as exc:
+                raise ValueError(f'Cannot encode {value!r} as {fmt}') \
+                    from exc
+        return value
+
+    @staticmethod
+    def _parse_value(text: str):
+        if len(text) >= 2 and text[0] == text[-1] == '"':
+            return text[1:-1].encode('latin-1')
+        try:
+            return int(text, 0)
+        except ValueError:
+            return float(text)
+
+    @classmethod
+    def _check(cls, value, operator: str, expect, tolerance: Optional[float]) \
+            -> bool:
+        try:
+            if tolerance is not None:
+                return abs(value - expect) <= tolerance
+            return cls.OPERATORS[operator](value, expect)
+        except TypeError:
+            return False
+
+    @staticmethod
+    def _report(op: ScriptOp, page: Optional[int], value=None,
+                ok: bool = True, error: Optional[str] = None) -> dict:
+        report = {'line': op.line, 'op': op.op, 'ok': ok}
+        if op.op in ('read', 'write', 'assert'):
+            report['name'] = op.args[0]
+            report['page'] = page
+        if op.op == 'write' and op.args[1] is not None:
+            value = op.args[1]
+        if value is not None:
+            if isinstance(value, bytes):
+                text = value.decode('latin-1')
+                value = text if text.isprintable() else value.hex()
+            report['value'] = value
+        if error:
+            report['error'] = error
+        return report
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('script', nargs='*',
+                               help='PMBus script files')
+        argparser.add_argument('-u', '--url',
+                               help='FTDI interface URL')
+        argparser.add_argument('-a', '--address', default='0x34',
+                               help='PMBus slave address')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=100000,
+                               help='I2C bus frequency, in Hz')
+        argparser.add_argument('-A', '--abort',
+                               choices=ScriptRunner.ABORT_MODES,
+                               default='write',
+                               help='operations stopped by a failed assert '
+                                    '(default: write)')
+        argparser.add_argument('-i', '--stdin', action='store_true',
+                               help='also read script paths from stdin, '
+                                    'one per line, until EOF')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        if not args.script and not args.stdin:
+            argparser.error('No script specified')
+
+        failed = False
+        device = UCD92xx(int(args.address, 0), args.frequency, url=args.url)
+        try:
+            runner = ScriptRunner(device, args.abort)
+            paths = list(args.script)
+            if args.stdin:
+                paths = chain(paths, (line.strip() for line in stdin))
+            for path in paths:
+                if not path:
+                    continue
+                try:
+                    outcome = runner.run_file(path)
+                except I2cIOError as exc:
+                    outcome = {'script': path, 'ok': False,
+                               'error': str(exc), 'results': []}
+                failed |= not outcome['ok']
+                print(dumps(outcome), flush=True)
+        finally:
+            device.close()
+        if failed:
+            exit(3)
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+"""Deadline-based multi-rate PMBus polling.
+
+   Run several periodic polling tasks against one UCD92xx, merge the tasks
+   that fall due together into a single batched transaction, and measure
+   the scheduling jitter of each task.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from math import sqrt
+from sys import modules, stderr
+from threading import Event
+from time import perf_counter, sleep
+from traceback import format_exc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+from pmbus import PmbusTemplate, UCD92xx
+
+
+class PollTask:
+    """A periodic polling task and its timing statistics.
+
+       Jitter is the delay between the deadline of a run and the start of
+       its transaction. A deadline is missed when the task could not run
+       before its next deadline; missed runs are skipped rather than run
+       late in a burst. A task run early, merged with others within the
+       scheduler slack, counts as on time.
+
+       :param name: task name
+       :param reads: (command, page) pairs to read
+       :param period: polling period, in seconds
+       :param callback: called after each run with the task, the values by
+                        (command, page) and the perf_counter() timestamp
+    """
+
+    def __init__(self, name: str, reads: Sequence[Tuple[str, int]],
+                 period: float,
+                 callback: Optional[Callable[['PollTask', dict, float],
+                                             None]] = None):
+        if period <= 0:
+            raise ValueError(f'Invalid period for task {name}')
+        if not reads:
+            raise ValueError(f'Nothing to read for task {name}')
+        self.name = name
+        self.reads = tuple(reads)
+        self.period = period
+        self.callback = callback
+        self.deadline = 0.0
+        self.values: dict = {}
+        """Values of the last run."""
+        self.runs = 0
+        self.missed = 0
+        self.jitter_max = 0.0
+        self._jitter_sum = 0.0
+        self._jitter_sq = 0.0
+
+    @property
+    def jitter_mean(self) -> float:
+        """Mean jitter, in seconds."""
+        return self._jitter_sum / self.runs if self.runs else 0.0
+
+    @property
+    def jitter_rms(self) -> float:
+        """RMS jitter, in seconds."""
+        return sqrt(self._jitter_sq / self.runs) if self.runs else 0.0
+
+    def stats(self) -> dict:
+        """Timing statistics of the task."""
+        return {'period': self.period, 'runs': self.runs,
+                'missed': self.missed, 'jitter_mean': self.jitter_mean,
+                'jitter_rms': self.jitter_rms, 'jitter_max': self.jitter_max}
+
+    def _record(self, start: float) -> None:
+        # a task merged early, within the slack, has no jitter
+        late = max(0.0, start - self.deadline)
+        missed = int(late // self.period)
+        self.runs += 1
+        self.missed += missed
+        self._jitter_sum += late
+        self._jitter_sq += late * late
+        self.jitter_max = max(self.jitter_max, late)
+        self.deadline += (missed + 1) * self.period
+
+
+class PollScheduler:
+    """Run polling tasks on a UCD92xx at their own rates.
+
+       Deadlines are absolute, so the transaction durations do not make the
+       tasks drift. The scheduler sleeps until shortly before the next
+       deadline, then spins up to it. All the tasks due at that time, within
+       ``slack``, run as one transaction, where reads shared by several
+       tasks are only issued once. The transaction of each set of due tasks
+       is compiled once into a PMBus template and reused.
+
+       :param device: UCD92xx device
+       :param spin: busy-wait duration before a deadline, in seconds
+       :param slack: early tolerance, tasks due within it are merged
+    """
+
+    SPIN = 0.0005
+    SLACK = 0.0002
+
+    def __init__(self, device: UCD92xx, spin: float = SPIN,
+                 slack: float = SLACK):
+        self._device = device
+        self._spin = spin
+        self._slack = slack
+        self._tasks: List[PollTask] = []
+        self._templates: Dict[Tuple[int, ...],
+                              Tuple[PmbusTemplate, bytearray]] = {}
+        self._stop = Event()
+
+    @property
+    def tasks(self) -> List[PollTask]:
+        """Registered tasks."""
+        return list(self._tasks)
+
+    def add(self, name: str, reads: Sequence[Tuple[str, int]], period: float,
+            callback: Optional[Callable[[PollTask, dict, float], None]] =
+            None) -> PollTask:
+        """Register a polling task.
+
+           :param name: task name
+           :param reads: (command, page) pairs to read
+           :param period: polling period, in seconds
+           :param callback: see PollTask
+           :return: the task
+        """
+        for command, _ in reads:
+            # fail early rather than from the polling loop
+            self._device._lookup(command)
+        task = PollTask(name, reads, period, callback)
+        self._tasks.append(task)
+        self._templates.clear()
+        return task
+
+    def run(self, duration: Optional[float] = None) -> None:
+        """Run the tasks until stopped or for a given duration.
+
+           :param duration: run time, in seconds, or None to run until
+                            :py:meth:`stop` is called
+        """
+        if not self._tasks:
+            raise ValueError('No task to run')
+        self._stop.clear()
+        start = perf_counter()
+        end = start + duration if duration is not None else None
+        for task in self._tasks:
+            task.deadline = start
+        while not self._stop.is_set():
+            deadline = min(task.deadline for task in self._tasks)
+            if end is not None and deadline >= end:
+                break
+            pause = deadline - perf_counter() - self._spin
+            if pause > 0:
+                sleep(pause)
+                continue
+            while perf_counter() < deadline:
+                pass
+            self._run_due(perf_counter(), end)
+
+    def stop(self) -> None:
+        """Stop a running scheduler, from a callback or another thread."""
+        self._stop.set()
+
+    def stats(self) -> Dict[str, dict]:
+        """Timing statistics of each task, by name."""
+        return {task.name: task.stats() for task in self._tasks}
+
+    def _run_due(self, now: float, end: Optional[float]) -> None:
+        limit = now + self._slack
+        if end is not None:
+            # do not merge runs due after the end of the run time
+            limit = min(limit, end - 1E-9)
+        due = tuple(index for index, task in enumerate(self._tasks)
+                    if task.deadline <= limit)
+        template, buf = self._templates.get(due) or self._compile(due)
+        start = perf_counter()
+        nacks = template.execute_into(buf, check=False)
+        values = template.decode(buf, nacks=nacks)
+        done = perf_counter()
+        for index in due:
+            task = self._tasks[index]
+            task._record(start)
+            task.values = {read: values.get(read) for read in task.reads}
+            if task.callback:
+                task.callback(task, task.values, done)
+
+    def _compile(self, due: Tuple[int, ...]) \
+            -> Tuple[PmbusTemplate, bytearray]:
+        batch = self._device.batch(reset_page=True)
+        reads = []
+        for index in due:
+            for read in self._tasks[index].reads:
+                if read not in reads:
+                    reads.append(read)
+        # group the reads by page, to minimize PAGE writes
+        for command, page in sorted(reads, key=lambda read: read[1]):
+            batch.read(command, page, (command, page))
+        template = batch.freeze()
+        self._templates[due] = template, template.buffer()
+        return self._templates[due]
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('-t', '--task', action='append',
+                               required=True,
+                               help='task as PERIOD:COMMAND@PAGE[,...], '
+                                    'may be repeated')
+        argparser.add_argument('-u', '--url',
+                               help='FTDI interface URL')
+        argparser.add_argument('-a', '--address', default='0x34',
+                               help='PMBus slave address')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=400000,
+                               help='I2C bus frequency, in Hz')
+        argparser.add_argument('-D', '--duration', type=float, default=10.0,
+                               help='run time, in seconds')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        tasks = []
+        for spec in args.task:
+            try:
+                period, commands = spec.split(':', 1)
+                reads = []
+                for read in commands.split(','):
+                    command, _, page = read.partition('@')
+                    reads.append((command, int(page or '0', 0)))
+                tasks.append((spec, reads, float(period)))
+            except ValueError as exc:
+                raise ValueError(f'Invalid task "{spec}"') from exc
+        device = UCD92xx(int(args.address, 0), args.frequency, url=args.url)
+        try:
+            scheduler = PollScheduler(device)
+            for task in tasks:
+                scheduler.add(*task)
+            scheduler.run(args.duration)
+        finally:
+            device.close()
+        for task in scheduler.tasks:
+            values = ' '.join(f'{command}@{page}={value}' for
+                              (command, page), value in task.values.items())
+            print(f'{task.name}: {task.runs} runs, {task.missed} missed, '
+                  f'jitter mean {task.jitter_mean*1E6:.0f}us '
+                  f'rms {task.jitter_rms*1E6:.0f}us '
+                  f'max {task.jitter_max*1E6:.0f}us, {values}')
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
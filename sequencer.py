@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+
+"""Timed multi-rail power sequencing.
+
+   Compile a sequence of GPIO edges, PAGE/OPERATION writes and delays into
+   as few MPSSE buffers as possible, execute it in one go and report the
+   timing of each step.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from json import load
+from sys import modules, stderr
+from traceback import format_exc
+from typing import List, Optional
+from i2cbatch import StepTiming
+from pmbus import PmbusBatch, UCD92xx
+
+
+class PowerSequencer:
+    """Deterministic power sequence for a UCD92xx.
+
+       Steps are appended with the chainable methods, then executed with
+       :py:meth:`run`. Delays are generated by the FTDI engine rather than
+       by the host, so the step spacing does not depend on USB or OS
+       scheduling, as long as the sequence fits in a single MPSSE buffer.
+
+       A sequence may also be loaded from a JSON file, a list of steps::
+
+         [{"gpio": "0x0008", "level": 1},
+          {"operation": "0x80", "page": 0},
+          {"delay": 0.0005},
+          {"write": "vout_command", "value": 1.2, "page": 1},
+          {"page": 2}]
+
+       The whole sequence is sent before any acknowledge is checked, so a
+       failed rail selection is only reported once the sequence has run.
+       With ``page_fence``, each PAGE write ends an MPSSE buffer instead,
+       so that a failed rail selection stops the sequence before the
+       writes meant for that rail, at the cost of a USB round trip per
+       page change, i.e. of the step spacing determinism.
+    """
+
+    OPERATION_ON = 0x80
+    OPERATION_OFF = 0x00
+
+    def __init__(self, device: UCD92xx, page_fence: bool = False):
+        self._device = device
+        self._page_fence = page_fence
+        self._steps = []
+
+    @classmethod
+    def from_json(cls, device: UCD92xx, path: str,
+                  page_fence: bool = False) -> 'PowerSequencer':
+        """Load a sequence from a JSON file.
+
+           :param device: target device
+           :param path: JSON file, a list of steps
+           :param page_fence: end an MPSSE buffer after each PAGE write
+           :return: the sequencer
+        """
+        with open(path, 'rt') as sfp:
+            steps = load(sfp)
+        if not isinstance(steps, list):
+            raise ValueError(f'Invalid sequence: {path}')
+        sequencer = cls(device, page_fence)
+        for pos, step in enumerate(steps, start=1):
+            if not isinstance(step, dict):
+                raise ValueError(f'Invalid step #{pos}: {step}')
+            page = cls._to_int(step.get('page'))
+            if 'gpio' in step:
+                sequencer.gpio(cls._to_int(step['gpio']),
+                               int(step.get('level', 1)))
+            elif 'operation' in step:
+                sequencer.operation(cls._to_int(step['operation']), page)
+            elif 'write' in step:
+                sequencer.write(step['write'], step.get('value'), page)
+            elif 'delay' in step:
+                sequencer.delay(float(step['delay']))
+            elif page is not None:
+                sequencer.page(page)
+            else:
+                raise ValueError(f'Invalid step #{pos}: {step}')
+        return sequencer
+
+    def gpio(self, pins: int, level: int) -> 'PowerSequencer':
+        """Drive GPIO output pins.
+
+           :param pins: GPIO pins to change
+           :param level: 1 to drive the pins high, 0 to drive them low
+           :return: self
+        """
+        self._steps.append(('gpio', pins, pins if level else 0))
+        return self
+
+    def page(self, page: int) -> 'PowerSequencer':
+        """Select a PMBus page.
+
+           :param page: page, i.e. rail
+           :return: self
+        """
+        self._steps.append(('page', page))
+        return self
+
+    def operation(self, value: int, page: Optional[int] = None) \
+            -> 'PowerSequencer':
+        """Write the OPERATION command of a rail.
+
+           :param value: OPERATION value, e.g. OPERATION_ON
+           :param page: page to select first
+           :return: self
+        """
+        return self.write('operation', value, page)
+
+    def write(self, name: str, value=None, page: Optional[int] = None) \
+            -> 'PowerSequencer':
+        """Write any PMBus command.
+
+           :param name: command name, as in the UCD92xx command table
+           :param value: value to write, encoded as ``UCD92xx.write``
+           :param page: page to select first
+           :return: self
+        """
+        self._steps.append(('write', name, value, page))
+        return self
+
+    def delay(self, seconds: float) -> 'PowerSequencer':
+        """Wait before the next step.
+
+           :param seconds: delay duration
+           :return: self
+        """
+        self._steps.append(('delay', seconds))
+        return self
+
+    def compile(self) -> PmbusBatch:
+        """Compile the sequence into a batch.
+
+           The control signal only brackets the sequence if the sequence
+           does not drive it itself.
+
+           :return: the batch, ready to execute
+        """
+        ctrl = self._device.gpio_ctrl_mask
+        drives_ctrl = any(step[0] == 'gpio' and step[1] & ctrl
+                          for step in self._steps)
+        batch = PmbusBatch(self._device, ctrl=not drives_ctrl,
+                           page_fence=self._page_fence)
+        for kind, *args in self._steps:
+            if kind == 'gpio':
+                batch.set_gpio(*args)
+            elif kind == 'page':
+                batch.set_page(*args)
+            elif kind == 'write':
+                batch.write(*args)
+            else:
+                batch.delay(*args)
+        return batch
+
+    def run(self) -> List[StepTiming]:
+        """Execute the sequence.
+
+           Timings are nominal within an MPSSE buffer, i.e. computed from
+           the bus clock, while the duration of each buffer is measured.
+
+           :return: the timing of each step
+           :raise I2cNackError: a step, e.g. a PAGE write, was not
+                                acknowledged
+        """
+        batch = self.compile()
+        batch.execute()
+        return batch.result.timings
+
+    @staticmethod
+    def _to_int(value) -> Optional[int]:
+        if value is None or isinstance(value, int):
+            return value
+        return int(value, 0)
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('sequence',
+                               help='JSON file of sequence steps')
+        argparser.add_argument('-u', '--url',
+                               help='FTDI interface URL')
+        argparser.add_argument('-a', '--address', default='0x34',
+                               help='PMBus slave address')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=100000,
+                               help='I2C bus frequency, in Hz')
+        argparser.add_argument('-p', '--page-fence', action='store_true',
+                               help='stop before the writes to a rail whose '
+                                    'selection failed, at the cost of a USB '
+                                    'round trip per page change')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        device = UCD92xx(int(args.address, 0), args.frequency, url=args.url)
+        try:
+            sequencer = PowerSequencer.from_json(device, args.sequence,
+                                                args.page_fence)
+            timings = sequencer.run()
+        finally:
+            device.close()
+        for timing in timings:
+            print(f'{timing.offset*1E6:10.1f}us {timing.duration*1E6:9.1f}us '
+                  f'[{timing.segment}] {timing.name}')
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+
+"""Multi-process PMBus telemetry sharding.
+
+   Poll several FTDI adapters, each from its own worker process, into
+   shared-memory ring buffers that any process can read without locking.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from json import dumps, loads
+from multiprocessing import get_context
+from multiprocessing.shared_memory import SharedMemory
+from os import getpid
+from struct import Struct
+from sys import modules, stderr, version_info
+from time import monotonic, sleep, time_ns
+from traceback import format_exc
+from typing import Dict, List, Sequence, Tuple
+import numpy as np
+
+
+class SampleRing:
+    """Single-writer ring buffer of decoded samples in shared memory.
+
+       The segment starts with a header (magic, column count, capacity and
+       the column names), followed by the head counter, i.e. the count of
+       samples ever written, and the slots. Each slot holds a sequence
+       number, a timestamp (nanoseconds since the epoch) and one float64
+       value per column.
+
+       Consistency relies on a per-slot seqlock rather than on a lock: the
+       writer marks the slot odd (``2n+1``) before updating it and even
+       (``2n+2``) once done, then publishes the new head. A reader checks
+       that the sequence number of a slot is the expected even value after
+       reading it; any other value means the slot was being overwritten.
+
+       :param shm: shared memory segment
+    """
+
+    MAGIC = b'PMBSHM01'
+    HEADER = Struct('<8sII')
+    HEADER_SIZE = 4096
+    """Header size, column names included."""
+
+    def __init__(self, shm: SharedMemory):
+        magic, columns, capacity = self.HEADER.unpack_from(shm.buf)
+        if magic != self.MAGIC:
+            raise ValueError(f'Not a sample ring: {shm.name}')
+        names_len = Struct('<I').unpack_from(shm.buf, self.HEADER.size)[0]
+        start = self.HEADER.size + 4
+        self._names = tuple(loads(bytes(shm.buf[start:start+names_len])))
+        self._shm = shm
+        self._capacity = capacity
+        self._head = np.ndarray((1,), dtype='<u8', buffer=shm.buf,
+                                offset=self.HEADER_SIZE - 8)
+        self._slots = np.ndarray((capacity,), dtype=self.slot_dtype(columns),
+                                 buffer=shm.buf, offset=self.HEADER_SIZE)
+        self._seq = self._slots['seq']
+        self._time = self._slots['time']
+        self._values = self._slots['values']
+
+    @staticmethod
+    def slot_dtype(columns: int) -> np.dtype:
+        """Data type of a ring slot."""
+        return np.dtype([('seq', '<u8'), ('time', '<i8'),
+                         ('values', '<f8', (columns,))])
+
+    @classmethod
+    def create(cls, name: str, columns: Sequence[str], capacity: int) \
+            -> 'SampleRing':
+        """Create a ring in a new shared memory segment.
+
+           :param name: segment name
+           :param columns: column names
+           :param capacity: slot count
+           :return: the ring, owner of the segment
+        """
+        if capacity < 1:
+            raise ValueError('Invalid ring capacity')
+        names = dumps(list(columns)).encode()
+        if cls.HEADER.size + 4 + len(names) > cls.HEADER_SIZE - 8:
+            raise ValueError('Too many columns')
+        size = cls.HEADER_SIZE + \
+            capacity * cls.slot_dtype(len(columns)).itemsize
+        shm = SharedMemory(name, create=True, size=size)
+        shm.buf[:cls.HEADER_SIZE] = bytes(cls.HEADER_SIZE)
+        cls.HEADER.pack_into(shm.buf, 0, cls.MAGIC, len(columns), capacity)
+        Struct('<I').pack_into(shm.buf, cls.HEADER.size, len(names))
+        start = cls.HEADER.size + 4
+        shm.buf[start:start+len(names)] = names
+        ring = cls(shm)
+        ring._seq[:] = 0
+        return ring
+
+    @classmethod
+    def attach(cls, name: str, track: bool = False) -> 'SampleRing':
+        """Attach to an existing ring, e.g. from a consumer process.
+
+           :param name: segment name
+           :param track: register the segment with the resource tracker,
+                         only for processes that share the tracker of the
+                         creator, i.e. its multiprocessing children
+           :return: the ring
+        """
+        if version_info >= (3, 13):
+            #pylint: disable-msg=unexpected-keyword-arg
+            shm = SharedMemory(name, track=track)
+        else:
+            shm = SharedMemory(name)
+            if not track:
+                # only the creator may unlink the segment, do not let the
+                # resource tracker of this process destroy it at exit
+                #pylint: disable-msg=import-outside-toplevel
+                from multiprocessing import resource_tracker
+                resource_tracker.unregister(shm._name, 'shared_memory')
+        return cls(shm)
+
+    @property
+    def name(self) -> str:
+        """Shared memory segment name."""
+        return self._shm.name
+
+    @property
+    def columns(self) -> Tuple[str, ...]:
+        """Column names."""
+        return self._names
+
+    @property
+    def capacity(self) -> int:
+        """Slot count."""
+        return self._capacity
+
+    @property
+    def head(self) -> int:
+        """Count of samples written since the ring was created."""
+        return int(self._head[0])
+
+    def append(self, timestamp: int, values: Sequence[float]) -> None:
+        """Write a sample. Only one process may write to a ring.
+
+           :param timestamp: nanoseconds since the epoch
+           :param values: one value per column, NaN if unavailable
+        """
+        count = int(self._head[0])
+        slot = count % self._capacity
+        self._seq[slot] = 2 * count + 1
+        self._time[slot] = timestamp
+        self._values[slot] = values
+        self._seq[slot] = 2 * count + 2
+        self._head[0] = count + 1
+
+    def view(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Zero-copy access to the slots.
+
+           The arrays are updated in place by the writer; a slot is valid
+           only while its sequence number is even and unchanged.
+
+           :return: sequence number, timestamp and value arrays
+        """
+        return self._seq, self._time, self._values
+
+    def read(self, start: int = 0) -> Tuple[int, np.ndarray, np.ndarray]:
+        """Copy the samples written since a position.
+
+           Samples already overwritten, or being overwritten, are skipped.
+
+           :param start: head value of the previous call
+           :return: the new position, timestamps and values
+        """
+        head = int(self._head[0])
+        start = max(start, head - self._capacity)
+        index = np.arange(start, head, dtype=np.uint64)
+        slots = index % np.uint64(self._capacity)
+        times = self._time[slots]
+        values = self._values[slots]
+        valid = self._seq[slots] == 2 * index + 2
+        return head, times[valid], values[valid]
+
+    def close(self) -> None:
+        """Detach from the segment."""
+        # release the buffer exports before closing the mapping
+        self._head = self._slots = self._seq = self._time = self._values = \
+            None
+        self._shm.close()
+
+    def unlink(self) -> None:
+        """Destroy the segment, only for the ring creator."""
+        self._shm.unlink()
+
+
+def poll_worker(url: str, address: int, frequency: float,
+                names: Sequence[str], pages: Sequence[int], interval: float,
+                ring_name: str, stop) -> None:
+    """Worker process: poll one adapter into a ring until stopped.
+
+       All the reads of a sample are precompiled into a single PMBus
+       template. Values whose read is not acknowledged are stored as NaN.
+
+       :param url: FTDI interface URL
+       :param address: PMBus slave address
+       :param frequency: I2C bus frequency, in Hz
+       :param names: commands to read
+       :param pages: pages to read the commands from
+       :param interval: sampling period, in seconds, 0 to poll back to back
+       :param ring_name: output ring
+       :param stop: multiprocessing event that stops the worker
+    """
+    #pylint: disable-msg=import-outside-toplevel
+    # the parent only needs the rings, keep USB out of its import chain
+    from pmbus import UCD92xx
+    ring = SampleRing.attach(ring_name, track=True)
+    device = UCD92xx(address, frequency, url=url)
+    try:
+        batch = device.batch(reset_page=True)
+        keys = [(name, page) for page in pages for name in names]
+        for name, page in keys:
+            batch.read(name, page, (name, page))
+        template = batch.freeze()
+        buf = template.buffer()
+        nan = float('nan')
+        deadline = monotonic()
+        while not stop.is_set():
+            nacks = template.execute_into(buf, check=False)
+            timestamp = time_ns()
+            values = template.decode(buf, nacks=nacks)
+            ring.append(timestamp, [float(values.get(key, nan))
+                                    for key in keys])
+            if interval > 0:
+                deadline += interval
+                pause = deadline - monotonic()
+                if pause > 0:
+                    sleep(pause)
+                else:
+                    deadline = monotonic()
+    finally:
+        device.close()
+        ring.close()
+
+
+class TelemetrySupervisor:
+    """Start and watch one telemetry worker process per adapter.
+
+       Each worker owns a SampleRing, created by the supervisor, whose
+       columns are named ``command.pPAGE`` as in the telemetry store.
+       Workers are started with the ``spawn`` method, so that no USB
+       context is inherited across processes.
+
+       :param urls: FTDI interface URLs, one worker each
+       :param address: PMBus slave address
+       :param names: commands to sample
+       :param pages: pages to sample the commands from
+       :param interval: sampling period, in seconds
+       :param capacity: ring slot count
+       :param frequency: I2C bus frequency, in Hz
+    """
+
+    CAPACITY = 1 << 16
+
+    def __init__(self, urls: Sequence[str], address: int,
+                 names: Sequence[str], pages: Sequence[int] = (0,),
+                 interval: float = 0.0, capacity: int = CAPACITY,
+                 frequency: float = 400000):
+        if not urls:
+            raise ValueError('No adapter to poll')
+        self._ctx = get_context('spawn')
+        self._stop = self._ctx.Event()
+        self._args = (address, frequency, list(names), list(pages), interval)
+        columns = [f'{name}.p{page}' for page in pages for name in names]
+        self._rings: Dict[str, SampleRing] = {}
+        self._workers: Dict[str, object] = {}
+        try:
+            for index, url in enumerate(urls):
+                self._rings[url] = SampleRing.create(
+                    f'pmbus-{getpid()}-{index}', columns, capacity)
+        except Exception:
+            self._release()
+            raise
+
+    def __enter__(self) -> 'TelemetrySupervisor':
+        self.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    @property
+    def rings(self) -> Dict[str, SampleRing]:
+        """Ring of each adapter, by URL."""
+        return dict(self._rings)
+
+    def start(self) -> None:
+        """Start the workers that are not running."""
+        self._stop.clear()
+        for url, ring in self._rings.items():
+            worker = self._workers.get(url)
+            if worker and worker.is_alive():
+                continue
+            worker = self._ctx.Process(target=poll_worker,
+                                       args=(url, *self._args, ring.name,
+                                             self._stop),
+                                       name=f'pmbus {url}', daemon=True)
+            worker.start()
+            self._workers[url] = worker
+
+    def check(self, restart: bool = False) -> List[str]:
+        """Find the adapters whose worker has died.
+
+           :param restart: start those workers again
+           :return: URLs of the dead workers
+        """
+        dead = [url for url, worker in self._workers.items()
+                if not worker.is_alive()]
+        if dead and restart:
+            self.start()
+        return dead
+
+    def stop(self, timeout: float = 2.0) -> None:
+        """Stop all workers.
+
+           :param timeout: grace period of each worker, in seconds
+        """
+        self._stop.set()
+        for worker in self._workers.values():
+            worker.join(timeout)
+            if worker.is_alive():
+                worker.terminate()
+                worker.join()
+        self._workers.clear()
+
+    def close(self) -> None:
+        """Stop all workers and destroy the rings."""
+        self.stop()
+        self._release()
+
+    def _release(self) -> None:
+        for ring in self._rings.values():
+            ring.close()
+            ring.unlink()
+        self._rings.clear()
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('url', nargs='+',
+                               help='FTDI interface URLs, one worker each')
+        argparser.add_argument('-a', '--address', default='0x34',
+                               help='PMBus slave address')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=400000,
+                               help='I2C bus frequency, in Hz')
+        argparser.add_argument('-n', '--names', default='read_vout',
+                               help='comma-separated commands to sample')
+        argparser.add_argument('-p', '--pages', default='0',
+                               help='comma-separated pages to sample')
+        argparser.add_argument('-i', '--interval', type=float, default=0.0,
+                               help='sampling period, in seconds')
+        argparser.add_argument('-c', '--capacity', type=int,
+                               default=TelemetrySupervisor.CAPACITY,
+                               help='ring buffer slots per adapter')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        names = args.names.split(',')
+        pages = [int(page, 0) for page in args.pages.split(',')]
+        with TelemetrySupervisor(args.url, int(args.address, 0), names,
+                                 pages, args.interval, args.capacity,
+                                 args.frequency) as supervisor:
+            positions = {url: 0 for url in args.url}
+            while True:
+                sleep(1.0)
+                total = 0
+                for url, ring in supervisor.rings.items():
+                    positions[url], times, values = \
+                        ring.read(positions[url])
+                    total += len(times)
+                    if len(times):
+                        last = ' '.join(f'{col}={val:.4g}' for col, val in
+                                        zip(ring.columns, values[-1]))
+                        print(f'{url}: {len(times)} samples/s {last}')
+                for url in supervisor.check(restart=True):
+                    print(f'{url}: worker died, restarted', file=stderr)
+                print(f'total: {total} samples/s')
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
@@ -1,5 +1,6 @@
 #!/usr/bin/env python3
 from pyftdi.spi import SpiController, SpiIOError
+from spiqual import SpiQualifier
 
 CMD_JEDEC_ID = 0x9f
 def main():
@@ -8,8 +9,9 @@ def main():
     # Configure the first interface (IF/1) of the FTDI device as a SPI master
     spi.configure('ftdi:///1')
 
-    # Get a port to a SPI slave w/ /CS on A*BUS3 and SPI mode 0 @ 12MHz
-    slave = spi.get_port(cs=0, freq=12E6, mode=0)
+    # Get a port to a SPI slave w/ /CS on A*BUS3, at the fastest SPI mode 0
+    # frequency qualified for this adapter (cached after the first run)
+    slave = SpiQualifier.get_port(spi, cs=0, modes=(0,))
 
     # Request the JEDEC ID from the SPI slave
     jedec_id = slave.exchange([0x9f], 3)
@@ -0,0 +1,242 @@
+#!/usr/bin/env python3
+
+"""SPI bus frequency and mode qualification.
+
+   Step the SPI clock up to the adapter limit while checking a known
+   readback, and remember the fastest stable setting per adapter and /CS.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from logging import getLogger
+from sys import modules, stderr
+from time import perf_counter
+from traceback import format_exc
+from typing import List, Optional, Sequence, Tuple
+from pyftdi.spi import SpiController, SpiIOError, SpiPort
+from adapter import adapter_serial, load_cache, save_cache
+
+
+class SpiQualifier:
+    """Find the fastest reliable SPI frequency and mode for a slave.
+
+       The readback probe is either the JEDEC ID (``jedec``) or the SFDP
+       header (``sfdp``). A reference value is captured at the lowest
+       candidate frequency, then each faster step must reproduce it on every
+       pass. Qualification stops at the first failing frequency for a mode.
+    """
+
+    CMD_JEDEC_ID = 0x9f
+    CMD_READ_SFDP = 0x5a
+    SFDP_SIGNATURE = b'SFDP'
+
+    PROBES = ('jedec', 'sfdp')
+    DEFAULT_PASSES = 16
+
+    # divisors of the highest MPSSE clock, the FTDI can only generate
+    # frequencies that are integral fractions of it
+    DIVISORS = (30, 20, 15, 12, 10, 8, 6, 5, 4, 3, 2, 1)
+
+    CACHE_NAME = 'spi_qualification'
+
+    def __init__(self, spi: SpiController, cs: int = 0,
+                 probe: str = 'jedec', passes: int = DEFAULT_PASSES,
+                 modes: Sequence[int] = (0,)):
+        if probe not in self.PROBES:
+            raise ValueError(f'Unknown probe: {probe}')
+        if passes < 1:
+            raise ValueError('At least one pass is required')
+        self.log = getLogger('spiqual')
+        self._spi = spi
+        self._cs = cs
+        self._probe = probe
+        self._passes = passes
+        self._modes = tuple(modes)
+
+    @property
+    def key(self) -> str:
+        """Cache key of the qualified adapter/CS pair."""
+        return f'{adapter_serial(self._spi.ftdi)}/cs{self._cs}'
+
+    def frequencies(self) -> List[float]:
+        """Report the candidate frequencies, in ascending order.
+
+           :return: achievable SPI frequencies up to the adapter limit
+        """
+        fmax = self._spi.frequency_max
+        return [fmax/div for div in self.DIVISORS]
+
+    def readback(self, port: SpiPort) -> bytes:
+        """Read the probe value once at the current port settings.
+
+           :param port: SPI port to probe
+           :return: probe bytes
+        """
+        if self._probe == 'sfdp':
+            # 24-bit address 0, one dummy byte, SFDP header + 1st param header
+            return bytes(port.exchange([self.CMD_READ_SFDP, 0, 0, 0, 0], 16))
+        return bytes(port.exchange([self.CMD_JEDEC_ID], 3))
+
+    def _check_reference(self, reference: bytes) -> None:
+        if self._probe == 'sfdp':
+            if not reference.startswith(self.SFDP_SIGNATURE):
+                raise SpiIOError(f'No SFDP signature: {reference.hex()}')
+        elif reference in (b'\x00' * len(reference), b'\xff' * len(reference)):
+            raise SpiIOError(f'No JEDEC ID: {reference.hex()}')
+
+    def _stable(self, port: SpiPort, reference: bytes) -> bool:
+        for _ in range(self._passes):
+            if self.readback(port) != reference:
+                return False
+        return True
+
+    def qualify_mode(self, port: SpiPort, mode: int) \
+            -> Tuple[Optional[float], bytes]:
+        """Qualify a single SPI mode.
+
+           :param port: SPI port to qualify
+           :param mode: SPI mode
+           :return: the fastest stable frequency (None if even the slowest
+                    step is unstable) and the reference readback
+        """
+        freqs = self.frequencies()
+        port.set_mode(mode)
+        port.set_frequency(freqs[0])
+        reference = self.readback(port)
+        self._check_reference(reference)
+        best = None
+        for freq in freqs:
+            port.set_frequency(freq)
+            if not self._stable(port, reference):
+                self.log.info('Mode %d unstable at %.3f MHz', mode, freq/1E6)
+                break
+            best = freq
+        return best, reference
+
+    def qualify(self) -> dict:
+        """Qualify all candidate modes and keep the fastest one.
+
+           :return: qualification record
+           :raise SpiIOError: if no mode is stable at any frequency
+        """
+        port = self._spi.get_port(self._cs)
+        record = None
+        for mode in self._modes:
+            freq, reference = self.qualify_mode(port, mode)
+            if freq is None:
+                continue
+            if not record or freq > record['frequency']:
+                record = {'frequency': freq, 'mode': mode,
+                          'probe': self._probe,
+                          'reference': reference.hex()}
+        if not record:
+            raise SpiIOError(f'No stable SPI setting for {self.key}')
+        port.set_mode(record['mode'])
+        port.set_frequency(record['frequency'])
+        return record
+
+    def verify(self, port: SpiPort, record: dict) -> bool:
+        """Check a cached record still holds, with a single readback.
+
+           :param port: SPI port, already set to the recorded settings
+           :param record: cached qualification record
+           :return: True if the readback matches the recorded reference
+        """
+        try:
+            return self.readback(port).hex() == record['reference']
+        except SpiIOError:
+            return False
+
+    @classmethod
+    def get_port(cls, spi: SpiController, cs: int = 0, probe: str = 'jedec',
+                 passes: int = DEFAULT_PASSES, modes: Sequence[int] = (0,),
+                 requalify: bool = False) -> SpiPort:
+        """Obtain a SPI port running at the fastest qualified setting.
+
+           A cached setting is reused as long as a single readback still
+           matches; otherwise the slave is qualified again and the cache is
+           updated.
+
+           :param spi: a configured SPI controller
+           :param cs: chip select slot
+           :param probe: readback probe, 'jedec' or 'sfdp'
+           :param passes: count of identical readbacks required per step
+           :param modes: SPI modes to qualify
+           :param requalify: ignore any cached setting
+           :return: the configured SPI port
+        """
+        qualifier = cls(spi, cs, probe, passes, modes)
+        cache = load_cache(cls.CACHE_NAME)
+        record = cache.get(qualifier.key)
+        port = spi.get_port(cs)
+        if record and not requalify and record.get('probe') == probe and \
+                record.get('mode') in modes:
+            port.set_mode(record['mode'])
+            port.set_frequency(min(record['frequency'], spi.frequency_max))
+            if qualifier.verify(port, record):
+                return port
+            qualifier.log.warning('Cached SPI setting for %s no longer '
+                                  'valid', qualifier.key)
+        record = qualifier.qualify()
+        cache[qualifier.key] = record
+        save_cache(cls.CACHE_NAME, cache)
+        return port
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('device', nargs='?', default='ftdi:///1',
+                               help='serial port device name')
+        argparser.add_argument('-c', '--cs', type=int, default=0,
+                               help='chip select slot')
+        argparser.add_argument('-m', '--mode', type=int, action='append',
+                               choices=(0, 1, 2, 3),
+                               help='SPI mode to qualify, may be repeated')
+        argparser.add_argument('-p', '--probe', choices=SpiQualifier.PROBES,
+                               default='jedec', help='readback probe')
+        argparser.add_argument('-n', '--passes', type=int,
+                               default=SpiQualifier.DEFAULT_PASSES,
+                               help='identical readbacks required per step')
+        argparser.add_argument('-r', '--requalify', action='store_true',
+                               help='ignore cached setting')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        spi = SpiController()
+        try:
+            spi.configure(args.device)
+            port = SpiQualifier.get_port(spi, args.cs, args.probe,
+                                         args.passes, args.mode or (0,),
+                                         args.requalify)
+            print(f'cs{args.cs}: mode {port.mode} @ '
+                  f'{port.frequency/1E6:.3f} MHz')
+            # rough bulk throughput at the qualified setting
+            size = 0x10000
+            start = perf_counter()
+            port.exchange([0x03, 0, 0, 0], size)
+            elapsed = perf_counter() - start
+            print(f'read {size} bytes in {elapsed*1E3:.1f} ms '
+                  f'({size/elapsed/1024:.0f} KiB/s)')
+        finally:
+            spi.terminate()
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+
+"""Startup time benchmark of the PMBus tools.
+
+   Time the fixed overhead of short PMBus invocations, each phase in a
+   fresh interpreter: module import, device creation, and the first
+   transaction when an adapter is given.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from os.path import dirname
+from statistics import median
+from subprocess import run
+from sys import executable, modules, stderr
+from time import perf_counter
+from traceback import format_exc
+from typing import Dict, List, Optional
+
+PHASE_SCRIPT = '''
+from time import perf_counter
+start = perf_counter()
+import pmbus
+imported = perf_counter()
+device = pmbus.UCD92xx({address}, {frequency}, url={url!r}, lazy={lazy})
+created = perf_counter()
+if {transact}:
+    device.read('status_word')
+transacted = perf_counter()
+device.close()
+print(imported - start, created - imported, transacted - created)
+'''
+
+
+class StartupBenchmark:
+    """Measure the startup phases of a PMBus tool.
+
+       Each run is a new interpreter, so the measure includes the cold
+       import of the modules, as for a real short-lived invocation.
+
+       :param url: FTDI interface URL, None to skip the transaction phase
+       :param address: PMBus slave address
+       :param frequency: I2C bus frequency, in Hz
+    """
+
+    PHASES = ('interpreter', 'import', 'create', 'first transaction')
+
+    def __init__(self, url: Optional[str] = None, address: int = 0x34,
+                 frequency: float = 400000):
+        self._url = url
+        self._address = address
+        self._frequency = frequency
+
+    def run(self, lazy: bool, count: int = 10) -> Dict[str, List[float]]:
+        """Time all phases.
+
+           Without an adapter, only lazy devices can be created.
+
+           :param lazy: create lazy devices
+           :param count: number of runs
+           :return: durations of each phase, in seconds
+        """
+        if not lazy and not self._url:
+            raise ValueError('Eager devices need an adapter URL')
+        script = PHASE_SCRIPT.format(address=self._address,
+                                     frequency=self._frequency,
+                                     url=self._url, lazy=lazy,
+                                     transact=bool(self._url))
+        results = {phase: [] for phase in self.PHASES}
+        cwd = dirname(__file__) or '.'
+        for _ in range(count):
+            results['interpreter'].append(self._time_process(['-c', 'pass']))
+            proc = run([executable, '-c', script], capture_output=True,
+                       text=True, cwd=cwd, check=False)
+            if proc.returncode:
+                raise IOError(proc.stderr.strip().splitlines()[-1])
+            for phase, value in zip(self.PHASES[1:], proc.stdout.split()):
+                results[phase].append(float(value))
+        if not self._url:
+            del results['first transaction']
+        return results
+
+    @staticmethod
+    def _time_process(args: List[str]) -> float:
+        start = perf_counter()
+        run([executable, *args], check=True)
+        return perf_counter() - start
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('-u', '--url',
+                               help='FTDI interface URL, to also time the '
+                                    'eager mode and the first transaction')
+        argparser.add_argument('-a', '--address', default='0x34',
+                               help='PMBus slave address')
+        argparser.add_argument('-f', '--frequency', type=float,
+                               default=400000,
+                               help='I2C bus frequency, in Hz')
+        argparser.add_argument('-n', '--count', type=int, default=10,
+                               help='number of runs')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        bench = StartupBenchmark(args.url, int(args.address, 0),
+                                 args.frequency)
+        modes = (True, False) if args.url else (True,)
+        for lazy in modes:
+            results = bench.run(lazy, args.count)
+            print('lazy' if lazy else 'eager')
+            for phase, values in results.items():
+                print(f'  {phase:18s} median {median(values)*1E3:8.2f}ms '
+                      f'min {min(values)*1E3:8.2f}ms')
+
+    except (ImportError, IOError, NotImplementedError, ValueError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)
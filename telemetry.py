@@ -0,0 +1,454 @@
+#!/usr/bin/env python3
+
+"""Columnar on-disk store for PMBus telemetry.
+
+   Samples are appended as raw PMBus words to one column per command and
+   page. Each column is a sequence of fixed-size, memory-mapped chunk files,
+   so that long captures can be queried and downsampled one chunk at a time
+   without loading them in memory.
+"""
+
+#pylint: disable-msg=broad-except
+
+from argparse import ArgumentParser
+from json import dump, load
+from os import makedirs, replace
+from os.path import isfile, join as joinpath
+from sys import modules, stderr
+from time import time_ns
+from traceback import format_exc
+from typing import Callable, Dict, Iterable, Iterator, Optional, Tuple
+import numpy as np
+
+
+def decode_linear11(raw: np.ndarray) -> np.ndarray:
+    """Array counterpart of UCD92xx.decode_lin11.
+
+       :param raw: LINEAR11 words
+       :return: decoded values
+    """
+    raw = raw.astype(np.int32)
+    exp = (raw >> 11) & 0x1f
+    exp = np.where(exp & 0x10, exp - 0x20, exp)
+    mantissa = raw & 0x7ff
+    mantissa = np.where(mantissa & 0x400, mantissa - 0x800, mantissa)
+    return np.ldexp(mantissa.astype(np.float64), exp)
+
+
+def decode_ulinear16(raw: np.ndarray, exponent: int) -> np.ndarray:
+    """Array counterpart of UCD92xx.decode_ulin16.
+
+       :param raw: ULINEAR16 words
+       :param exponent: VOUT_MODE exponent
+       :return: decoded values
+    """
+    return np.ldexp(raw.astype(np.float64), exponent)
+
+
+def decode_slinear16(raw: np.ndarray, exponent: int) -> np.ndarray:
+    """Array counterpart of UCD92xx.decode_slin16.
+
+       :param raw: SLINEAR16 words
+       :param exponent: VOUT_MODE exponent
+       :return: decoded values
+    """
+    return np.ldexp(raw.astype(np.int16).astype(np.float64), exponent)
+
+
+class TelemetryColumn:
+    """Append-only column of raw samples for one command and page.
+
+       A column is made of chunk files of ``chunk_size`` samples; each chunk
+       holds a timestamp file (int64 nanoseconds since the epoch) and a raw
+       word file (uint16). Timestamps are expected to be monotonic.
+
+       ``sealed`` is called each time a chunk is full, so that the owner
+       can commit the sample count.
+    """
+
+    def __init__(self, path: str, fmt: str, exponent: Optional[int],
+                 chunk_size: int, count: int = 0,
+                 sealed: Optional[Callable[[], None]] = None):
+        if fmt not in TelemetryStore.FORMATS:
+            raise ValueError(f'Unsupported telemetry format: {fmt}')
+        if fmt in ('ulinear16', 'slinear16') and exponent is None:
+            raise ValueError(f'{fmt.upper()} column requires an exponent')
+        makedirs(path, exist_ok=True)
+        self._path = path
+        self.format = fmt
+        self.exponent = exponent
+        self._chunk_size = chunk_size
+        self._count = count
+        self._sealed = sealed
+        self._ts = None
+        self._raw = None
+        self._chunk = None
+
+    def __len__(self) -> int:
+        return self._count
+
+    @property
+    def info(self) -> dict:
+        """Column metadata."""
+        return {'format': self.format, 'exponent': self.exponent,
+                'count': self._count}
+
+    def append(self, raw: int, timestamp: Optional[int] = None) -> None:
+        """Append one raw sample.
+
+           :param raw: raw PMBus word or byte
+           :param timestamp: time in ns since the epoch, default to now
+        """
+        chunk, pos = divmod(self._count, self._chunk_size)
+        if chunk != self._chunk:
+            self._open_chunk(chunk)
+        self._ts[pos] = time_ns() if timestamp is None else timestamp
+        self._raw[pos] = raw
+        self._count += 1
+
+    def extend(self, raws: Iterable[int], timestamps: Iterable[int]) -> None:
+        """Append a batch of raw samples.
+
+           :param raws: raw PMBus words or bytes
+           :param timestamps: matching times in ns since the epoch
+        """
+        raws = np.asarray(raws, dtype=np.uint16)
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        if raws.shape != timestamps.shape:
+            raise ValueError('Sample and timestamp counts differ')
+        done = 0
+        while done < len(raws):
+            chunk, pos = divmod(self._count, self._chunk_size)
+            if chunk != self._chunk:
+                self._open_chunk(chunk)
+            size = min(len(raws) - done, self._chunk_size - pos)
+            self._ts[pos:pos+size] = timestamps[done:done+size]
+            self._raw[pos:pos+size] = raws[done:done+size]
+            self._count += size
+            done += size
+
+    def flush(self) -> None:
+        """Flush the current chunk to disk."""
+        if self._ts is not None:
+            self._ts.flush()
+            self._raw.flush()
+
+    def close(self) -> None:
+        """Release the current chunk mapping."""
+        self.flush()
+        self._ts = self._raw = self._chunk = None
+
+    def decode(self, raw: np.ndarray) -> np.ndarray:
+        """Decode raw samples of this column.
+
+           :param raw: raw samples
+           :return: values, as float for LINEAR11/(U|S)LINEAR16 columns
+        """
+        if self.format == 'linear11':
+            return decode_linear11(raw)
+        if self.format == 'ulinear16':
+            return decode_ulinear16(raw, self.exponent)
+        if self.format == 'slinear16':
+            return decode_slinear16(raw, self.exponent)
+        return raw.astype(np.int64)
+
+    def chunks(self, start: Optional[int] = None, end: Optional[int] = None) \
+            -> Iterator[Tuple[np.ndarray, np.ndarray]]:
+        """Iterate over the stored chunks, restricted to a time range.
+
+           The yielded arrays are read-only memory maps (raw samples are not
+           decoded), valid till the next iteration.
+
+           :param start: first timestamp in ns, inclusive
+           :param end: last timestamp in ns, exclusive
+           :return: iterator on (timestamps, raw samples) pairs
+        """
+        self.flush()
+        chunks = (self._count + self._chunk_size - 1) // self._chunk_size
+        for chunk in range(chunks):
+            count = min(self._chunk_size,
+                        self._count - chunk * self._chunk_size)
+            tsfile, rawfile = self._chunk_files(chunk)
+            ts = np.memmap(tsfile, dtype=np.int64, mode='r',
+                           shape=(self._chunk_size,))[:count]
+            if (start is not None and ts[-1] < start) or \
+                    (end is not None and ts[0] >= end):
+                continue
+            lo = 0 if start is None else np.searchsorted(ts, start, 'left')
+            hi = count if end is None else np.searchsorted(ts, end, 'left')
+            raw = np.memmap(rawfile, dtype=np.uint16, mode='r',
+                            shape=(self._chunk_size,))[:count]
+            yield ts[lo:hi], raw[lo:hi]
+
+    def query(self, start: Optional[int] = None, end: Optional[int] = None) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """Load and decode a time range.
+
+           :param start: first timestamp in ns, inclusive
+           :param end: last timestamp in ns, exclusive
+           :return: timestamps and decoded values
+        """
+        parts = [(np.array(ts), self.decode(raw))
+                 for ts, raw in self.chunks(start, end)]
+        if not parts:
+            return np.empty(0, np.int64), self.decode(np.empty(0, np.uint16))
+        return (np.concatenate([ts for ts, _ in parts]),
+                np.concatenate([val for _, val in parts]))
+
+    def downsample(self, bucket: int, start: Optional[int] = None,
+                   end: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """Reduce a time range to per-bucket min/max/mean.
+
+           Only one chunk is decoded at a time, so the memory use does not
+           depend on the queried range.
+
+           :param bucket: bucket duration in ns
+           :param start: first timestamp in ns, inclusive; buckets are
+                         aligned on it, or on the epoch if not specified
+           :param end: last timestamp in ns, exclusive
+           :return: arrays of bucket start time, min, max, mean and count;
+                    empty buckets are omitted
+        """
+        if bucket <= 0:
+            raise ValueError('Invalid bucket duration')
+        origin = start or 0
+        ids, mins, maxs, sums, counts = [], [], [], [], []
+        # bucket still open at the end of the previous chunk, as
+        # (id, min, max, sum, count): it may span any number of chunks
+        pending = None
+        for ts, raw in self.chunks(start, end):
+            if not len(ts):
+                continue
+            values = self.decode(raw).astype(np.float64)
+            bid = (ts - origin) // bucket
+            # timestamps are sorted, so are bucket ids
+            edges = np.concatenate(([0], np.flatnonzero(np.diff(bid)) + 1))
+            cids = bid[edges]
+            cmin = np.minimum.reduceat(values, edges)
+            cmax = np.maximum.reduceat(values, edges)
+            csum = np.add.reduceat(values, edges)
+            ccnt = np.diff(np.append(edges, len(values)))
+            if pending is not None:
+                if pending[0] == cids[0]:
+                    cmin[0] = min(cmin[0], pending[1])
+                    cmax[0] = max(cmax[0], pending[2])
+                    csum[0] += pending[3]
+                    ccnt[0] += pending[4]
+                else:
+                    self._append_bucket(pending, ids, mins, maxs, sums,
+                                        counts)
+            pending = (cids[-1], cmin[-1], cmax[-1], csum[-1], ccnt[-1])
+            ids.append(cids[:-1])
+            mins.append(cmin[:-1])
+            maxs.append(cmax[:-1])
+            sums.append(csum[:-1])
+            counts.append(ccnt[:-1])
+        if pending is None:
+            empty = np.empty(0)
+            return {'time': np.empty(0, np.int64), 'min': empty,
+                    'max': empty, 'mean': empty,
+                    'count': np.empty(0, np.int64)}
+        self._append_bucket(pending, ids, mins, maxs, sums, counts)
+        count = np.concatenate(counts)
+        return {'time': np.concatenate(ids) * bucket + origin,
+                'min': np.concatenate(mins),
+                'max': np.concatenate(maxs),
+                'mean': np.concatenate(sums) / count,
+                'count': count}
+
+    @staticmethod
+    def _append_bucket(bucket: tuple, *arrays: list) -> None:
+        for array, value in zip(arrays, bucket):
+            array.append(np.array((value,)))
+
+    def _chunk_files(self, chunk: int) -> Tuple[str, str]:
+        base = joinpath(self._path, f'{chunk:08d}')
+        return f'{base}.ts', f'{base}.raw'
+
+    def _open_chunk(self, chunk: int) -> None:
+        self.flush()
+        if self._chunk is not None and self._sealed:
+            self._sealed()
+        tsfile, rawfile = self._chunk_files(chunk)
+        mode = 'r+' if isfile(tsfile) else 'w+'
+        self._ts = np.memmap(tsfile, dtype=np.int64, mode=mode,
+                             shape=(self._chunk_size,))
+        self._raw = np.memmap(rawfile, dtype=np.uint16, mode=mode,
+                              shape=(self._chunk_size,))
+        self._chunk = chunk
+
+
+class TelemetryStore:
+    """Append-only columnar PMBus telemetry store.
+
+       A store is a directory with a ``meta.json`` index and one
+       sub-directory per column, named after the command and page, e.g.
+       ``read_vout.p3``. Raw words are stored; decoding to engineering units
+       only happens when querying.
+    """
+
+    META = 'meta.json'
+    FORMATS = ('byte', 'word', 'linear11', 'ulinear16', 'slinear16')
+    CHUNK_SIZE = 1 << 20
+
+    def __init__(self, path: str, chunk_size: int = CHUNK_SIZE):
+        self._path = path
+        self._columns: Dict[Tuple[str, int], TelemetryColumn] = {}
+        meta_path = joinpath(path, self.META)
+        if isfile(meta_path):
+            with open(meta_path, 'rt') as mfp:
+                meta = load(mfp)
+            self._chunk_size = meta['chunk_size']
+            for key, info in meta['columns'].items():
+                name, page = key.rsplit('.p', 1)
+                self._columns[(name, int(page))] = TelemetryColumn(
+                    joinpath(path, key), info['format'], info['exponent'],
+                    self._chunk_size, info['count'], self._write_meta)
+        else:
+            if chunk_size <= 0:
+                raise ValueError('Invalid chunk size')
+            makedirs(path, exist_ok=True)
+            self._chunk_size = chunk_size
+            self._write_meta()
+
+    def __enter__(self) -> 'TelemetryStore':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+    @property
+    def columns(self) -> Dict[Tuple[str, int], TelemetryColumn]:
+        """Columns, indexed by (command name, page)."""
+        return dict(self._columns)
+
+    def column(self, name: str, page: int, fmt: Optional[str] = None,
+               exponent: Optional[int] = None) -> TelemetryColumn:
+        """Get or create a column.
+
+           :param name: PMBus command name
+           :param page: PMBus page
+           :param fmt: data format, required to create the column
+           :param exponent: VOUT_MODE exponent of (U|S)LINEAR16 columns
+           :return: column
+        """
+        col = self._columns.get((name, page))
+        if col:
+            if fmt and (fmt != col.format or
+                        (exponent is not None and
+                         exponent != col.exponent)):
+                raise ValueError(f'Column {name}/{page} format mismatch')
+            return col
+        if not fmt:
+            raise KeyError(f'No such column: {name}/{page}')
+        col = TelemetryColumn(joinpath(self._path, f'{name}.p{page}'), fmt,
+                              exponent, self._chunk_size,
+                              sealed=self._write_meta)
+        self._columns[(name, page)] = col
+        self._write_meta()
+        return col
+
+    def append(self, name: str, page: int, raw: int,
+               timestamp: Optional[int] = None) -> None:
+        """Append a raw sample to an existing column."""
+        self.column(name, page).append(raw, timestamp)
+
+    def sample(self, device, names: Iterable[str],
+               page: Optional[int] = None) -> None:
+        """Read raw telemetry words from a device and append them.
+
+           :param device: UCD92xx instance
+           :param names: PMBus command names, of byte or word formats
+           :param page: page to read from, default to the current page
+           :raise ValueError: no page given while the device page is unknown
+        """
+        if page is None:
+            page = device.page
+            if page is None:
+                raise ValueError('Device page is unknown, select a page to '
+                                 'sample')
+        elif page != device.page:
+            device.set_page(page)
+        for name in names:
+            code, fmt, readlen, _, _ = device.command_table[name]
+            if fmt not in self.FORMATS:
+                raise ValueError(f'{name} cannot be stored as telemetry')
+            col = self.column(name, page, fmt,
+                              device.exponent
+                              if fmt in ('ulinear16', 'slinear16')
+                              else None)
+            data = device.read_bytes(code, readlen)
+            col.append(device.bytes2uint(data))
+
+    def flush(self) -> None:
+        """Flush all columns and the store index."""
+        for col in self._columns.values():
+            col.flush()
+        self._write_meta()
+
+    def close(self) -> None:
+        """Flush and release all columns."""
+        for col in self._columns.values():
+            col.close()
+        self._write_meta()
+
+    def _write_meta(self) -> None:
+        meta = {'chunk_size': self._chunk_size,
+                'columns': {f'{name}.p{page}': col.info
+                            for (name, page), col in self._columns.items()}}
+        tmp = joinpath(self._path, f'{self.META}.tmp')
+        with open(tmp, 'wt') as mfp:
+            dump(meta, mfp, indent=2)
+        replace(tmp, joinpath(self._path, self.META))
+
+
+def main():
+    """Entry point."""
+    debug = False
+    try:
+        argparser = ArgumentParser(description=modules[__name__].__doc__)
+        argparser.add_argument('store', help='telemetry store directory')
+        argparser.add_argument('column', nargs='?',
+                               help='column to query, as command.pPAGE')
+        argparser.add_argument('-b', '--bucket', type=float, default=60.0,
+                               help='downsampling bucket, in seconds')
+        argparser.add_argument('-s', '--start', type=float,
+                               help='start time, in seconds since the epoch')
+        argparser.add_argument('-e', '--end', type=float,
+                               help='end time, in seconds since the epoch')
+        argparser.add_argument('-d', '--debug', action='store_true',
+                               help='enable debug mode')
+        args = argparser.parse_args()
+        debug = args.debug
+
+        if not isfile(joinpath(args.store, TelemetryStore.META)):
+            raise ValueError(f'No telemetry store in {args.store}')
+        store = TelemetryStore(args.store)
+        if not args.column:
+            for (name, page), col in sorted(store.columns.items()):
+                print(f'{name}.p{page}: {len(col)} {col.format} samples')
+            return
+        name, page = args.column.rsplit('.p', 1)
+        col = store.column(name, int(page))
+        start = int(args.start * 1E9) if args.start is not None else None
+        end = int(args.end * 1E9) if args.end is not None else None
+        result = col.downsample(int(args.bucket * 1E9), start, end)
+        for row in zip(result['time'], result['min'], result['mean'],
+                       result['max'], result['count']):
+            print('%.3f %g %g %g %d' % (row[0] / 1E9, *row[1:]))
+
+    except (ImportError, IOError, NotImplementedError, ValueError,
+            KeyError) as exc:
+        print('\nError: %s' % exc, file=stderr)
+        if debug:
+            print(format_exc(chain=False), file=stderr)
+        exit(1)
+    except KeyboardInterrupt:
+        exit(2)
+
+
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as exc:
+        print(str(exc), file=stderr)